@@ -0,0 +1,466 @@
+#!/usr/bin/env python
+##WingHeader v1
+###############################################################################
+## File       :  unpyc_bench.py
+## Description:  Benchmark of the UnPyc decompilation pipeline over a generated
+##            :  reproducible corpus of code objects
+## Created_On :  Sun Oct 18 16:40:05 2026
+## Created_By :  agent
+## Modified_On:
+## Modified_By:
+## License    :  GPLv3 (Docs/LICENSE.txt)
+##
+## (c) Copyright 2026, agent all rights reserved.
+###############################################################################
+
+##Each corpus family is run in a fresh interpreter so the peak memory of one
+## family does not hide that of the next. Functions per second and peak memory
+## growth are gathered per pipeline stage via Decompilers/unpyc/timing.py and
+## written as JSON, two such files (e.g. from two checkouts) can then be
+## compared with --compare
+##
+## The corpus is compiled by the Python running the benchmark, so it is only
+## decompiled if the opcode table of the project is for that Python. Rates are
+## over the code objects that decompiled, those that didn't are listed
+##
+## unpyc_bench.py [-o results.json] [-f family,family] [-r repeats] [--any-table]
+## unpyc_bench.py --compare old.json new.json
+
+import os
+import sys
+import imp
+import time
+import glob
+import shutil
+import struct
+import marshal
+import tempfile
+import optparse
+import subprocess
+
+try:
+    from hashlib import sha1
+except ImportError:
+    ##Python 2.4
+    from sha import new as sha1
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+MODULE_LOCATION = os.path.dirname(os.path.abspath(__file__))
+PYRETIC_ROOT    = os.path.dirname(MODULE_LOCATION)
+
+sys.path.insert(0, PYRETIC_ROOT)
+
+##Version of the results format, bumped if the layout of the JSON changes
+RESULTS_VERSION = 2
+
+
+##Generators for the synthetic families, each returns the source of a single
+## function whose size/complexity grows with n. Sources are fixed so the same
+## interpreter always produces the same bytecode
+
+def gen_straight(n):
+    """
+    Straight line function of n statements
+    """
+    lines = ["def straight_%d(a, b):"%(n)]
+    for i in range(n):
+        if i % 3 == 0:
+            lines.append("    x%d = a + %d"%(i, i))
+        elif i % 3 == 1:
+            lines.append("    b.attr%d = x%d * a"%(i, i - 1))
+        else:
+            lines.append("    a = len(b.items) + x%d"%(i - 2))
+    lines.append("    return a")
+    return "\n".join(lines) + "\n"
+
+
+def gen_nested_ifs(n):
+    """
+    Ifs nested n deep, each with an else
+    """
+    lines = ["def nested_ifs_%d(a):"%(n)]
+    for i in range(n):
+        pad = "    " * (i + 1)
+        lines.append("%sif a > %d:"%(pad, i))
+        lines.append("%s    a = a - 1"%(pad))
+    for i in range(n - 1, -1, -1):
+        pad = "    " * (i + 1)
+        lines.append("%selse:"%(pad))
+        lines.append("%s    a = a + %d"%(pad, i))
+    lines.append("    return a")
+    return "\n".join(lines) + "\n"
+
+
+def gen_try_chain(n):
+    """
+    n consecutive try/except blocks with two handlers each
+    """
+    lines = ["def try_chain_%d(a):"%(n)]
+    for i in range(n):
+        lines.append("    try:")
+        lines.append("        a = a.step%d()"%(i))
+        lines.append("    except ValueError:")
+        lines.append("        a = %d"%(i))
+        lines.append("    except (KeyError, IndexError), err:")
+        lines.append("        a = err")
+    lines.append("    return a")
+    return "\n".join(lines) + "\n"
+
+
+def gen_loop_body(n):
+    """
+    A for loop with an n statement body containing conditionals
+    """
+    lines = ["def loop_body_%d(items):"%(n), "    total = 0", "    for x in items:"]
+    for i in range(n):
+        if i % 4 == 0:
+            lines.append("        if x == %d:"%(i))
+            lines.append("            continue")
+        else:
+            lines.append("        total = total + x * %d"%(i))
+    lines.append("    return total")
+    return "\n".join(lines) + "\n"
+
+
+##family name -> (generator, sizes)
+SYNTHETIC = {"straight"   : (gen_straight,   (10, 50, 100, 200, 400)),
+             "nested_ifs" : (gen_nested_ifs, (1, 2, 4, 6, 8)),
+             "try_chain"  : (gen_try_chain,  (1, 2, 4, 8, 16)),
+             "loop_body"  : (gen_loop_body,  (10, 50, 100, 200))}
+
+FAMILIES = ["straight", "nested_ifs", "try_chain", "loop_body", "stdlib"]
+
+
+def build_corpus(family):
+    """
+    Return:
+           list of (name, code object) to decompile for the family
+    """
+    corpus = []
+
+    if family == "stdlib":
+        lib_dir = os.path.join(PYRETIC_ROOT, "Downloaded_Runtimes", "Python-default", "Lib")
+        for path in sorted(glob.glob(os.path.join(lib_dir, "*.py"))):
+            ##Relative filename so the corpus is identical wherever the checkout lives
+            name = "Lib/%s"%(os.path.basename(path))
+            f = open(path, "rU")
+            source = f.read()
+            f.close()
+            corpus.append((name, compile(source, name, "exec")))
+        return corpus
+
+    generator, sizes = SYNTHETIC[family]
+    for n in sizes:
+        name   = "%s_%d"%(family, n)
+        module = compile(generator(n), "%s.py"%(name), "exec")
+        ##Benchmark the function itself rather than the module defining it
+        for const in module.co_consts:
+            if hasattr(const, "co_code"):
+                corpus.append((name, const))
+
+    return corpus
+
+
+def corpus_digest(corpus):
+    """
+    Hash of the corpus bytecode, results are only comparable if these match
+    """
+    h = sha1()
+    for name, co in corpus:
+        h.update(name)
+        h.update(marshal.dumps(co))
+    return h.hexdigest()
+
+
+def _magic_number(magic):
+    """
+    .pyc magic number as an int, None if unknown
+    """
+    if not magic:
+        return None
+    return struct.unpack("<H", magic[:2])[0]
+
+
+def run_family(family, repeats, any_table = False):
+    """
+    Decompile the corpus of a family with stage timing on
+
+    any_table - decompile even if the opcode table is not for this Python
+
+    Return:
+           dict of results for the family, with only a 'refused' reason if
+           the opcode table is not for this Python
+    """
+    import pyREtic
+
+    ##Throwaway project so the standard opcode table is on the path
+    project_root = tempfile.mkdtemp(prefix = "pyretic_bench_")
+    try:
+        pyREtic.pyREtic(write_source = False, project_name = "benchmark",
+                        project_root = project_root, use_cache = False)
+
+        from Decompilers.unpyc import liveUnPYC, disasm, decompile, optable, timing
+
+        ##The corpus is bytecode of this Python, another table misreads it
+        table_magic  = _magic_number(optable.active().magic)
+        python_magic = _magic_number(imp.get_magic())
+        if table_magic != python_magic and not any_table:
+            if table_magic is None:
+                reason = "the opcode table doesn't give its .pyc magic number"
+            else:
+                reason = "the opcode table is for .pyc magic %d"%(table_magic)
+            return {"refused" : "%s, Python %s compiles magic %d"%(reason,
+                                                                  sys.version.split()[0],
+                                                                  python_magic)}
+
+        corpus = build_corpus(family)
+
+        ##Keep the fastest round, the slower ones mostly measure the machine.
+        ## Peak memory only grows in the first round, later ones reuse it
+        best   = None
+        growth = {}
+        for i in range(repeats):
+            timing.reset()
+            timing.enable(memory = True)
+            ##Only the timings of what decompiled are kept, a failure
+            ## usually gives up part way through and would look fast
+            kept    = []
+            failed  = []
+            seconds = 0.0
+            start   = time.time()
+            for name, co in corpus:
+                ##Straight through the pipeline, the cache and the dedupe
+                ## table would turn repeats into lookups
+                timing.begin(name)
+                item_start = time.time()
+                try:
+                    parser = liveUnPYC.CoParser(co)
+                    da     = disasm.Disassembler(parser.co, optimizeJumps = True)
+                    sc     = decompile.Decompiler(da).decompile()
+                    reason = "no source produced"
+                except Exception, err:
+                    sc     = None
+                    reason = "%s: %s"%(err.__class__.__name__, err)
+                item_seconds = time.time() - item_start
+                timing.end()
+                records = timing.take_records()
+                if sc:
+                    seconds += item_seconds
+                    kept    += records
+                else:
+                    failed.append((name, reason))
+            wall = time.time() - start
+            timing.disable()
+            timing.add_records(kept)
+
+            if i == 0:
+                for stage, totals in timing.stage_totals().items():
+                    growth[stage] = totals[2]
+                    
+            if best is None or seconds < best[0]:
+                best = (seconds, wall, failed, timing.record_count(),
+                        timing.stage_totals())
+
+    finally:
+        shutil.rmtree(project_root, True)
+
+    seconds, wall, failed, code_objects, totals = best
+
+    stages = {}
+    for stage, (calls, seconds, unused, stage_cos) in totals.items():
+        if seconds:
+            rate = stage_cos / seconds
+        else:
+            rate = None
+        stages[stage] = {"calls" : calls, "code_objects" : stage_cos,
+                         "seconds" : seconds, "funcs_per_sec" : rate,
+                         "peak_growth_kb" : growth.get(stage, 0)}
+
+    if seconds:
+        rate = code_objects / seconds
+    else:
+        rate = None
+
+    return {"corpus_sha1"  : corpus_digest(corpus),
+            "corpus_size"  : len(corpus),
+            "table_magic"  : table_magic,
+            "python_magic" : python_magic,
+            "repeats"      : repeats,
+            "code_objects" : code_objects,
+            "failed"       : failed,
+            "wall_seconds" : wall,
+            "decompile_seconds" : seconds,
+            "funcs_per_sec": rate,
+            "peak_rss_kb"  : timing.peak_rss(),
+            "stages"       : stages}
+
+
+def _checkout_id():
+    """
+    git revision of the checkout being benchmarked, None if not a git checkout
+    """
+    try:
+        proc = subprocess.Popen(["git", "rev-parse", "--short", "HEAD"],
+                                cwd = PYRETIC_ROOT, stdout = subprocess.PIPE,
+                                stderr = subprocess.PIPE)
+        out = proc.communicate()[0].strip()
+    except OSError:
+        return None
+    if proc.returncode != 0:
+        return None
+    return out
+
+
+def run(families, repeats, output, any_table = False):
+    """
+    Run each family in its own interpreter and write the combined results
+    """
+    results = {"version"  : RESULTS_VERSION,
+               "checkout" : _checkout_id(),
+               "python"   : sys.version.split()[0],
+               "platform" : sys.platform,
+               "date"     : time.strftime("%Y-%m-%d %H:%M:%S"),
+               "families" : {}}
+
+    for family in families:
+        print "[+] Benchmarking %s...."%(family)
+        args = [sys.executable, os.path.abspath(__file__),
+                "--child", family, "-r", str(repeats)]
+        if any_table:
+            args.append("--any-table")
+        proc = subprocess.Popen(args, stdout = subprocess.PIPE)
+        out = proc.communicate()[0]
+        if proc.returncode != 0:
+            print "[-] Benchmark of %s failed"%(family)
+            continue
+
+        res = json.loads(out)
+        if "refused" in res:
+            print "[-] %s not benchmarked, %s. Use --any-table to run it anyway"%(family,
+                                                                               res["refused"])
+            continue
+            
+        results["families"][family] = res
+        if res["table_magic"] != res["python_magic"]:
+            print "[!] %s was decompiled with an opcode table for another Python"%(family)
+        print "[=] %-12s %6d code objects %8s funcs/sec %8d KB peak %d failed"%(
+            family, res["code_objects"], _fmt(res["funcs_per_sec"]), res["peak_rss_kb"],
+            len(res["failed"]))
+        for (name, reason) in res["failed"]:
+            print "[-]     %s : %s"%(name, reason)
+
+    f = open(output, "w")
+    json.dump(results, f, indent = 1, sort_keys = True)
+    f.close()
+    print "[+] Results written to %s"%(output)
+
+
+def _change(old, new):
+
+    if not old or new is None:
+        return "      n/a"
+    return "%+8.1f%%"%(100.0 * (new - old) / old)
+
+
+def compare(old_file, new_file):
+    """
+    Print funcs/sec and peak memory growth of two result files side by side,
+    a positive change in funcs/sec is faster
+    """
+    old = json.load(open(old_file))
+    new = json.load(open(new_file))
+
+    print "[=] old: %s (%s)  new: %s (%s)"%(old_file, old["checkout"], new_file, new["checkout"])
+    if old["version"] != new["version"]:
+        print "[!] Results are in different formats (%d / %d), re-run the older one"%(old["version"],
+                                                                                     new["version"])
+        return
+    if old["python"] != new["python"]:
+        print "[!] Results are from different Python versions (%s / %s)"%(old["python"],
+                                                                         new["python"])
+
+    for family in FAMILIES:
+        if family not in old["families"] or family not in new["families"]:
+            continue
+        o = old["families"][family]
+        n = new["families"][family]
+
+        print
+        print "[=] %s"%(family)
+        if o["corpus_sha1"] != n["corpus_sha1"]:
+            print "[!] Corpus differs between runs, numbers are not comparable"
+        for (label, res) in (("old", o), ("new", n)):
+            if res["table_magic"] != res["python_magic"]:
+                print "[!] %s run used an opcode table for another Python"%(label)
+            if res["failed"]:
+                print "[!] %s run failed to decompile %d of %d, rates are over the rest"%(
+                    label, len(res["failed"]), res["corpus_size"])
+        print "[=] %-24s %12s %12s %9s %10s %10s"%("Stage", "old f/s", "new f/s", "change",
+                                                   "old KB", "new KB")
+        print "[=] %-24s %12s %12s %s %10d %10d"%("(whole pipeline)",
+                                                 _fmt(o["funcs_per_sec"]),
+                                                 _fmt(n["funcs_per_sec"]),
+                                                 _change(o["funcs_per_sec"], n["funcs_per_sec"]),
+                                                 o["peak_rss_kb"], n["peak_rss_kb"])
+        stages = dict.fromkeys(o["stages"].keys() + n["stages"].keys()).keys()
+        stages.sort()
+        for stage in stages:
+            os_ = o["stages"].get(stage, {})
+            ns_ = n["stages"].get(stage, {})
+            print "[=] %-24s %12s %12s %s %10s %10s"%(stage,
+                                                     _fmt(os_.get("funcs_per_sec")),
+                                                     _fmt(ns_.get("funcs_per_sec")),
+                                                     _change(os_.get("funcs_per_sec"),
+                                                             ns_.get("funcs_per_sec")),
+                                                     os_.get("peak_growth_kb", "-"),
+                                                     ns_.get("peak_growth_kb", "-"))
+
+
+def _fmt(rate):
+
+    if rate is None:
+        return "-"
+    return "%.2f"%(rate)
+
+
+if __name__ == "__main__":
+
+    parser = optparse.OptionParser(usage = "%prog [options]\n       %prog --compare old.json new.json")
+    parser.add_option("-o", "--output", default = "unpyc_bench.json",
+                      help = "file to write the JSON results to [default: %default]")
+    parser.add_option("-f", "--families", default = ",".join(FAMILIES),
+                      help = "comma separated corpus families to run [default: %default]")
+    parser.add_option("-r", "--repeats", type = "int", default = 5,
+                      help = "rounds to decompile each corpus, the fastest is kept [default: %default]")
+    parser.add_option("--compare", action = "store_true",
+                      help = "compare two result files")
+    parser.add_option("--any-table", action = "store_true", dest = "any_table",
+                      help = "benchmark even if the opcode table is not for the Python running "
+                             "the benchmark, most of the corpus will fail to decompile")
+    parser.add_option("--child", help = optparse.SUPPRESS_HELP)
+    (options, args) = parser.parse_args()
+
+    if options.compare:
+        if len(args) != 2:
+            parser.error("--compare needs an old and a new results file")
+        compare(args[0], args[1])
+
+    elif options.child:
+        ##Decompiler output goes to stdout, keep it clear for the results
+        results_out = sys.stdout
+        sys.stdout  = open(os.devnull, "w")
+        sys.stderr  = sys.stdout
+        res = run_family(options.child, options.repeats, options.any_table)
+        sys.stdout = results_out
+        print json.dumps(res)
+
+    else:
+        families = [f.strip() for f in options.families.split(",") if f.strip()]
+        for family in families:
+            if family not in FAMILIES:
+                parser.error("unknown family '%s', choose from %s"%(family, ", ".join(FAMILIES)))
+        run(families, options.repeats, options.output, options.any_table)
@@ -79,26 +79,45 @@ class Node:
         '''
         self.value = value
         self.children = children
-        self.counter = 1
 
-    def inc(self):
-        '''Increases the reference counter.'''
+    # True once the node sits on a stack that is handed on to the following
+    # basic blocks. A shared node must not be changed in place, see copy().
+    shared = False
 
-        self.counter += 1
+    def share(self):
+        '''Marks the node as shared between decompilation stacks.'''
 
-    def dec(self):
-        '''Decreases the reference counter.'''
+        self.shared = True
 
-        self.counter -= 1
-        if self.counter < 0:
-            raise TypeError
+    def copy(self):
+        '''
+        Makes an unshared copy of the node, to be changed instead of the node
+        itself. Children are not copied, only the list holding them.
+
+        @return: new node.
+
+        '''
+        from copy import copy
+        o = copy(self)
+        if isinstance(self.children, list):
+            o.children = self.children[:]
+        o.shared = False
+        return o
+
+    def isLastCopy(self, stack):
+        '''
+        Ensures that it is the last copy of this object, i.e. that no slot of
+        the decompilation stack holds it any more. Nodes are shared by the
+        stacks of different basic blocks, so copies are found on the stack
+        rather than counted in the node.
 
-    def isLastCopy(self):
-        '''Ensures that it is the last copy of this object.'''
+        @param stack: stack the node was popped from.
 
-        if self.counter == 0:
-            return True
-        return False
+        '''
+        for x in stack:
+            if x is self:
+                return False
+        return True
 
     def saveTree(self, filename):
         '''
@@ -411,8 +430,17 @@ class BigSliceOp(OpNode):
         return rstr1 + ':' + rstr2 + ':' + rstr3
 
 class CallOp(OpNode):
-    def __init__(self, lchild, rchildren):
+    def __init__(self, lchild, rchildren, co=None):
+        '''
+        @param lchild: function called.
+        @param rchildren: parameters.
+        @param co:
+            code object of the function called when it was made just before
+            the call, as a class body is.
+
+        '''
         OpNode.__init__(self, '<call>', [lchild, rchildren], 13)
+        self.co = co
 
     def __str__(self):
         (lchild, rchildren) = self.children
@@ -583,6 +611,11 @@ class Import(DataNode):
     def addFrom(self, name, asname):
         self.froms.append((name, asname))
 
+    def copy(self):
+        o = DataNode.copy(self)
+        o.froms = self.froms[:]
+        return o
+
 class ImportFrom(DataNode):
     def __init__(self, importobj, name):
         (self.importobj, self.name) = (importobj, name)
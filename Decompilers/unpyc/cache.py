@@ -0,0 +1,437 @@
+#!/usr/bin/python
+
+# [The "BSD licence"]
+# Copyright (c) 2026 agent
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * The name of the author may not be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ''AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL agent BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+'''
+Content addressed on-disk cache of decompiled source code, so unchanged
+code objects are not decompiled again between runs, and an in memory
+equivalent for identical code in one run.
+
+'''
+
+##Entries are keyed by a hash of the marshalled code object plus a hash of the
+## active opcode table, so a changed .pyc or a new remap never gets stale source
+
+import os
+
+try:
+    from hashlib import sha1
+except ImportError:
+    ##Python 2.4
+    from sha import new as sha1
+
+try:
+    import marshal
+    CAN_MARSHAL = True
+except ImportError:
+    ##Some obfuscated runtimes strip marshal out, without it nothing can be keyed
+    CAN_MARSHAL = False
+
+import optable
+import parse
+
+from Decompilers.unpyc import __version__ as UNPYC_VERSION
+
+##Default maximum size of the cache on disk, in bytes
+DEFAULT_MAX_SIZE = 256 * 1024 * 1024
+
+##When the maximum is exceeded evict least recently used entries down to this fraction
+EVICT_TO = 0.9
+
+
+class DecompileCache:
+    """
+    Cache of decompiled source code held in a project directory
+
+    Each entry is a file named by its key, its mtime is refreshed on every hit
+    so size based eviction can throw away the least recently used entries first
+    """
+    def __init__(self, cache_dir, max_size = DEFAULT_MAX_SIZE):
+
+        self.cache_dir = cache_dir
+        self.max_size  = max_size
+
+        ##Total bytes on disk, calculated lazily as a scan of a big cache is slow
+        self.size = None
+
+        self.stats = {"hits" : 0, "misses" : 0, "stores" : 0, "evictions" : 0}
+
+
+    def key(self, code_obj):
+        """
+        Get the cache key for a code object
+
+        Return:
+               key - string, None if the code object cannot be marshalled
+        """
+        if not CAN_MARSHAL:
+            return None
+
+        try:
+            co_digest = sha1(marshal.dumps(code_obj)).hexdigest()
+        except Exception, err:
+            print "[-] Unable to marshal code object for cache key: %s"%(err)
+            return None
+
+        return sha1("%s-%s-%s"%(co_digest, optable.active().digest,
+                                        UNPYC_VERSION)).hexdigest()
+
+
+    def _entry_path(self, key):
+        """
+        Entries are spread over 256 subdirs to keep directory listings small
+        """
+        return os.path.join(self.cache_dir, key[:2], key)
+
+
+    def get(self, key):
+        """
+        Look up the source code stored under a key
+
+        Return:
+               source code - string, None on a miss
+        """
+        if not key:
+            return None
+
+        location = self._entry_path(key)
+        try:
+            f = open(location, "rb")
+            source = f.read()
+            f.close()
+        except IOError:
+            self.stats["misses"] += 1
+            return None
+
+        ##Mark as recently used
+        try:
+            os.utime(location, None)
+        except OSError:
+            pass
+
+        self.stats["hits"] += 1
+        return source
+
+
+    def put(self, key, source):
+        """
+        Store source code under a key, evicting old entries if the cache has
+        grown past its maximum size
+        """
+        if not key or not source:
+            return
+
+        location = self._entry_path(key)
+
+        ##Write to a temp file and rename so that other processes sharing the
+        ## cache never read a half written entry
+        tmp_location = "%s.%d.tmp"%(location, os.getpid())
+        try:
+            if not os.path.isdir(os.path.dirname(location)):
+                os.makedirs(os.path.dirname(location))
+            f = open(tmp_location, "wb")
+            f.write(source)
+            f.close()
+            os.rename(tmp_location, location)
+        except (IOError, OSError), err:
+            print "[-] Problem writing decompilation cache entry %s : %s"%(location, err)
+            return
+
+        self.stats["stores"] += 1
+
+        if self.size is None:
+            self.size = self.disk_usage()[1]
+        else:
+            self.size += len(source)
+
+        if self.size > self.max_size:
+            self.evict()
+
+
+    def _entries(self):
+        """
+        Return:
+               list of (mtime, size, path) for every entry on disk
+        """
+        entries = []
+        if not os.path.isdir(self.cache_dir):
+            return entries
+
+        for (path, dirs, files) in os.walk(self.cache_dir):
+            for f in files:
+                if f.endswith(".tmp"):
+                    continue
+                try:
+                    st = os.stat(os.path.join(path, f))
+                except OSError:
+                    ##Evicted by another process
+                    continue
+                entries.append((st.st_mtime, st.st_size, os.path.join(path, f)))
+
+        return entries
+
+
+    def disk_usage(self):
+        """
+        Return:
+               (number of entries, total bytes) - tuple
+        """
+        entries = self._entries()
+        return (len(entries), sum([e[1] for e in entries]))
+
+
+    def evict(self):
+        """
+        Remove least recently used entries until the cache is back under
+        EVICT_TO of its maximum size
+        """
+        entries = self._entries()
+        entries.sort()
+
+        self.size = sum([e[1] for e in entries])
+        target    = self.max_size * EVICT_TO
+
+        for (mtime, size, location) in entries:
+            if self.size <= target:
+                break
+            try:
+                os.remove(location)
+            except OSError:
+                continue
+            self.size -= size
+            self.stats["evictions"] += 1
+
+
+    def clear(self):
+        """
+        Remove every entry from the cache
+
+        Return:
+               number of entries removed
+        """
+        removed = 0
+        for (mtime, size, location) in self._entries():
+            try:
+                os.remove(location)
+                removed += 1
+            except OSError:
+                pass
+
+        self.size = 0
+        return removed
+
+
+    def take_stats(self):
+        """
+        Return the hit/miss counters gathered since the last call and reset
+        them, used to ship counters from worker processes back to the parent
+        """
+        stats = self.stats
+        self.stats = dict([(k, 0) for k in stats.keys()])
+        return stats
+
+
+    def add_stats(self, stats):
+        """
+        Fold counters taken from another DecompileCache into this one
+        """
+        for k, v in stats.items():
+            self.stats[k] = self.stats.get(k, 0) + v
+
+
+    def display_stats(self):
+        """
+        Print cache usage to stdout
+        """
+        entries, size = self.disk_usage()
+        lookups = self.stats["hits"] + self.stats["misses"]
+        if lookups:
+            hit_rate = 100.0 * self.stats["hits"] / lookups
+        else:
+            hit_rate = 0.0
+
+        print "[=] Decompilation cache:    %s"%(self.cache_dir)
+        print "[=] Entries on disk:        %d"%(entries)
+        print "[=] Size on disk:           %.2f MB of %.2f MB"%(size / 1048576.0,
+                                                              self.max_size / 1048576.0)
+        print "[=] Hits this session:      %d (%.1f%%)"%(self.stats["hits"], hit_rate)
+        print "[=] Misses this session:    %d"%(self.stats["misses"])
+        print "[=] Stored this session:    %d"%(self.stats["stores"])
+        print "[=] Evicted this session:   %d"%(self.stats["evictions"])
+
+
+class SeenCode:
+    """
+    In memory record of the code objects decompiled during a single run, so
+    copies of the same function vendored into many modules are decompiled once
+
+    Code objects are treated as identical when their bytecode, constants,
+    names and variable names match (plus the few other fields such as
+    argcount that change the decompiled source), wherever they were found
+
+    Source is held with the (name, reason) of the code objects that ran out of
+    structuring budget producing it, so every copy is reported as timed out
+
+    Until its source is stored the decompiler also keeps the basic blocks of a
+    code object here, so decompiling it again does not redo them
+    """
+    def __init__(self):
+
+        ##key : (source code, [(name, reason), ...])
+        self.results = {}
+
+        ##key : {basic block : what decompiling it left}, see kept_blocks
+        self.blocks = {}
+
+        ##Decompilations skipped since the last take_saved()
+        self.saved = 0
+
+        ##Keys of source decompiled ahead of time in other processes, see
+        ## prefill, whose first lookup saves nothing
+        self.prefilled = set()
+
+
+    def _const_key(self, const):
+        """
+        Form of a parsed constant to digest, nested code objects by their own
+        digest
+        """
+        if const is None:
+            ##A constant of a type CoParser could not represent
+            raise ValueError("unknown constant")
+
+        if isinstance(const, parse.pyCode):
+            return self._code_key(const)
+
+        elif isinstance(const, parse.pyTuple):
+            return (const.__class__.__name__,
+                    tuple([self._const_key(c) for c in const.value]))
+
+        return (const.__class__.__name__, const.value)
+
+
+    def _code_key(self, co):
+        """
+        sha1 digest of the fields of a code object that make up its source, so
+        an entry doesn't hold a second copy of the bytecode of everything seen
+
+        Kept on the code object, it is asked for again by every code object it
+        is nested in and by the decompiler
+        """
+        if hasattr(co, "seen_digest"):
+            return co.seen_digest
+
+        fields = (tuple([self._const_key(c) for c in co.consts.value]),
+                  tuple([n.value for n in co.names.value]),
+                  tuple([v.value for v in co.varnames.value]),
+                  tuple([v.value for v in co.freevars.value]),
+                  tuple([v.value for v in co.cellvars.value]),
+                  co.argcount.value, co.flags.value, co.name.value)
+
+        digest = sha1("%d:"%(len(co.code.value)))
+        digest.update(co.code.value)
+        digest.update(repr(fields))
+        co.seen_digest = digest.digest()
+        return co.seen_digest
+
+
+    def key(self, co, offset = 0):
+        """
+        Get the key for a parsed (parse.pyCode) code object decompiled from
+        the given offset with the active opcode table
+
+        Return:
+               key - (offset, opcode table generation, digest) tuple, None if
+               the code object cannot be compared safely
+        """
+        try:
+            return (offset, optable.active().generation, self._code_key(co))
+        except ValueError:
+            return None
+
+
+    def lookup(self, key):
+        """
+        Return:
+               (found, source code, timed out) - tuple, source code is
+               unindented, timed out the (name, reason) of the code objects
+               that ran out of budget producing it, to be reported again
+        """
+        if key is not None and key in self.results:
+            if key in self.prefilled:
+                self.prefilled.remove(key)
+            else:
+                self.saved += 1
+            source, timed_out = self.results[key]
+            return (True, source, list(timed_out))
+
+        return (False, None, [])
+
+
+    def known(self, key):
+        """
+        Return:
+               True if source for the key is already held
+        """
+        return key is not None and key in self.results
+
+
+    def kept_blocks(self, key):
+        """
+        Return:
+               dict of the decompiled basic blocks of a code object, empty the
+               first time it is decompiled
+        """
+        return self.blocks.setdefault(key, {})
+
+
+    def store(self, key, source, timed_out = ()):
+
+        if key is not None:
+            self.results[key] = (source, list(timed_out))
+            ##Copies are now given the source, the blocks are not needed again
+            self.blocks.pop(key, None)
+
+
+    def prefill(self, key, source, timed_out = ()):
+        """
+        Store source decompiled by another process before the decompiler
+        gets to it, the decompiler then finds it at the right place as if it
+        had decompiled it itself
+        """
+        if key is not None and key not in self.results:
+            self.results[key] = (source, list(timed_out))
+            self.prefilled.add(key)
+
+
+    def take_saved(self):
+        """
+        Return the number of decompilations saved since the last call and reset
+        it, used to attribute savings to each file of a run
+        """
+        saved = self.saved
+        self.saved = 0
+        return saved
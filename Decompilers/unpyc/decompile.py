@@ -46,10 +46,10 @@ Core functions for decompiling basic blocks.
 import sys
 import traceback
 
-from opcodes import cmp_op
 import parse
 import disasm
 import structure
+import timing
 
 from ast import *
 from text import d_indentText as indentText, \
@@ -59,38 +59,183 @@ def dbgprint(s):
     #print >> sys.stderr, s
     pass
 
-# TODO: defined new stack... not to call dec() after each pop()
+def signature(nodes):
+    '''
+    Shape of a decompilation stack, the type and arity of each node on it.
+
+    @param nodes: stack, or postponed stores.
+
+    @return: tuple usable as a dict key, holding no nodes.
+
+    '''
+    r = []
+    for x in nodes:
+        if isinstance(x, tuple):
+            r.append(signature(x))
+        elif isinstance(getattr(x, 'children', None), list):
+            r.append((x.__class__, len(x.children)))
+        else:
+            r.append((x.__class__, 0))
+    return tuple(r)
+
+def unshare(stack, index):
+    '''
+    Makes the node at stack[index] safe to change in place. A shared node is
+    replaced by a copy in every slot of the stack that holds it, so values
+    DUP_TOPed before the block started still refer to one node.
+
+    @param stack: decompilation stack.
+    @param index: index of the node on the stack.
+
+    @return: node now at stack[index].
+
+    '''
+    o = stack[index]
+    if o.shared:
+        c = o.copy()
+        for i in xrange(len(stack)):
+            if stack[i] is o:
+                stack[i] = c
+        o = c
+    return o
 
 class Decompiler:
     '''Decompiler itself.'''
 
-    def __init__(self, disassembler, debugDraw=False):
+    # mnemonics of the commands that have an action, the action of 'X'
+    # is the method _X, 'SLICE+1' is _SLICE_1 and so on
+    actionMnemonics = (
+        'STOP_CODE', 'POP_TOP', 'ROT_TWO', 'ROT_THREE', 'DUP_TOP', 'ROT_FOUR',
+        'NOP', 'UNARY_POSITIVE', 'UNARY_NEGATIVE', 'UNARY_NOT',
+        'UNARY_CONVERT', 'UNARY_INVERT', 'LIST_APPEND', 'BINARY_POWER',
+        'BINARY_MULTIPLY', 'BINARY_DIVIDE', 'BINARY_MODULO', 'BINARY_ADD',
+        'BINARY_SUBTRACT', 'BINARY_SUBSCR', 'BINARY_FLOOR_DIVIDE',
+        'BINARY_TRUE_DIVIDE', 'INPLACE_FLOOR_DIVIDE', 'INPLACE_TRUE_DIVIDE',
+        'SLICE', 'SLICE+1', 'SLICE+2', 'SLICE+3', 'STORE_SLICE',
+        'STORE_SLICE+1', 'STORE_SLICE+2', 'STORE_SLICE+3', 'DELETE_SLICE',
+        'DELETE_SLICE+1', 'DELETE_SLICE+2', 'DELETE_SLICE+3', 'STORE_MAP',
+        'INPLACE_ADD', 'INPLACE_SUBTRACT', 'INPLACE_MULTIPLY',
+        'INPLACE_DIVIDE', 'INPLACE_MODULO', 'STORE_SUBSCR', 'DELETE_SUBSCR',
+        'BINARY_LSHIFT', 'BINARY_RSHIFT', 'BINARY_AND', 'BINARY_XOR',
+        'BINARY_OR', 'INPLACE_POWER', 'GET_ITER', 'PRINT_EXPR', 'PRINT_ITEM',
+        'PRINT_NEWLINE', 'PRINT_ITEM_TO', 'PRINT_NEWLINE_TO',
+        'INPLACE_LSHIFT', 'INPLACE_RSHIFT', 'INPLACE_AND', 'INPLACE_XOR',
+        'INPLACE_OR', 'BREAK_LOOP', 'WITH_CLEANUP', 'LOAD_LOCALS',
+        'RETURN_VALUE', 'IMPORT_STAR', 'EXEC_STMT', 'YIELD_VALUE',
+        'POP_BLOCK', 'END_FINALLY', 'BUILD_CLASS', 'STORE_NAME',
+        'DELETE_NAME', 'UNPACK_SEQUENCE', 'FOR_ITER', 'STORE_ATTR',
+        'DELETE_ATTR', 'STORE_GLOBAL', 'DELETE_GLOBAL', 'DUP_TOPX',
+        'LOAD_CONST', 'LOAD_NAME', 'BUILD_TUPLE', 'BUILD_LIST', 'BUILD_MAP',
+        'LOAD_ATTR', 'COMPARE_OP', 'IMPORT_NAME', 'IMPORT_FROM',
+        'JUMP_FORWARD', 'JUMP_IF_FALSE', 'JUMP_IF_TRUE', 'JUMP_ABSOLUTE',
+        'LOAD_GLOBAL', 'CONTINUE_LOOP', 'SETUP_LOOP', 'SETUP_EXCEPT',
+        'SETUP_FINALLY', 'LOAD_FAST', 'STORE_FAST', 'DELETE_FAST',
+        'RAISE_VARARGS', 'CALL_FUNCTION', 'MAKE_FUNCTION', 'BUILD_SLICE',
+        'MAKE_CLOSURE', 'LOAD_CLOSURE', 'LOAD_DEREF', 'STORE_DEREF',
+        'CALL_FUNCTION_VAR', 'CALL_FUNCTION_KW', 'CALL_FUNCTION_VAR_KW',
+        'EXTENDED_ARG')
+
+    # mnemonics -> action function, made once per class by getDispatch
+    dispatch = None
+
+    def __init__(self, disassembler, debugDraw=False, seen=None, budget=None):
         '''
         @param disassembler:
             L{Disassembler} to get command list, code blocks and such.
         @param debugDraw:
             if true, intermediate CFGs are saved. See L{structure}
             for more details.
+        @param seen:
+            L{cache.SeenCode} shared by all decompilations of a run, nested
+            code objects identical to one already decompiled are reused.
+            None to always decompile.
+        @param budget:
+            L{structure.Budget} limiting the time/steps spent structuring
+            the CFG of each code object, when exceeded the unstructured
+            basic blocks are output. None for no limit.
 
         '''
         self.disassembler = disassembler
         self.debugDraw = debugDraw
+        self.seen = seen
+        self.budget = budget
+        # (name, reason) of the code objects, this one or nested ones, that
+        # ran out of budget while decompiling it, its source is incomplete
+        self.timedOut = []
         self.co = disassembler.co
         self.postponedStores = []
+        # decompiled basic blocks of this code object, see codeDecompile
+        self.blocks = None
+        # blocks taken from an earlier decompilation of the code object
+        self.keptBlocks = 0
+        # code objects in co_consts by name, see getCoIndex
+        self.coIndex = None
         
         #RICH TEMP
         self.richy_count = 0
 
+    def getCoIndex(self):
+        '''
+        Indexes the code objects in co_consts by name, once per code object.
+
+        @return:
+            {name: [code objects with that name, in co_consts order]}.
+
+        '''
+        if self.coIndex is None:
+            self.coIndex = {}
+            for x in self.co.consts.value:
+                if isinstance(x, parse.pyCode):
+                    self.coIndex.setdefault(x.name.value, []).append(x)
+        return self.coIndex
+
     def findCoByName(self, name):
         '''
-        @return: code object with a given name.
+        @return:
+            code object with a given name, the first one if several have
+            it. A class body is found exactly through the L{CallOp} that
+            ran it instead.
 
         '''
-        for x in self.co.consts.value:
-            if isinstance(x, parse.pyCode) and x.name.value == name:
-                return x
+        cos = self.getCoIndex().get(name)
+        if cos:
+            return cos[0]
         return None
 
+    def decompileNested(self, co, offset, startIndent):
+        '''
+        Decompile a function or class body defined in this code object.
+
+        @param co: nested code object.
+        @param offset: offset to start decompilation from.
+        @param startIndent: indent of the generated source code.
+        @return: source code, None on failure.
+
+        '''
+        key = None
+        if self.seen is not None:
+            key = self.seen.key(co, offset)
+            found, x, timedOut = self.seen.lookup(key)
+            if found:
+                # a copy of what ran out of budget is just as incomplete
+                if self.budget is not None:
+                    self.budget.timedOut += timedOut
+                self.timedOut += timedOut
+                if x is None: return None
+                return indentText(x, startIndent)
+        timing.begin(co.name.value)
+        try:
+            da = disasm.Disassembler(co, optimizeJumps=True)
+            d = Decompiler(da, seen=self.seen, budget=self.budget)
+            x = d.decompile(offset=offset)
+        finally:
+            timing.end()
+        self.timedOut += d.timedOut
+        if self.seen is not None:
+            self.seen.store(key, x, d.timedOut)
+        if x is None: return None
+        return indentText(x, startIndent)
+
     @staticmethod
     def checkStack(stack, depth):
         '''
@@ -99,10 +244,14 @@ class Decompiler:
             ignored.
 
         '''
+        # counted from the top and given up on as soon as there are more
+        # entries than depth, so a deep expression stack is not walked
         counter = 0
-        for x in stack:
+        for x in reversed(stack):
             if not isinstance(x, DummyEx):
                 counter += 1
+                if counter > depth:
+                    return False
         return counter == depth
 
     def STORE(self, lvalue, rvalue, curIndent, emptystack):
@@ -120,8 +269,7 @@ class Decompiler:
             r += ind(curIndent) + 'def ' + lvalue + '('
             r += rvalue.getParams()
             r += '):\n'
-            da = disasm.Disassembler(rvalue.value, optimizeJumps=True)
-            x = Decompiler(da).decompile(startIndent=curIndent+1)
+            x = self.decompileNested(rvalue.value, 0, curIndent+1)
             #FixMe
             if x != None:
                 if x in ('', '\n'): x = ind(curIndent + 1) + 'pass\n'
@@ -131,10 +279,12 @@ class Decompiler:
             r += ', '.join(x.value for x in rvalue.baseclasses.value)
             r += '):\n'
             # offset=6 to avoid __module__ = __name__ duplication
-            co = self.findCoByName(rvalue.classname.value)
-            da = disasm.Disassembler(co, optimizeJumps=True)
-            dc = Decompiler(da)
-            x = dc.decompile(offset=6, startIndent=curIndent+1)
+            if isinstance(rvalue.methods, CallOp) and \
+               rvalue.methods.co is not None:
+                co = rvalue.methods.co
+            else:
+                co = self.findCoByName(rvalue.classname.value)
+            x = self.decompileNested(co, 6, curIndent+1)
             #FixMe
             if x != None:
                 x += '\n'
@@ -200,8 +350,7 @@ class Decompiler:
         except IndexError, err:
             print "XXXX: pop from empty stack caught _POP_TOP, returning: ",r
             return r
-        o.dec()
-        if o.isLastCopy():
+        if o.isLastCopy(stack):
             if isinstance(o, Import):
                 level = '.' * o.level.value
                 a = []
@@ -229,7 +378,6 @@ class Decompiler:
 
     def _DUP_TOP(self, cmd, prevcmd, nextcmd, stack, curIndent):
         stack.append(stack[-1])
-        stack[-1].inc()
 
     def _ROT_FOUR(self, cmd, prevcmd, nextcmd, stack, curIndent):
         (stack[-1], stack[-2], stack[-3], stack[-4]) = \
@@ -263,52 +411,52 @@ class Decompiler:
 
     def _BINARY_POWER(self, cmd, prevcmd, nextcmd, stack, curIndent):
         stack[-2] = ExponentiationOp(stack[-2], stack[-1])
-        stack.pop().dec()
+        stack.pop()
 
     def _BINARY_MULTIPLY(self, cmd, prevcmd, nextcmd, stack, curIndent):
         stack[-2] = MultiplicationOp(stack[-2], stack[-1])
-        stack.pop().dec()
+        stack.pop()
 
     def _BINARY_DIVIDE(self, cmd, prevcmd, nextcmd, stack, curIndent):
         stack[-2] = DivisionOp(stack[-2], stack[-1])
-        stack.pop().dec()
+        stack.pop()
 
     def _BINARY_MODULO(self, cmd, prevcmd, nextcmd, stack, curIndent):
         stack[-2] = RemainderOp(stack[-2], stack[-1])
-        stack.pop().dec()
+        stack.pop()
 
     def _BINARY_ADD(self, cmd, prevcmd, nextcmd, stack, curIndent):
         stack[-2] = AdditionOp(stack[-2], stack[-1])
-        stack.pop().dec()
+        stack.pop()
 
     def _BINARY_SUBTRACT(self, cmd, prevcmd, nextcmd, stack, curIndent):
         stack[-2] = SubtractionOp(stack[-2], stack[-1])
-        stack.pop().dec()
+        stack.pop()
 
     def _BINARY_SUBSCR(self, cmd, prevcmd, nextcmd, stack, curIndent):
         stack[-2] = SubscriptionOp(stack[-2], stack[-1])
-        stack.pop().dec()
+        stack.pop()
 
     def _BINARY_FLOOR_DIVIDE(self, cmd, prevcmd, nextcmd, stack, curIndent):
         stack[-2] = FloorDivisionOp(stack[-2], stack[-1])
-        stack.pop().dec()
+        stack.pop()
 
     def _BINARY_TRUE_DIVIDE(self, cmd, prevcmd, nextcmd, stack, curIndent):
         r = ind(curIndent) + '# from __future__ import division\n' + \
             ind(curIndent) + '# CAUTION! future division detected!\n'
         stack[-2] = DivisionOp(stack[-2], stack[-1])
-        stack.pop().dec()
+        stack.pop()
         return r
 
     def _INPLACE_FLOOR_DIVIDE(self, cmd, prevcmd, nextcmd, stack, curIndent):
         stack[-2] = InplaceFloorDivisionOp(stack[-2], stack[-1])
-        stack.pop().dec()
+        stack.pop()
 
     def _INPLACE_TRUE_DIVIDE(self, cmd, prevcmd, nextcmd, stack, curIndent):
         r = ind(curIndent) + '# from __future__ import division\n' + \
             ind(curIndent) + '# CAUTION! future division detected!\n'
         stack[-2] = InplaceDivisionOp(stack[-2], stack[-1])
-        stack.pop().dec()
+        stack.pop()
         return r
 
     def _SLICE(self, cmd, prevcmd, nextcmd, stack, curIndent):
@@ -316,147 +464,147 @@ class Decompiler:
 
     def _SLICE_1(self, cmd, prevcmd, nextcmd, stack, curIndent):
         stack[-2] = Slice1Op(stack[-2], stack[-1])
-        stack.pop().dec()
+        stack.pop()
 
     def _SLICE_2(self, cmd, prevcmd, nextcmd, stack, curIndent):
         stack[-2] = Slice2Op(stack[-2], stack[-1])
-        stack.pop().dec()
+        stack.pop()
 
     def _SLICE_3(self, cmd, prevcmd, nextcmd, stack, curIndent):
         stack[-3] = Slice3Op(stack[-3], stack[-2], stack[-1])
-        stack.pop().dec()
-        stack.pop().dec()
+        stack.pop()
+        stack.pop()
 
     def _STORE_SLICE(self, cmd, prevcmd, nextcmd, stack, curIndent):
         e = SliceOp(stack[-1])
         emptyStack = self.checkStack(stack, 2)
         r = self.STORE(e, stack[-2], curIndent, emptyStack)
-        stack.pop().dec()
-        stack.pop().dec()
+        stack.pop()
+        stack.pop()
         return r
 
     def _STORE_SLICE_1(self, cmd, prevcmd, nextcmd, stack, curIndent):
         e = Slice1Op(stack[-2], stack[-1])
         r = self.STORE(e, stack[-3], curIndent, self.checkStack(stack, 3))
-        stack.pop().dec()
-        stack.pop().dec()
-        stack.pop().dec()
+        stack.pop()
+        stack.pop()
+        stack.pop()
         return r
 
     def _STORE_SLICE_2(self, cmd, prevcmd, nextcmd, stack, curIndent):
         e = Slice2Op(stack[-2], stack[-1])
         r = self.STORE(e, stack[-3], curIndent, self.checkStack(stack, 3))
-        stack.pop().dec()
-        stack.pop().dec()
-        stack.pop().dec()
+        stack.pop()
+        stack.pop()
+        stack.pop()
         return r
 
     def _STORE_SLICE_3(self, cmd, prevcmd, nextcmd, stack, curIndent):
         e = Slice3Op(stack[-3], stack[-2], stack[-1])
         r = self.STORE(e, stack[-4], curIndent, self.checkStack(stack, 4))
-        stack.pop().dec()
-        stack.pop().dec()
-        stack.pop().dec()
-        stack.pop().dec()
+        stack.pop()
+        stack.pop()
+        stack.pop()
+        stack.pop()
         return r
 
     def _DELETE_SLICE(self, cmd, prevcmd, nextcmd, stack, curIndent):
         r = ind(curIndent) + 'del ' + str(SliceOp(stack[-1])) + '\n'
-        stack.pop().dec()
+        stack.pop()
         return r
 
     def _DELETE_SLICE_1(self, cmd, prevcmd, nextcmd, stack, curIndent):
         r = ind(curIndent) + 'del ' + \
             str(Slice1Op(stack[-2], stack[-1])) + '\n'
-        stack.pop().dec()
-        stack.pop().dec()
+        stack.pop()
+        stack.pop()
         return r
 
     def _DELETE_SLICE_2(self, cmd, prevcmd, nextcmd, stack, curIndent):
         r = ind(curIndent) + 'del ' + \
             str(Slice2Op(stack[-2], stack[-1])) + '\n'
-        stack.pop().dec()
-        stack.pop().dec()
+        stack.pop()
+        stack.pop()
         return r
 
     def _DELETE_SLICE_3(self, cmd, prevcmd, nextcmd, stack, curIndent):
         r = ind(curIndent) + 'del ' + \
             str(Slice3Op(stack[-3], stack[-2], stack[-1])) + '\n'
-        stack.pop().dec()
-        stack.pop().dec()
-        stack.pop().dec()
+        stack.pop()
+        stack.pop()
+        stack.pop()
         return r
 
     def _STORE_MAP(self, cmd, prevcmd, nextcmd, stack, curIndent):
-        stack[-3].addPair(stack[-1], stack[-2])
-        stack.pop().dec()
-        stack.pop().dec()
+        unshare(stack, -3).addPair(stack[-1], stack[-2])
+        stack.pop()
+        stack.pop()
 
     def _INPLACE_ADD(self, cmd, prevcmd, nextcmd, stack, curIndent):
         stack[-2] = InplaceAdditionOp(stack[-2], stack[-1])
-        stack.pop().dec()
+        stack.pop()
 
     def _INPLACE_SUBTRACT(self, cmd, prevcmd, nextcmd, stack, curIndent):
         stack[-2] = InplaceSubtractionOp(stack[-2], stack[-1])
-        stack.pop().dec()
+        stack.pop()
 
     def _INPLACE_MULTIPLY(self, cmd, prevcmd, nextcmd, stack, curIndent):
         stack[-2] = InplaceMultiplicationOp(stack[-2], stack[-1])
-        stack.pop().dec()
+        stack.pop()
 
     def _INPLACE_DIVIDE(self, cmd, prevcmd, nextcmd, stack, curIndent):
         stack[-2] = InplaceDivisionOp(stack[-2], stack[-1])
-        stack.pop().dec()
+        stack.pop()
 
     def _INPLACE_MODULO(self, cmd, prevcmd, nextcmd, stack, curIndent):
         stack[-2] = InplaceRemainderOp(stack[-2], stack[-1])
-        stack.pop().dec()
+        stack.pop()
 
     def _STORE_SUBSCR(self, cmd, prevcmd, nextcmd, stack, curIndent):
         r = ''
         if isinstance(stack[-2], NewHash):
-            stack[-2].addPair(stack[-1], stack[-3])
+            unshare(stack, -2).addPair(stack[-1], stack[-3])
             #stack[-2].value[stack[-1]] = stack[-3]
             #stack[-2].order.append(stack[-1])
         else:
             e = SubscriptionOp(stack[-2], stack[-1])
             emptyStack = self.checkStack(stack, 3)
             r += self.STORE(e, stack[-3], curIndent, emptyStack)
-        stack.pop().dec()
-        stack.pop().dec()
-        stack.pop().dec()
+        stack.pop()
+        stack.pop()
+        stack.pop()
         return r
 
     def _DELETE_SUBSCR(self, cmd, prevcmd, nextcmd, stack, curIndent):
         r = ind(curIndent) + 'del ' + \
             str(SubscriptionOp(stack[-2], stack[-1])) + '\n'
-        stack.pop().dec()
-        stack.pop().dec()
+        stack.pop()
+        stack.pop()
         return r
 
     def _BINARY_LSHIFT(self, cmd, prevcmd, nextcmd, stack, curIndent):
         stack[-2] = LShiftOp(stack[-2], stack[-1])
-        stack.pop().dec()
+        stack.pop()
 
     def _BINARY_RSHIFT(self, cmd, prevcmd, nextcmd, stack, curIndent):
         stack[-2] = RShiftOp(stack[-2], stack[-1])
-        stack.pop().dec()
+        stack.pop()
 
     def _BINARY_AND(self, cmd, prevcmd, nextcmd, stack, curIndent):
         stack[-2] = BitwiseANDOp(stack[-2], stack[-1])
-        stack.pop().dec()
+        stack.pop()
 
     def _BINARY_XOR(self, cmd, prevcmd, nextcmd, stack, curIndent):
         stack[-2] = BitwiseXOROp(stack[-2], stack[-1])
-        stack.pop().dec()
+        stack.pop()
 
     def _BINARY_OR(self, cmd, prevcmd, nextcmd, stack, curIndent):
         stack[-2] = BitwiseOROp(stack[-2], stack[-1])
-        stack.pop().dec()
+        stack.pop()
 
     def _INPLACE_POWER(self, cmd, prevcmd, nextcmd, stack, curIndent):
         stack[-2] = InplaceExponentiationOp(stack[-2], stack[-1])
-        stack.pop().dec()
+        stack.pop()
 
     def _GET_ITER(self, cmd, prevcmd, nextcmd, stack, curIndent):
         stack[-1] = Iterator(stack[-1])
@@ -471,7 +619,7 @@ class Decompiler:
             r += ind(curIndent) + 'print ' + str(stack[-1]) + '\n'
         else:
             r += ind(curIndent) + 'print ' + str(stack[-1]) + ',\n'
-        stack.pop().dec()
+        stack.pop()
         return r
 
     def _PRINT_NEWLINE(self, cmd, prevcmd, nextcmd, stack, curIndent):
@@ -488,36 +636,36 @@ class Decompiler:
         else:
             r += ind(curIndent) + 'print >> ' + \
                  str(stack[-1]) + ', ' + str(stack[-2]) + ',\n'
-        stack.pop().dec()
-        stack.pop().dec()
+        stack.pop()
+        stack.pop()
         return r
 
     def _PRINT_NEWLINE_TO(self, cmd, prevcmd, nextcmd, stack, curIndent):
         r = ''
         if prevcmd is None or prevcmd.mnemonics != 'PRINT_ITEM_TO':
             r += ind(curIndent) + 'print >> ' + str(stack[-1]) + '\n'
-        stack.pop().dec()
+        stack.pop()
         return r
 
     def _INPLACE_LSHIFT(self, cmd, prevcmd, nextcmd, stack, curIndent):
         stack[-2] = InplaceLShiftOp(stack[-2], stack[-1])
-        stack.pop().dec()
+        stack.pop()
 
     def _INPLACE_RSHIFT(self, cmd, prevcmd, nextcmd, stack, curIndent):
         stack[-2] = InplaceRShiftOp(stack[-2], stack[-1])
-        stack.pop().dec()
+        stack.pop()
 
     def _INPLACE_AND(self, cmd, prevcmd, nextcmd, stack, curIndent):
         stack[-2] = InplaceBitwiseANDOp(stack[-2], stack[-1])
-        stack.pop().dec()
+        stack.pop()
 
     def _INPLACE_XOR(self, cmd, prevcmd, nextcmd, stack, curIndent):
         stack[-2] = InplaceBitwiseXOROp(stack[-2], stack[-1])
-        stack.pop().dec()
+        stack.pop()
 
     def _INPLACE_OR(self, cmd, prevcmd, nextcmd, stack, curIndent):
         stack[-2] = InplaceBitwiseOROp(stack[-2], stack[-1])
-        stack.pop().dec()
+        stack.pop()
 
     def _BREAK_LOOP(self, cmd, prevcmd, nextcmd, stack, curIndent):
         # TODO: recheck BREAK_LOOP
@@ -537,7 +685,6 @@ class Decompiler:
         except IndexError, err:
             print "XXXX: pop from empty stack caught, returning: ",r
             return r
-        o.dec()
         noneInNames = False
         for x in self.co.names.value:
             if x.value == 'None':
@@ -552,7 +699,7 @@ class Decompiler:
 
     def _IMPORT_STAR(self, cmd, prevcmd, nextcmd, stack, curIndent):
         r = ind(curIndent) + 'from ' + stack[-1].module + ' import *\n'
-        stack.pop().dec()
+        stack.pop()
         return r
 
     def _EXEC_STMT(self, cmd, prevcmd, nextcmd, stack, curIndent):
@@ -566,9 +713,9 @@ class Decompiler:
         else:
             r += ind(curIndent) + 'exec ' + str(stack[-3]) + \
                  ' in ' + str(stack[-2]) + ', ' + str(stack[-1]) + '\n'
-        stack.pop().dec()
-        stack.pop().dec()
-        stack.pop().dec()
+        stack.pop()
+        stack.pop()
+        stack.pop()
         return r
 
     def _YIELD_VALUE(self, cmd, prevcmd, nextcmd, stack, curIndent):
@@ -587,11 +734,8 @@ class Decompiler:
 
     def _BUILD_CLASS(self, cmd, prevcmd, nextcmd, stack, curIndent):
         methods = stack.pop()
-        methods.dec()
         baseclasses = stack.pop()
-        baseclasses.dec()
         classname = stack.pop()
-        classname.dec()
         stack.append(NewClass(classname, baseclasses, methods))
 
     def _STORE_NAME(self, cmd, prevcmd, nextcmd, stack, curIndent):
@@ -599,7 +743,7 @@ class Decompiler:
         lvalue = self.co.names.value[cmd.argument].value
         emptyStack = self.checkStack(stack, 1)
         r = self.STORE(lvalue, stack[-1], curIndent, emptyStack)
-        stack.pop().dec()
+        stack.pop()
         return r
 
     def _DELETE_NAME(self, cmd, prevcmd, nextcmd, stack, curIndent):
@@ -621,15 +765,15 @@ class Decompiler:
         v = Variable(self.co.names.value[cmd.argument].value)
         e = AttributeOp(stack[-1], v)
         r = self.STORE(e, stack[-2], curIndent, self.checkStack(stack, 2))
-        stack.pop().dec()
-        stack.pop().dec()
+        stack.pop()
+        stack.pop()
         return r
 
     def _DELETE_ATTR(self, cmd, prevcmd, nextcmd, stack, curIndent):
         v = Variable(self.co.names.value[cmd.argument].value)
         stack[-1] = AttributeOp(stack[-1], v)
         r = ind(curIndent) + 'del ' + str(stack[-1]) + '\n'
-        stack.pop().dec()
+        stack.pop()
         return r
 
     def _STORE_GLOBAL(self, cmd, prevcmd, nextcmd, stack, curIndent):
@@ -644,8 +788,6 @@ class Decompiler:
         # TODO: DUP_TOPX
         if cmd.argument > 0:
             stack.extend(stack[-cmd.argument:])
-        for x in stack[-cmd.argument:]:
-            x.inc()
 
     def _LOAD_CONST(self, cmd, prevcmd, nextcmd, stack, curIndent):
         #print self.co
@@ -680,7 +822,6 @@ class Decompiler:
         lst = []
         for z in range(cmd.argument):
             o = stack.pop()
-            o.dec()
             lst.insert(0, o)
         stack.append(NewTuple(tuple(lst)))
 
@@ -688,7 +829,6 @@ class Decompiler:
         lst = []
         for z in range(cmd.argument):
             o = stack.pop()
-            o.dec()
             lst.insert(0, o)
         stack.append(NewList(lst))
 
@@ -702,21 +842,20 @@ class Decompiler:
             stack[-1] = AttributeOp(stack[-1], v)
 
     def _COMPARE_OP(self, cmd, prevcmd, nextcmd, stack, curIndent):
-        op = cmp_op[cmd.argument]
+        op = self.disassembler.commands.stream.cmp_op[cmd.argument]
         # stack[-2] = CompareOp(op, str(stack[-2]), str(stack[-1]))
         stack[-2] = CompareOp(op, stack[-2], stack[-1])
-        stack.pop().dec()
+        stack.pop()
 
     def _IMPORT_NAME(self, cmd, prevcmd, nextcmd, stack, curIndent):
         names = stack.pop()
         level = stack.pop()
-        names.dec()
-        level.dec()
         value = self.co.names.value[cmd.argument].value
         stack.append(Import(value, names, level))
 
     def _IMPORT_FROM(self, cmd, prevcmd, nextcmd, stack, curIndent):
-        importobj = stack[-1]
+        # the STORE that follows adds the name to importobj
+        importobj = unshare(stack, -1)
         value = self.co.names.value[cmd.argument].value
         stack.append(ImportFrom(importobj, value))
 
@@ -762,7 +901,7 @@ class Decompiler:
 
         try:
             r = self.STORE(value, stack[-1], curIndent, self.checkStack(stack, 1))
-            stack.pop().dec()        
+            stack.pop()
         except IndexError:
             r=""
         
@@ -782,7 +921,7 @@ class Decompiler:
             r += 'raise ' + \
                  ', '.join(str(x) for x in stack[-cmd.argument:]) + '\n'
         for _ in xrange(cmd.argument):
-            stack.pop().dec()
+            stack.pop()
         return r
 
     def _CALL_FUNCTION(self, cmd, prevcmd, nextcmd, stack, curIndent):
@@ -794,11 +933,10 @@ class Decompiler:
             paramValue = str(stack[-1]) # o.__repr__()
             paramKey = stack[-2].__str__() # o.__str__()
             functionParams.insert(0, paramKey + '=' + paramValue)
-            stack.pop().dec()
-            stack.pop().dec()
+            stack.pop()
+            stack.pop()
         for index in range(positional):
             o = stack.pop()
-            o.dec()
             ##XXX Rich
             try:
                 functionParams.insert(0, str(o)) # o.__repr__())
@@ -807,43 +945,41 @@ class Decompiler:
                 print "=",o.value.str()
                 #raw_input("XXX: _CALL_FUNCTION Error: %s"%(err))
         o = stack.pop()
-        o.dec()
+        co = None
         if o.__class__ is NewFunction:
             functionName = o.value.name.value
+            co = o.value
         else:
             functionName = str(o) # o.__repr__()
-        stack.append(CallOp(functionName, functionParams))
+        stack.append(CallOp(functionName, functionParams, co))
 
     def _MAKE_FUNCTION(self, cmd, prevcmd, nextcmd, stack, curIndent):
         f_co = stack.pop()
-        f_co.dec()
         if f_co.value.name.value == '<lambda>':
             nf = NewLambda(f_co.value)
         else:
             nf = NewFunction(f_co.value)
         for index in range(cmd.argument):
             o = stack.pop()
-            o.dec()
             nf.addDefParam(o)
         stack.append(nf)
 
     def _BUILD_SLICE(self, cmd, prevcmd, nextcmd, stack, curIndent):
         if cmd.argument == 2:
             stack[-2] = Slice3Op(stack[-2], stack[-1])
-            stack.pop().dec()
+            stack.pop()
         elif cmd.argument == 3:
             stack[-3] = BigSliceOp(stack[-3], stack[-2], stack[-1])
-            stack.pop().dec()
-            stack.pop().dec()
+            stack.pop()
+            stack.pop()
 
     def _MAKE_CLOSURE(self, cmd, prevcmd, nextcmd, stack, curIndent):
         # TODO: test MAKE_CLOSURE, LOAD_DEREF, STORE_DEREF, LOAD_CLOSURE
         f_co = stack.pop()
-        f_co.dec()
         for _ in xrange(len(f_co.value.freevars.value)):
             try:
                 #FixMe
-                stack.pop().dec()
+                stack.pop()
             except:
                 print "XXX: make closure bug"
                 break
@@ -853,7 +989,6 @@ class Decompiler:
             nf = NewFunction(f_co.value)
         for index in range(cmd.argument):
             o = stack.pop()
-            o.dec()
             nf.defParams.append(o)
         stack.append(nf)
 
@@ -885,13 +1020,13 @@ class Decompiler:
             value = self.co.freevars.value[index].value
             emptyStack = self.checkStack(stack, 1)
             r += self.STORE(value, stack[-1], curIndent, emptyStack)
-        stack.pop().dec()
+        stack.pop()
         return r
 
     def _CALL_FUNCTION_VAR(self, cmd, prevcmd, nextcmd, stack, curIndent):
         # TODO: remove copypaste from CALL_FUNCTION*
         star = str(stack[-1]) #__repr__()
-        stack.pop().dec()
+        stack.pop()
         positional = cmd.argument & 0xFF
         keyword = (cmd.argument >> 8) & 0xFF
         functionParams = []
@@ -899,13 +1034,12 @@ class Decompiler:
             paramValue = str(stack[-1]) # __repr__()
             paramKey = stack[-2].__strnq__() # __str__()
             functionParams.insert(0, paramKey + '=' + paramValue)
-            stack.pop().dec()
-            stack.pop().dec()
+            stack.pop()
+            stack.pop()
         for index in range(positional):
             functionParams.insert(0, str(stack[-1])) # __repr__()
-            stack.pop().dec()
+            stack.pop()
         o = stack.pop()
-        o.dec()
         if o.__class__ is NewFunction:
             functionName = o.value.name.value
         else:
@@ -916,7 +1050,7 @@ class Decompiler:
     def _CALL_FUNCTION_KW(self, cmd, prevcmd, nextcmd, stack, curIndent):
         # TODO: remove copypaste from CALL_FUNCTION*
         starstar = str(stack[-1]) # __repr__()
-        stack.pop().dec()
+        stack.pop()
         positional = cmd.argument & 0xFF
         keyword = (cmd.argument >> 8) & 0xFF
         functionParams = []
@@ -924,13 +1058,12 @@ class Decompiler:
             paramValue = str(stack[-1]) # __repr__()
             paramKey = stack[-2].__strnq__() # __str__()
             functionParams.insert(0, paramKey + '=' + paramValue)
-            stack.pop().dec()
-            stack.pop().dec()
+            stack.pop()
+            stack.pop()
         for index in range(positional):
             functionParams.insert(0, str(stack[-1])) # __repr__()
-            stack.pop().dec()
+            stack.pop()
         o = stack.pop()
-        o.dec()
         if o.__class__ is NewFunction:
             functionName = o.value.name.value
         else:
@@ -943,8 +1076,8 @@ class Decompiler:
         # TODO: remove copypaste from CALL_FUNCTION*
         starstar = str(stack[-1]) # __repr__()
         star = str(stack[-2])  # __repr__()
-        stack.pop().dec()
-        stack.pop().dec()
+        stack.pop()
+        stack.pop()
         positional = cmd.argument & 0xFF
         keyword = (cmd.argument >> 8) & 0xFF
         functionParams = []
@@ -952,13 +1085,12 @@ class Decompiler:
             paramValue = str(stack[-1]) # __repr__()
             paramKey = stack[-2].__strnq__() # __str__()
             functionParams.insert(0, paramKey + '=' + paramValue)
-            stack.pop().dec()
-            stack.pop().dec()
+            stack.pop()
+            stack.pop()
         for index in range(positional):
             functionParams.insert(0, str(stack[-1])) # __str__()
-            stack.pop().dec()
+            stack.pop()
         o = stack.pop()
-        o.dec()
         if o.__class__ is NewFunction:
             functionName = o.value.name.value
         else:
@@ -971,197 +1103,128 @@ class Decompiler:
         # TODO: EXTENDED_ARG
         pass
 
+    def getDispatch(self):
+        '''
+        Builds the table of actions for the commands once per class, rather
+        than once per decompiled block.
+
+        @return:
+            dict of mnemonics -> function, called with the L{Decompiler}
+            as its first argument.
+
+        '''
+        cls = self.__class__
+        if cls.__dict__.get('dispatch') is None:
+            dispatch = {}
+            for mnemonics in cls.actionMnemonics:
+                action = getattr(cls, '_' + mnemonics.replace('+', '_'))
+                dispatch[mnemonics] = action.im_func
+            cls.dispatch = dispatch
+        return cls.dispatch
+
+    def printStack(self, stack):
+        '''Reports current stack state.'''
+
+        print '---> stack: '
+        for x in stack:
+            print '     ' + str(x)
+
     def codeDecompile(self, offset=0, length=0, startIndent=0,
                       showStack=False, stack=[], mode='plain'):
         '''
         Decompiles current code object.
 
+        With L{cache.SeenCode} the result is kept for the code object,
+        decompiling the same range again from a stack of the same shape (as
+        it does when decompile() is run on the code object again) gives it
+        back without running the commands. The nodes left on the stack are
+        handed out again, the caller must share them as
+        L{structure.graph.DFADecompile} does.
+
         @param offset: start offset in co_code.
         @param length: length of the co_code substring to decompile.
         @param startIndent: initial indent for the generated source code.
         @param showStack: report current stack state after each command.
-        @param stack: initial stack state.
+        @param stack: initial stack state, left in its final state.
         @param mode: decompilation mode ('plain' or 'conditional').
 
         '''
-        callHash = {
-            'STOP_CODE' : self._STOP_CODE,
-            'POP_TOP' : self._POP_TOP,
-            'ROT_TWO' : self._ROT_TWO,
-            'ROT_THREE' : self._ROT_THREE,
-            'DUP_TOP' : self._DUP_TOP,
-            'ROT_FOUR' : self._ROT_FOUR,
-            'NOP' : self._NOP,
-            'UNARY_POSITIVE' : self._UNARY_POSITIVE,
-            'UNARY_NEGATIVE' : self._UNARY_NEGATIVE,
-            'UNARY_NOT' : self._UNARY_NOT,
-            'UNARY_CONVERT' : self._UNARY_CONVERT,
-            'UNARY_INVERT' : self._UNARY_INVERT,
-            'LIST_APPEND' : self._LIST_APPEND,
-            'BINARY_POWER' : self._BINARY_POWER,
-            'BINARY_MULTIPLY' : self._BINARY_MULTIPLY,
-            'BINARY_DIVIDE' : self._BINARY_DIVIDE,
-            'BINARY_MODULO' : self._BINARY_MODULO,
-            'BINARY_ADD' : self._BINARY_ADD,
-            'BINARY_SUBTRACT' : self._BINARY_SUBTRACT,
-            'BINARY_SUBSCR' : self._BINARY_SUBSCR,
-            'BINARY_FLOOR_DIVIDE' : self._BINARY_FLOOR_DIVIDE,
-            'BINARY_TRUE_DIVIDE' : self._BINARY_TRUE_DIVIDE,
-            'INPLACE_FLOOR_DIVIDE' : self._INPLACE_FLOOR_DIVIDE,
-            'INPLACE_TRUE_DIVIDE' : self._INPLACE_TRUE_DIVIDE,
-            'SLICE' : self._SLICE,
-            'SLICE+1' : self._SLICE_1,
-            'SLICE+2' : self._SLICE_2,
-            'SLICE+3' : self._SLICE_3,
-            'STORE_SLICE' : self._STORE_SLICE,
-            'STORE_SLICE+1' : self._STORE_SLICE_1,
-            'STORE_SLICE+2' : self._STORE_SLICE_2,
-            'STORE_SLICE+3' : self._STORE_SLICE_3,
-            'DELETE_SLICE' : self._DELETE_SLICE,
-            'DELETE_SLICE+1' : self._DELETE_SLICE_1,
-            'DELETE_SLICE+2' : self._DELETE_SLICE_2,
-            'DELETE_SLICE+3' : self._DELETE_SLICE_3,
-            'STORE_MAP' : self._STORE_MAP,
-            'INPLACE_ADD' : self._INPLACE_ADD,
-            'INPLACE_SUBTRACT' : self._INPLACE_SUBTRACT,
-            'INPLACE_MULTIPLY' : self._INPLACE_MULTIPLY,
-            'INPLACE_DIVIDE' : self._INPLACE_DIVIDE,
-            'INPLACE_MODULO' : self._INPLACE_MODULO,
-            'STORE_SUBSCR' : self._STORE_SUBSCR,
-            'DELETE_SUBSCR' : self._DELETE_SUBSCR,
-            'BINARY_LSHIFT' : self._BINARY_LSHIFT,
-            'BINARY_RSHIFT' : self._BINARY_RSHIFT,
-            'BINARY_AND' : self._BINARY_AND,
-            'BINARY_XOR' : self._BINARY_XOR,
-            'BINARY_OR' : self._BINARY_OR,
-            'INPLACE_POWER' : self._INPLACE_POWER,
-            'GET_ITER' : self._GET_ITER,
-            'PRINT_EXPR' : self._PRINT_EXPR,
-            'PRINT_ITEM' : self._PRINT_ITEM,
-            'PRINT_NEWLINE' : self._PRINT_NEWLINE,
-            'PRINT_ITEM_TO' : self._PRINT_ITEM_TO,
-            'PRINT_NEWLINE_TO' : self._PRINT_NEWLINE_TO,
-            'INPLACE_LSHIFT' : self._INPLACE_LSHIFT,
-            'INPLACE_RSHIFT' : self._INPLACE_RSHIFT,
-            'INPLACE_AND' : self._INPLACE_AND,
-            'INPLACE_XOR' : self._INPLACE_XOR,
-            'INPLACE_OR' : self._INPLACE_OR,
-            'BREAK_LOOP' : self._BREAK_LOOP,
-            'WITH_CLEANUP' : self._WITH_CLEANUP,
-            'LOAD_LOCALS' : self._LOAD_LOCALS,
-            'RETURN_VALUE' : self._RETURN_VALUE,
-            'IMPORT_STAR' : self._IMPORT_STAR,
-            'EXEC_STMT' : self._EXEC_STMT,
-            'YIELD_VALUE' : self._YIELD_VALUE,
-            'POP_BLOCK' : self._POP_BLOCK,
-            'END_FINALLY' : self._END_FINALLY,
-            'BUILD_CLASS' : self._BUILD_CLASS,
-            'STORE_NAME' : self._STORE_NAME,
-            'DELETE_NAME' : self._DELETE_NAME,
-            'UNPACK_SEQUENCE' : self._UNPACK_SEQUENCE,
-            'FOR_ITER' : self._FOR_ITER,
-            'STORE_ATTR' : self._STORE_ATTR,
-            'DELETE_ATTR' : self._DELETE_ATTR,
-            'STORE_GLOBAL' : self._STORE_GLOBAL,
-            'DELETE_GLOBAL' : self._DELETE_GLOBAL,
-            'DUP_TOPX' : self._DUP_TOPX,
-            'LOAD_CONST' : self._LOAD_CONST,
-            'LOAD_NAME' : self._LOAD_NAME,
-            'BUILD_TUPLE' : self._BUILD_TUPLE,
-            'BUILD_LIST' : self._BUILD_LIST,
-            'BUILD_MAP' : self._BUILD_MAP,
-            'LOAD_ATTR' : self._LOAD_ATTR,
-            'COMPARE_OP' : self._COMPARE_OP,
-            'IMPORT_NAME' : self._IMPORT_NAME,
-            'IMPORT_FROM' : self._IMPORT_FROM,
-            'JUMP_FORWARD' : self._JUMP_FORWARD,
-            'JUMP_IF_FALSE' : self._JUMP_IF_FALSE,
-            'JUMP_IF_TRUE' : self._JUMP_IF_TRUE,
-            'JUMP_ABSOLUTE' : self._JUMP_ABSOLUTE,
-            'LOAD_GLOBAL' : self._LOAD_GLOBAL,
-            'CONTINUE_LOOP' : self._CONTINUE_LOOP,
-            'SETUP_LOOP' : self._SETUP_LOOP,
-            'SETUP_EXCEPT' : self._SETUP_EXCEPT,
-            'SETUP_FINALLY' : self._SETUP_FINALLY,
-            'LOAD_FAST' : self._LOAD_FAST,
-            'STORE_FAST' : self._STORE_FAST,
-            'DELETE_FAST' : self._DELETE_FAST,
-            'RAISE_VARARGS' : self._RAISE_VARARGS,
-            'CALL_FUNCTION' : self._CALL_FUNCTION,
-            'MAKE_FUNCTION' : self._MAKE_FUNCTION,
-            'BUILD_SLICE' : self._BUILD_SLICE,
-            'MAKE_CLOSURE' : self._MAKE_CLOSURE,
-            'LOAD_CLOSURE' : self._LOAD_CLOSURE,
-            'LOAD_DEREF' : self._LOAD_DEREF,
-            'STORE_DEREF' : self._STORE_DEREF,
-            'CALL_FUNCTION_VAR' : self._CALL_FUNCTION_VAR,
-            'CALL_FUNCTION_KW' : self._CALL_FUNCTION_KW,
-            'CALL_FUNCTION_VAR_KW' : self._CALL_FUNCTION_VAR_KW,
-            'EXTENDED_ARG' : self._EXTENDED_ARG
-        }
+        if showStack or self.blocks is None:
+            return self.decompileCommands(offset, length, startIndent,
+                                          showStack, stack, mode)
+        # a block of a code object is always reached with the same stack,
+        # its shape is enough to tell it from another start
+        key = (offset, length, startIndent, mode, signature(stack),
+               signature(self.postponedStores))
+        if key not in self.blocks:
+            before = len(self.timedOut)
+            res = self.decompileCommands(offset, length, startIndent,
+                                         showStack, stack, mode)
+            # nested code objects that ran out of budget in this block
+            self.blocks[key] = (res, tuple(stack),
+                                tuple(self.postponedStores),
+                                self.timedOut[before:])
+            return res
+        (res, after, postponed, timedOut) = self.blocks[key]
+        self.keptBlocks += 1
+        stack[:] = after
+        self.postponedStores = list(postponed)
+        if self.budget is not None:
+            self.budget.timedOut += timedOut
+        self.timedOut += timedOut
+        return res
+
+    def decompileCommands(self, offset, length, startIndent, showStack,
+                          stack, mode):
+        '''
+        Decompiles the commands of a range, see L{codeDecompile}.
 
+        '''
+        dispatch = self.getDispatch()
         commands = self.disassembler.getCommands(offset, length).cmdList
-        r = ''
+        # source of each command, joined once at the end
+        r = []
         stackOfStacks = []
         curIndent = startIndent
         indentStack = []
         jumps = []
         cmdlen = len(commands)
 
-        for index in xrange(cmdlen):
+        # an exception in an action skips the rest of that command, it is
+        # caught outside the loop so the loop itself sets up no handler
+        index = 0
+        while index < cmdlen:
             try:
-                cmd = commands[index]
-                prevcmd = None
-                nextcmd = None
-                if index != cmdlen - 1: nextcmd = commands[index + 1]
-                if index != 0: prevcmd = commands[index - 1]
-
-                if cmd.mnemonics is not None:
-                    # TODO: should be hash switch!
-                    if mode == 'conditional' and \
-                       cmd.mnemonics in ('JUMP_IF_TRUE', 'JUMP_IF_FALSE'):
-                        return (r, stack[-1])
-                    else:
-                        
-                        func = callHash[cmd.mnemonics]
-                        ##XXX Rich 
-                        try:
-                            res = func(cmd, prevcmd, nextcmd,
-                                       stack, curIndent)
-                        except Exception, err:
-                            print "XXX: %s"%err
-                            #import traceback
-                            #traceback.print_exc()
-                            #raw_input()
-                            res = None
-                        ##XXX
-                            
+                for index in xrange(index, cmdlen):
+                    cmd = commands[index]
+                    if cmd.mnemonics is not None:
+                        if mode == 'conditional' and \
+                           cmd.mnemonics in ('JUMP_IF_TRUE', 'JUMP_IF_FALSE'):
+                            return (''.join(r), stack[-1])
+                        prevcmd = None
+                        nextcmd = None
+                        if index != cmdlen - 1: nextcmd = commands[index + 1]
+                        if index != 0: prevcmd = commands[index - 1]
+                        res = dispatch[cmd.mnemonics](self, cmd, prevcmd,
+                                                      nextcmd, stack,
+                                                      curIndent)
                         if res is not None:
-                            r += res
+                            r.append(res)
 
-                    if showStack:
-                        print '---> stack: '
-                        for x in stack:
-                            print '     ' + str(x)
-            except:
-                raise
-                print r
-                r = ''
-                print '------'
-                print '***', sys.exc_info()
-                print >> sys.stderr, \
-                    '>>> Decompilation broken:\n' \
-                    '>>> exception: ' + str(sys.exc_info()[1]) + \
-                    '>>> stack trace:\n' + \
-                    traceback.print_tb(sys.exc_info()[2]) + \
-                    '>>> decompilation state info:\n' \
-                    'co.name = %s\n' \
-                    'lastoffset = %.8X\n' \
-                    'lastcommand = %s\n' \
-                    'lastargument = %s\n' % (self.co.name.value, cmd.offset,
-                                             cmd.mnemonics, cmd.argument)
-                print >> sys.stderr, '>>> decompilation stack info:\n'
-                sys.exit(-1)
+                        if showStack:
+                            self.printStack(stack)
+                index = cmdlen
+            except Exception, err:
+                # only failures inside an action are skipped, an unknown
+                # command and such still break the decompilation
+                if sys.exc_info()[2].tb_next is None:
+                    raise
+                ##XXX Rich
+                print "XXX: %s"%err
+                ##XXX
+                if showStack:
+                    self.printStack(stack)
+                index += 1
         # TODO: check and cleanup self.postponedStores
         if stack:
             dbgprint('>>> Warning: Decompilation finished with ' \
@@ -1170,11 +1233,15 @@ class Decompiler:
                 dbgprint('\t' + str(x))
             dbgprint('<<<')
 
-        if mode == 'conditional': return (r, None)
-        return r
+        if mode == 'conditional': return (''.join(r), None)
+        return ''.join(r)
 
     def decompile(self, offset=0, startIndent=0):
         '''Entry point for the decompilation process.'''
+        if self.seen is not None:
+            key = self.seen.key(self.co, offset)
+            if key is not None:
+                self.blocks = self.seen.kept_blocks(key)
         try:
             cb = self.disassembler.getAllCodeBlocks(offset)
             print "[+] All code blocks got"
@@ -1182,14 +1249,36 @@ class Decompiler:
             print "[+] Flow graph from code blocks got"
             flowGraph.DFADecompile(self)
             print "[+] DFA decompiled"
-            flowGraph.simplifyComplexIFs()
-            print "[+] Complex IF's simplified"
-            flowGraph.preprocessWhileLoops()
-            print "[+] WHILE loops preprocessed"
-            flowGraph.simplifyAllCompound()
-            print "[+] All compounds simplified"
-            flowGraph.simplifyConsecutive()
-            print "[+] Consecutives simplified"
+            timedOut = None
+            if self.budget is not None:
+                flowGraph.clock = self.budget.start()
+            try:
+                flowGraph.simplifyComplexIFs()
+                print "[+] Complex IF's simplified"
+                flowGraph.preprocessWhileLoops()
+                print "[+] WHILE loops preprocessed"
+                flowGraph.simplifyAllCompound()
+                print "[+] All compounds simplified (%d passes, %d merges, " \
+                      "%d of %d node visits)" % (flowGraph.passes,
+                                                 flowGraph.merges,
+                                                 flowGraph.visits,
+                                                 flowGraph.sweeps)
+                flowGraph.simplifyConsecutive()
+                print "[+] Consecutives simplified"
+            except structure.BudgetExceeded, err:
+                # fall back to the blocks structured so far
+                timedOut = str(err)
+                name = '%s (line %d)' % (self.co.name.value,
+                                         self.co.firstlineno.value)
+                self.budget.timedOut.append((name, timedOut))
+                self.timedOut.append((name, timedOut))
+                print "[-] %s: %s" % (name, timedOut)
+            # how much work structuring took, against sweeping every node
+            # each pass
+            timing.count('structure passes', flowGraph.passes)
+            timing.count('structure merges', flowGraph.merges)
+            timing.count('structure visits', flowGraph.visits)
+            timing.count('structure full visits', flowGraph.sweeps)
             if len(flowGraph.nodes) == 1:
                 r = flowGraph.nodes[flowGraph.root].code
             else:
@@ -1197,13 +1286,16 @@ class Decompiler:
                 print "!!!INCOMPLETE DISASSEMBLY!!!!"
                 print "%d code block uncoalesced"%len(flowGraph.nodes)
                 #r = '>>> Fatal error: could not structure control flow graph.'
-                r=""
+                r=[]
+                if timedOut:
+                    r.append("#[STRUCTURING ABANDONED: %s]\n" % timedOut)
                 ordered_nodes=flowGraph.nodes.keys()
                 ordered_nodes.sort()
                 for n in ordered_nodes:
-                    if len(flowGraph.nodes[n].code) == 0:
+                    if flowGraph.nodes[n].code == '':
                         continue
-                    r += "#[NODE: %s]\n%s\n"%(n, flowGraph.nodes[n].code)
+                    r.append("#[NODE: %s]\n%s\n"%(n, flowGraph.nodes[n].code))
+                r=''.join(r)
                 
                
             return indentText(r, startIndent)
@@ -47,11 +47,22 @@ basic blocks, some bytecode optimizations and disassembler itself.
 
 '''
 
-import struct
-from copy import deepcopy
+from array import array
+from bisect import bisect_left
+from copy import copy
 
-import opcodes
+import optable
 import parse
+import timing
+
+try:
+    import numpy
+    CAN_NUMPY = True
+except ImportError:
+    CAN_NUMPY = False
+
+# co_code shorter than this is decoded quicker without numpy call overhead
+NUMPY_MIN_SIZE = 4096
 
 class Command:
     '''Single command in bytecode.'''
@@ -178,22 +189,304 @@ class CodeBlocks:
             r += '%.8X <- ' % k + self.strkey(k) + '\n'
         return r
 
+# argument column value of commands that take no argument
+NOARG = -0x7FFFFFFF
+
+def decodeCode(co_code, startOffset=0):
+    '''
+    Decodes the whole co_code in one go, finding instruction lengths from
+    a table rather than looking up each opcode.
+
+    @param co_code: bytecode.
+    @param startOffset: offset base.
+    @return: L{InstructionStream} of the commands in co_code.
+
+    '''
+    stream = InstructionStream()
+    if CAN_NUMPY and len(co_code) >= NUMPY_MIN_SIZE:
+        decodeColumnsNumpy(stream, co_code, startOffset)
+    else:
+        decodeColumns(stream, co_code, startOffset)
+    return stream
+
+def decodeColumns(stream, co_code, startOffset):
+    '''Fills the columns of stream from co_code, without numpy.'''
+
+    sizes = stream.sizes
+    code = array('B', co_code)
+    offsets = stream.offsets
+    ops = stream.opcodes
+    arguments = stream.arguments
+    lengths = stream.lengths
+    border = len(code)
+    i = 0
+    while i < border:
+        opcode = code[i]
+        size = sizes[opcode]
+        offsets.append(i + startOffset)
+        ops.append(opcode)
+        if size == 0:
+            arguments.append(NOARG)
+            lengths.append(1)
+        else:
+            if size == 2 and i + 2 < border:
+                arguments.append(code[i + 1] | code[i + 2] << 8)
+            else:
+                # odd size or truncated at the end, as parse.getInt
+                argument = 0
+                shift = 0
+                for x in code[i + 1:i + 1 + size]:
+                    argument += x << shift
+                    shift += 8
+                arguments.append(argument)
+            lengths.append(3)
+        i += 1 + size
+
+def decodeColumnsNumpy(stream, co_code, startOffset):
+    '''
+    Fills the columns of stream from co_code with numpy.
+
+    Every byte is given the offset an instruction starting there would be
+    followed by, the instructions are then the bytes reached from offset 0.
+    Those are found by doubling, after k rounds all instructions less than
+    2^k hops from the start are known, so there is no python loop over the
+    instructions.
+
+    '''
+    sizes = numpy.array(stream.sizes, numpy.intc)
+    code = numpy.frombuffer(co_code, numpy.uint8)
+    border = len(code)
+    # byte border stands for past the end and leads to itself
+    jump = numpy.arange(1, border + 2, dtype=numpy.intc)
+    jump[:border] += sizes[code]
+    jump = numpy.minimum(jump, border)
+    reached = numpy.zeros(border + 1, bool)
+    reached[0] = True
+    reached[border] = True
+    while True:
+        hops = jump[numpy.flatnonzero(reached)]
+        if reached[hops].all():
+            break
+        reached[hops] = True
+        jump = jump[jump]
+    starts = numpy.flatnonzero(reached[:border])
+    ops = code[starts]
+    argSizes = sizes[ops]
+    arguments = numpy.zeros(len(starts), numpy.intc)
+    for k in xrange(int(argSizes.max())):
+        where = starts + 1 + k
+        present = (argSizes > k) & (where < border)
+        arguments[present] += code[where[present]].astype(numpy.intc) << (8 * k)
+    hasArgument = argSizes != 0
+    arguments[~hasArgument] = NOARG
+    stream.offsets.fromstring((starts + startOffset).astype(numpy.intc).tostring())
+    stream.opcodes.fromstring(ops.tostring())
+    stream.arguments.fromstring(arguments.tostring())
+    stream.lengths.fromstring(numpy.where(hasArgument, 3, 1).astype(numpy.uint8).tostring())
+
+class InstructionStream:
+    '''
+    Disassembled commands stored column-wise in parallel arrays.
+
+    Keeps a few bytes per command instead of a L{Command} instance,
+    L{Command}s are only made when asked for (see L{command} and
+    L{Cursor}).
+
+    '''
+    def __init__(self):
+        self.offsets = array('i')
+        self.opcodes = array('B')
+        self.arguments = array('i')
+        self.lengths = array('B')
+        # lists from the opcode table at disassembly time, by opcode and
+        # cmp_op by COMPARE_OP argument, kept so a table swapped in later
+        # does not change how this stream is read or shown
+        table = optable.active()
+        self.names = table.names
+        self.sizes = table.sizes
+        self.jumps = table.jumps
+        self.cmp_op = table.cmp_op
+        self.docs = table.docs
+        # index -> mnemonics for commands rewritten by optimizations
+        self.renamed = {}
+        # every command as a L{Command}, made by L{commands} when first
+        # asked for and shared until the stream is modified
+        self.cmdList = None
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def append(self, offset, opcode, argument, length):
+        self.offsets.append(offset)
+        self.opcodes.append(opcode)
+        if argument is None:
+            argument = NOARG
+        self.arguments.append(argument)
+        self.lengths.append(length)
+
+    def index(self, offset):
+        '''@return: index of the command at offset, None if there is none.'''
+
+        i = bisect_left(self.offsets, offset)
+        if i < len(self.offsets) and self.offsets[i] == offset:
+            return i
+        return None
+
+    def mnemonics(self, i):
+        if i in self.renamed:
+            return self.renamed[i]
+        return self.names[self.opcodes[i]]
+
+    def argument(self, i):
+        argument = self.arguments[i]
+        if argument == NOARG:
+            return None
+        return argument
+
+    def setMnemonics(self, i, mnemonics):
+        self.renamed[i] = mnemonics
+        self.cmdList = None
+
+    def setArgument(self, i, argument):
+        if argument is None:
+            argument = NOARG
+        self.arguments[i] = argument
+        self.cmdList = None
+
+    def command(self, i):
+        '''@return: new L{Command} for the command at index i.'''
+
+        cmd = Command(self.offsets[i], self.opcodes[i], self.mnemonics(i),
+                      self.argument(i))
+        cmd.length = self.lengths[i]
+        return cmd
+
+    def commands(self, start, end):
+        '''
+        @return:
+            list of L{Command}s for commands start to end. The L{Command}s
+            of the whole stream are made on the first call and shared by
+            every list handed out until the stream is modified.
+
+        '''
+        if self.cmdList is None:
+            names = self.names
+            cmdList = []
+            append = cmdList.append
+            for (offset, opcode, argument, length) in zip(self.offsets,
+                    self.opcodes, self.arguments, self.lengths):
+                if argument == NOARG:
+                    argument = None
+                cmd = Command(offset, opcode, names[opcode], argument)
+                cmd.length = length
+                append(cmd)
+            for (i, mnemonics) in self.renamed.items():
+                cmdList[i].mnemonics = mnemonics
+            self.cmdList = cmdList
+        return self.cmdList[start:end]
+
+    def cursor(self, start=0, end=None):
+        '''
+        @return: generator moving one L{Cursor} over commands start to end.
+        '''
+        if end is None: end = len(self.offsets)
+        cur = Cursor(self)
+        for i in xrange(start, end):
+            cur.moveTo(i)
+            yield cur
+
+    def copy(self):
+        other = copy(self)
+        other.offsets = array('i', self.offsets)
+        other.opcodes = array('B', self.opcodes)
+        other.arguments = array('i', self.arguments)
+        other.lengths = array('B', self.lengths)
+        other.renamed = self.renamed.copy()
+        other.cmdList = None
+        return other
+
+class Cursor:
+    '''
+    Index into an L{InstructionStream} that has the attributes of the
+    L{Command} it is on, so a pass over the commands needs no L{Command}
+    per step. Assigning to the attributes does not change the stream, use
+    L{setArgument} and L{setMnemonics}.
+
+    '''
+    def __init__(self, stream):
+        self.stream = stream
+        self.index = None
+
+    def moveTo(self, i):
+        stream = self.stream
+        self.index = i
+        self.offset = stream.offsets[i]
+        self.opcode = stream.opcodes[i]
+        self.length = stream.lengths[i]
+        self.argument = stream.arguments[i]
+        if self.argument == NOARG:
+            self.argument = None
+        if i in stream.renamed:
+            self.mnemonics = stream.renamed[i]
+        else:
+            self.mnemonics = stream.names[self.opcode]
+
+    def setArgument(self, argument):
+        self.stream.setArgument(self.index, argument)
+        self.argument = argument
+
+    def setMnemonics(self, mnemonics):
+        self.stream.setMnemonics(self.index, mnemonics)
+        self.mnemonics = mnemonics
+
+    def command(self):
+        return self.stream.command(self.index)
+
+    def __str__(self):
+        return str(self.command())
+
 class Commands:
     '''Container for L{Command}s collection.'''
 
-    def __init__(self, cmdList, offsets, cmdHash):
+    def __init__(self, stream, start=0, end=None):
         '''
-        @param cmdList: list     of commands.
-        @param offsets: offsets of given list of commands.
-        @param cmdHash: hash of given commands (offset -> command).
+        @param stream: L{InstructionStream} holding the commands.
+        @param start: index of the first command in this collection.
+        @param end: index after the last one, None for the end of stream.
 
         '''
-        self.cmdList = cmdList
-        self.offsets = offsets
-        self.cmdHash = cmdHash
+        if end is None: end = len(stream)
+        self.stream = stream
+        self.start = start
+        self.end = end
+
+    def __getattr__(self, name):
+        # cmdList - list of commands.
+        # offsets - offsets of given list of commands.
+        # cmdHash - hash of given commands (offset -> command).
+        if name == 'cmdList':
+            self.cmdList = self.stream.commands(self.start, self.end)
+            return self.cmdList
+        if name == 'offsets':
+            self.offsets = self.stream.offsets[self.start:self.end].tolist()
+            return self.offsets
+        if name == 'cmdHash':
+            self.cmdHash = dict(zip(self.offsets, self.cmdList))
+            return self.cmdHash
+        raise AttributeError(name)
+
+    def cursor(self):
+        '''@return: L{Cursor} generator over the collection.'''
+
+        return self.stream.cursor(self.start, self.end)
+
+    def copy(self):
+        '''@return: L{Commands} over a copy of the stream.'''
+
+        return Commands(self.stream.copy(), self.start, self.end)
 
     def __str__(self):
-        return '\n'.join(str(cmd) for cmd in self.cmdList)
+        return '\n'.join(str(cmd) for cmd in self.cursor())
 
 class Disassembler:
     '''Disassembler itself.'''
@@ -208,6 +501,14 @@ class Disassembler:
 
         '''
         self.co = co
+        # set once getCommands has handed out Command objects, see
+        # ownCommands
+        self.shared = False
+        # results of scans over the commands, kept until they are modified,
+        # see getJumps, getAllCodeBlocks and getLoopCodeBlocks
+        self.analysis = {}
+        # jump chain hops removed by optimizeJumps
+        self.collapsedHops = 0
         if not raw:
             self.commands = self.disasmCommands(self.co.code.value)
         else:
@@ -216,6 +517,7 @@ class Disassembler:
             self.optimizeJumps()
             self.optimizeAbsoluteJumps()
 
+    @timing.timed('optimizeJumps')
     def optimizeJumps(self):
         '''
         Optimizes conditional jumps.
@@ -223,76 +525,112 @@ class Disassembler:
         Replaces JUMP_IF_* -> JUMP_IF_* -> ... -> TARGET
         with JUMP_IF_* -> TARGET.
 
+        Jump arguments are unsigned so a chain only goes forward, through
+        commands not yet rewritten. Where a chain ends then depends only
+        on the jump, the address reached and the negation so far, and is
+        kept for every hop followed. A hop shared by many chains (long
+        chained boolean conditions) is only followed once.
+
+        @return: number of hops collapsed, also kept as collapsedHops.
+
         '''
-        def getOptimizationAddr(cmd, negate=False):
+        stream = self.ownCommands().stream
+        commandAt = {}
+
+        def getCommand(offset):
+            '''@return: L{Command} at offset, KeyError if there is none.'''
+
+            if offset not in commandAt:
+                i = stream.index(offset)
+                if i is None: raise KeyError(offset)
+                commandAt[offset] = stream.command(i)
+            return commandAt[offset]
+
+        def getOptimizationAddr(mnemonics, targetAddr, negate=False):
             '''
-            @param cmd: L{Command} from which to start.
+            @param mnemonics: the jump being optimized.
+            @param targetAddr: address it jumps to so far.
             @param negate:
                 the way to process UNARY_NOT + JUMP_IF.
             @return: address of the next hop.
 
             '''
-            if cmd.mnemonics is not None and cmd.argument is not None:
-                if cmd.mnemonics == 'JUMP_IF_FALSE' and negate == False or \
-                   cmd.mnemonics == 'JUMP_IF_TRUE' and negate == True:
-                    targetAddr = cmd.offset + cmd.argument + cmd.length
-                    target = self.commands.cmdHash[targetAddr]
-                    afterTargetAddr = target.offset + target.length
-                    ##XXX Rich
-                    try:
-                        afterTarget = self.commands.cmdHash[afterTargetAddr]
-                    except:
-                        #print "zzzzzzzzzz"
-                        #print targetAddr
-                        #print target, target.offset , target.length
-                        #print afterTargetAddr
-                        #print cmd.mnemonics
-                        #print self.commands.cmdHash
-                        #raw_input()
-                        return (None, None)
-                        
-                    if target.mnemonics == 'JUMP_IF_FALSE':
-                        rAddr = target.offset + target.argument + target.length
-                        return (rAddr, False)
-                    elif target.mnemonics == 'UNARY_NOT' and \
-                         afterTarget.mnemonics == 'JUMP_IF_TRUE':
-                        rAddr = afterTarget.offset + \
-                                afterTarget.argument + \
-                                afterTarget.length
-                        return (rAddr, True)
-                    elif target.mnemonics == 'JUMP_IF_TRUE':
-                        return (target.offset + target.length, False)
-                    elif target.mnemonics == 'UNARY_NOT' and \
-                         afterTarget.mnemonics == 'JUMP_IF_FALSE':
-                        return (afterTarget.offset + afterTarget.length, True)
-                if cmd.mnemonics == 'JUMP_IF_TRUE' and negate == False or \
-                   cmd.mnemonics == 'JUMP_IF_FALSE' and negate == True:
-                    targetAddr = cmd.offset + cmd.argument + cmd.length
-                    target = self.commands.cmdHash[targetAddr]
-                    afterTargetAddr = target.offset + target.length
-                    afterTarget = self.commands.cmdHash[afterTargetAddr]
-                    if target.mnemonics == 'JUMP_IF_TRUE':
-                        rAddr = target.offset + target.argument + target.length
-                        return (rAddr, False)
-                    elif target.mnemonics == 'UNARY_NOT' and \
-                         afterTarget.mnemonics == 'JUMP_IF_FALSE':
-                        rAddr = afterTarget.offset + \
-                                afterTarget.argument + \
-                                afterTarget.length
-                        return (rAddr, True)
-                    elif target.mnemonics == 'JUMP_IF_FALSE':
-                        return (target.offset + target.length, False)
-                    elif target.mnemonics == 'UNARY_NOT' and \
-                         afterTarget.mnemonics == 'JUMP_IF_TRUE':
-                        return (afterTarget.offset + afterTarget.length, True)
+            if mnemonics == 'JUMP_IF_FALSE' and negate == False or \
+               mnemonics == 'JUMP_IF_TRUE' and negate == True:
+                target = getCommand(targetAddr)
+                afterTargetAddr = target.offset + target.length
+                ##XXX Rich
+                try:
+                    afterTarget = getCommand(afterTargetAddr)
+                except:
+                    return (None, None)
+
+                if target.mnemonics == 'JUMP_IF_FALSE':
+                    rAddr = target.offset + target.argument + target.length
+                    return (rAddr, False)
+                elif target.mnemonics == 'UNARY_NOT' and \
+                     afterTarget.mnemonics == 'JUMP_IF_TRUE':
+                    rAddr = afterTarget.offset + \
+                            afterTarget.argument + \
+                            afterTarget.length
+                    return (rAddr, True)
+                elif target.mnemonics == 'JUMP_IF_TRUE':
+                    return (target.offset + target.length, False)
+                elif target.mnemonics == 'UNARY_NOT' and \
+                     afterTarget.mnemonics == 'JUMP_IF_FALSE':
+                    return (afterTarget.offset + afterTarget.length, True)
+            if mnemonics == 'JUMP_IF_TRUE' and negate == False or \
+               mnemonics == 'JUMP_IF_FALSE' and negate == True:
+                target = getCommand(targetAddr)
+                afterTargetAddr = target.offset + target.length
+                afterTarget = getCommand(afterTargetAddr)
+                if target.mnemonics == 'JUMP_IF_TRUE':
+                    rAddr = target.offset + target.argument + target.length
+                    return (rAddr, False)
+                elif target.mnemonics == 'UNARY_NOT' and \
+                     afterTarget.mnemonics == 'JUMP_IF_FALSE':
+                    rAddr = afterTarget.offset + \
+                            afterTarget.argument + \
+                            afterTarget.length
+                    return (rAddr, True)
+                elif target.mnemonics == 'JUMP_IF_FALSE':
+                    return (target.offset + target.length, False)
+                elif target.mnemonics == 'UNARY_NOT' and \
+                     afterTarget.mnemonics == 'JUMP_IF_TRUE':
+                    return (afterTarget.offset + afterTarget.length, True)
             return (None, None)
 
-        for cmd in self.commands.cmdList:
-            (addr, negate) = getOptimizationAddr(cmd)
-            while addr is not None:
-                cmd.argument = addr - cmd.offset - cmd.length
-                (addr, negate) = getOptimizationAddr(cmd, negate)
-
+        # (mnemonics, address, negate) -> (final address, hops to it)
+        resolved = {}
+        collapsed = 0
+        for i in xrange(len(stream)):
+            mnemonics = stream.mnemonics(i)
+            argument = stream.argument(i)
+            if mnemonics not in ('JUMP_IF_FALSE', 'JUMP_IF_TRUE') or \
+               argument is None:
+                continue
+            offset = stream.offsets[i]
+            length = stream.lengths[i]
+            state = (mnemonics, offset + argument + length, False)
+            path = []
+            while state not in resolved:
+                (addr, negate) = getOptimizationAddr(*state)
+                if addr is None:
+                    resolved[state] = (state[1], 0)
+                    break
+                path.append(state)
+                state = (mnemonics, addr, negate)
+            (addr, hops) = resolved[state]
+            while path:
+                hops += 1
+                resolved[path.pop()] = (addr, hops)
+            if hops:
+                stream.setArgument(i, addr - offset - length)
+                collapsed += hops
+        self.collapsedHops = collapsed
+        return collapsed
+
+    @timing.timed('optimizeAbsoluteJumps')
     def optimizeAbsoluteJumps(self):
         '''
         Replaces JUMP_ABSOLUTE with CONTINUE_LOOP or NOP.
@@ -302,29 +640,32 @@ class Disassembler:
         with CONTINUE_LOOP.
 
         '''
+        stream = self.ownCommands().stream
         possible = {}
-        for cmd in self.commands.cmdList:
+        for cmd in stream.cursor():
             if cmd.mnemonics == 'FOR_ITER':
                 possible[cmd.offset] = 0
             elif cmd.mnemonics == 'SETUP_LOOP':
                 possible[cmd.offset + cmd.length] = 0
-        index = len(self.commands.cmdList) - 1
+        cmd = Cursor(stream)
+        index = len(stream) - 1
         while index >= 0:
-            cmd = self.commands.cmdList[index]
-            if cmd.mnemonics == 'JUMP_ABSOLUTE':
+            if stream.mnemonics(index) == 'JUMP_ABSOLUTE':
+                cmd.moveTo(index)
                 if cmd.argument in possible and cmd.offset > cmd.argument:
                     if possible[cmd.argument] == 0:
                         possible[cmd.argument] = 1
-                        cmd.mnemonics = 'NOP'
-                        cmd.argument = None
+                        cmd.setMnemonics('NOP')
+                        cmd.setArgument(None)
                     else:
-                        cmd.mnemonics = 'CONTINUE_LOOP'
+                        cmd.setMnemonics('CONTINUE_LOOP')
                 else:
                     # TODO: panic... strange jump
                     print 'STRANGE ABSOLUTE JUMP!!!'
             index -= 1
 
     @staticmethod
+    @timing.timed('disasmCommands')
     def disasmCommands(co_code, startOffset=0):
         '''
         @param co_code: bytecode.
@@ -332,28 +673,22 @@ class Disassembler:
         @return: L{Commands} for the specified co_code.
 
         '''
-        commands = []
-        offsets = []
-        cmdHash = {}
-        i = 0
-        border = len(co_code)
-        while i < border:
-            offset = i + startOffset
-            opcode = struct.unpack('=B', co_code[i])[0]
-            i += 1
-            name = None
-            argument = None
-            if opcode in opcodes.opcodes:
-                name = opcodes.opcodes[opcode][0]
-                size = opcodes.opcodes[opcode][1]
-                if size != 0:
-                    argument = parse.getInt(co_code[i:i + size])
-                    i += size
-            cmd = Command(offset, opcode, name, argument)
-            commands.append(cmd)
-            offsets.append(offset)
-            cmdHash[offset] = cmd
-        return Commands(commands, offsets, cmdHash)
+        return Commands(decodeCode(co_code, startOffset))
+
+    def ownCommands(self):
+        '''
+        Copy-on-write for passes that modify commands in place.
+
+        @return:
+            L{Commands} of the disassembler, copied first if some of its
+            L{Command}s have been handed out by L{getCommands}.
+
+        '''
+        if self.shared:
+            self.commands = self.commands.copy()
+            self.shared = False
+        self.analysis = {}
+        return self.commands
 
     def getCommands(self, offset=0, length=0):
         '''
@@ -361,82 +696,107 @@ class Disassembler:
         @param length: length of the substring in co_code.
         @return:
             Commands object, which represents the given slice of
-            co_code.
+            co_code. The L{Command}s are shared with the disassembler
+            and must not be modified, see L{ownCommands}.
 
         '''
-        commands = deepcopy(self.commands)
+        stream = self.commands.stream
         data = self.co.code.value
-        if offset == 0 and length == 0: return commands
+        self.shared = True
+        if offset == 0 and length == 0:
+            return Commands(stream)
         if length == 0: length = len(data) - offset
         if length + offset > len(data): length = len(data) - offset
-        if offset not in commands.cmdHash: return None
-        start = None
-        end = None
-        for i in xrange(len(commands.offsets)):
-            x = commands.offsets[i]
-            if x < offset:
-                del commands.cmdHash[x]
-            elif x >= length + offset:
-                del commands.cmdHash[x]
-                if end is None: end = i
-            else:
-                if start is None: start = i
-        if start is not None:
-            commands.cmdList = commands.cmdList[start:end]
-            commands.offsets = commands.offsets[start:end]
-        else:
-            commands.cmdList = []
-            commands.offset = []
-        return commands
+        start = stream.index(offset)
+        if start is None: return None
+        end = bisect_left(stream.offsets, offset + length)
+        return Commands(stream, start, max(start, end))
+
+    def getJumps(self):
+        '''
+        Scans all commands once for the basic blocks they start or reference.
+
+        @return:
+            list of (command index, command offset, block offset, type of
+            reference) in command order, type is None where a block just
+            starts after the command.
 
+        '''
+        if 'jumps' not in self.analysis:
+            jumps = []
+            stream = self.commands.stream
+            ops = stream.opcodes
+            kinds = stream.jumps
+            names = stream.names
+            cmd = Cursor(stream)
+            for i in xrange(len(stream)):
+                # only jumps, END_FINALLY and renamed commands give blocks
+                opcode = ops[i]
+                if kinds[opcode] == optable.JUMP_NONE and \
+                   names[opcode] != 'END_FINALLY' and i not in stream.renamed:
+                    continue
+                cmd.moveTo(i)
+                if cmd.mnemonics is None:
+                    continue
+                if cmd.argument is None and cmd.mnemonics != 'END_FINALLY':
+                    continue
+                after = cmd.offset + cmd.length
+                if cmd.argument is not None:
+                    target = cmd.offset + cmd.argument + cmd.length
+                refs = None
+                if cmd.mnemonics == 'JUMP_FORWARD':
+                    refs = ((after, None), (target, 'JF'))
+                elif cmd.mnemonics == 'JUMP_IF_FALSE':
+                    refs = ((after, 'NJIF'), (target, 'JIF'))
+                elif cmd.mnemonics == 'JUMP_IF_TRUE':
+                    refs = ((after, 'NJIT'), (target, 'JIT'))
+                elif cmd.mnemonics == 'JUMP_ABSOLUTE':
+                    refs = ((after, None), (cmd.argument, 'JA'))
+                elif cmd.mnemonics == 'SETUP_FINALLY':
+                    refs = ((after, 'ASF'), (target, 'finally'))
+                elif cmd.mnemonics == 'END_FINALLY':
+                    refs = ((after, 'AE'),)
+                elif cmd.mnemonics == 'SETUP_EXCEPT':
+                    refs = ((after, 'try'), (target, 'except'))
+                elif cmd.mnemonics == 'SETUP_LOOP':
+                    refs = ((after, 'loop'), (target, 'AL'))
+                elif cmd.mnemonics == 'FOR_ITER':
+                    refs = ((after, 'for'), (target, 'AF'))
+                if refs is not None:
+                    for (where, name) in refs:
+                        jumps.append((cmd.index, cmd.offset, where, name))
+            self.analysis['jumps'] = jumps
+            self.analysis['jumpIndexes'] = [j[0] for j in jumps]
+        return self.analysis['jumps']
+
+    @timing.timed('getAllCodeBlocks')
     def getAllCodeBlocks(self, offset=0, length=0):
         '''
         Builds basic blocks of current co_code.
 
         @param offset: start offset in co_code.
         @param length: length of the substring in co_code.
-        @return: L{CodeBlocks} of the current code object.
+        @return:
+            L{CodeBlocks} of the current code object. Kept for later
+            calls with the same range, so must not be modified.
 
         '''
-        commands = self.getCommands(offset, length).cmdList
+        commands = self.getCommands(offset, length)
+        key = ('blocks', commands.start, commands.end)
+        if key in self.analysis:
+            return self.analysis[key]
+        jumps = self.getJumps()
+        indexes = self.analysis['jumpIndexes']
         cb = CodeBlocks(offset)
-        for cmd in commands:
-            if cmd.mnemonics is not None:
-                if cmd.argument is not None or cmd.mnemonics == 'END_FINALLY':
-                    if cmd.mnemonics == 'JUMP_FORWARD':
-                        cb.add(cmd.offset + cmd.length)
-                        cb.add(cmd.offset + cmd.argument + cmd.length,
-                               cmd.offset, 'JF')
-                    elif cmd.mnemonics == 'JUMP_IF_FALSE':
-                        cb.add(cmd.offset + cmd.length, cmd.offset, 'NJIF')
-                        cb.add(cmd.offset + cmd.argument + cmd.length,
-                               cmd.offset, 'JIF')
-                    elif cmd.mnemonics == 'JUMP_IF_TRUE':
-                        cb.add(cmd.offset + cmd.length, cmd.offset, 'NJIT')
-                        cb.add(cmd.offset + cmd.argument + cmd.length,
-                               cmd.offset, 'JIT')
-                    elif cmd.mnemonics == 'JUMP_ABSOLUTE':
-                        cb.add(cmd.offset + cmd.length)
-                        cb.add(cmd.argument, cmd.offset, 'JA')
-                    elif cmd.mnemonics == 'SETUP_FINALLY':
-                        cb.add(cmd.offset + cmd.length, cmd.offset, 'ASF')
-                        cb.add(cmd.offset + cmd.argument + cmd.length,
-                               cmd.offset, 'finally')
-                    elif cmd.mnemonics == 'END_FINALLY':
-                        cb.add(cmd.offset + cmd.length, cmd.offset, 'AE')
-                    elif cmd.mnemonics == 'SETUP_EXCEPT':
-                        cb.add(cmd.offset + cmd.length, cmd.offset, 'try')
-                        cb.add(cmd.offset + cmd.argument + cmd.length,
-                               cmd.offset, 'except')
-                    elif cmd.mnemonics == 'SETUP_LOOP':
-                        cb.add(cmd.offset + cmd.length, cmd.offset, 'loop')
-                        cb.add(cmd.offset + cmd.argument + cmd.length,
-                               cmd.offset, 'AL')
-                    elif cmd.mnemonics == 'FOR_ITER':
-                        cb.add(cmd.offset + cmd.length, cmd.offset, 'for')
-                        cb.add(cmd.offset + cmd.argument + cmd.length,
-                               cmd.offset, 'AF')
+        for (index, xref, where, name) in \
+            jumps[bisect_left(indexes, commands.start):
+                  bisect_left(indexes, commands.end)]:
+            if name is None:
+                cb.add(where)
+            else:
+                cb.add(where, xref, name)
         cb.calcBlockXrefs()
+        self.analysis[key] = cb
         return cb
 
     def getLoopCodeBlocks(self, offset=0, length=0):
@@ -445,13 +805,18 @@ class Disassembler:
 
         @param offset: start offset in co_code.
         @param length: length of the substring in co_code.
-        @return: L{CodeBlocks} of current code object.
+        @return:
+            L{CodeBlocks} of current code object. Kept for later calls
+            with the same range, so must not be modified.
 
         '''
-        commands = self.getCommands(offset, length).cmdList
+        commands = self.getCommands(offset, length)
+        key = ('loops', commands.start, commands.end)
+        if key in self.analysis:
+            return self.analysis[key]
         cb = CodeBlocks(offset)
         currentBlock = offset
-        for cmd in commands:
+        for cmd in commands.cursor():
             currentOffset = cmd.offset
             if currentOffset in cb.blocks: currentBlock = currentOffset
             if cmd.mnemonics is not None and cmd.argument is not None:
@@ -468,6 +833,7 @@ class Disassembler:
                            currentBlock, 'for')
                     cb.add(cmd.offset + cmd.argument + cmd.length,
                            currentOffset, currentBlock, 'AF')
+        self.analysis[key] = cb
         return cb
 
     def getMoreInfo(self, cmd, verbose):
@@ -503,7 +869,7 @@ class Disassembler:
                         #             const.info(verbose)))
                         r += const.info(verbose)
                 elif cmd.mnemonics == 'COMPARE_OP':
-                    r += '"' + opcodes.cmp_op[cmd.argument] + '"'
+                    r += '"' + self.commands.stream.cmp_op[cmd.argument] + '"'
                 elif cmd.mnemonics in ('LOAD_FAST', 'STORE_FAST',
                                        'DELETE_FAST'):
                     r += self.co.varnames.value[cmd.argument].info(verbose)
@@ -544,8 +910,8 @@ class Disassembler:
         @return: the disassembler output.
 
         '''
-        cb = self.getAllCodeBlocks(offset, length)
-        commands = self.getCommands(offset, length).cmdList
+        if xref: cb = self.getAllCodeBlocks(offset, length)
+        commands = self.getCommands(offset, length).cursor()
         r = ''
         for cmd in commands:
             if xref and cmd.offset in cb.blocks:
@@ -560,8 +926,9 @@ class Disassembler:
                     if verbose >= 1: r += '%.4X' % cmd.argument
                     r += self.getMoreInfo(cmd, verbose)
 
-                if verbose >= 2 and len(opcodes.opcodes[cmd.opcode]) > 2:
-                    nT = parse.narrowText(opcodes.opcodes[cmd.opcode][2])
+                doc = self.commands.stream.docs[cmd.opcode]
+                if verbose >= 2 and doc is not None:
+                    nT = parse.narrowText(doc)
                     r += '\n' + parse.indentText(nT, 1)
             r += '\n'
         return r
@@ -37,6 +37,12 @@ except ImportError, err:
 from Decompilers.unpyc import parse
 from Decompilers.unpyc import disasm
 from Decompilers.unpyc import decompile
+from Decompilers.unpyc import structure
+from Decompilers.unpyc import cache
+from Decompilers.unpyc import timing
+
+##co_flags bit set for functions, not for module & class bodies
+CO_OPTIMIZED = 0x0001
 
 class CoParser:
     """
@@ -129,6 +135,7 @@ class CoParser:
             print "UNKNOWN DATA TYPE: %s"%(type(obj))  
             
     
+    @timing.timed("CoParser")
     def __init__(self, code_obj, verboseDisasm=False):
         """
         Pass in an unmarshalled code object for decompilation
@@ -180,6 +187,27 @@ class liveUnPYC(object):
            
         self.verbose = verbose
         self.debug   = debug
+        
+        ##Decompilation cache of the project, None to always decompile
+        self.cache = None
+        if pyretic and pyretic.use_cache:
+            self.cache = pyretic.get_cache()
+            
+        ##Code objects already decompiled by this instance, so identical
+        ## copies found elsewhere in the walk are only decompiled once
+        self.seen = cache.SeenCode()
+        
+        ##Time/step limits for structuring each code object, see structure.Budget
+        if pyretic:
+            self.budget = structure.Budget(pyretic.budget_seconds, pyretic.budget_steps)
+        else:
+            self.budget = structure.Budget()
+            
+        ##Function mapping a list of (marshalled code object, offset) tasks to
+        ## a list of (source, run info, timing records), in order, by handing
+        ## them to other processes which call nested_decompile. None to
+        ## decompile the functions of a module in this process
+        self.nested_map = None
 
                 
     def set_top_level_module(self, mod_name):
@@ -209,14 +237,25 @@ class liveUnPYC(object):
             mod_f.close()
             print "[-] Problem reading module '%s' : %s"%(mod_name, err)
             return ""
+        mod_f.close()
+        
+        return self.bytes_decompile(obf_bc, mod_name)
+    
+    
+    def bytes_decompile(self, obf_bc, mod_name):
+        """
+        Decompile the contents of an obfuscated .pyc/.pyo that has already been
+        read, e.g. a member of a zip archive
         
+        obf_bc   - the raw bytes of the .pyc/.pyo
+        mod_name - where the bytes came from, for messages
+        """
         ##Skip magic & time stampe (first 8 bytes) & unmarshel the series of 
         ## code objects
         ##IF THE MARSHALLER HAS CHANGED YOU MUST USE THAT MARSHALER 
         try:
             co=marshal.loads(obf_bc[8:])
         except Exception, err:
-            mod_f.close()
             print "[-] Problem unmarshaling module '%s' : %s"%(mod_name, err)
             return ""
             
@@ -571,34 +610,202 @@ class liveUnPYC(object):
         Do the in memory decompilation
         """
         print "[=] Decompiling %s"%(identity)
-       
+        
+        ##Source for an identical code object may already be in the cache
+        key = None
+        if self.cache:
+            key = self.cache.key(code_obj)
+            sc  = self.cache.get(key)
+            if sc is not None:
+                print "[+] Source for %s found in cache"%(identity)
+                return sc
+        
+        timing.begin(identity)
+        try:
+            sc, timed_out = self._decompile_co(code_obj, identity, verbose)
+        finally:
+            timing.end()
+        
+        ##Don't cache source that ran out of budget, a later run may have more
+        if key and not timed_out:
+            self.cache.put(key, sc)
+
+        return sc
+    
+    
+    def _decompile_co(self, code_obj, identity, verbose):
+        """
+        Parse, disassemble and decompile a code object not found in the cache
+        
+        Return:
+               (source code, timed out) - timed out is the (name, reason) of
+               the code objects that ran out of budget, the source is
+               complete only if there are none
+        """
         try:
             #parser = parse.Parser(f_code, raw=True)
             print "[+] Parsing code object of %s"%(code_obj)
             parser = CoParser(code_obj, verboseDisasm=verbose)
+            
+            ##An identical code object may already have been decompiled this run
+            seen_key = self.seen.key(parser.co)
+            found, sc, timed_out = self.seen.lookup(seen_key)
+            if found:
+                print "[+] Reusing source of identical code object for %s"%(identity)
+                ##Reported again, this copy is as incomplete as the first
+                self.budget.timedOut += timed_out
+                return (sc, timed_out)
+            
             print "[+] Disassembling.... "
             optimizingDisassembler = disasm.Disassembler(parser.co,
                                                        optimizeJumps=True)
             print "[+] Decompiling.... "        
-            decompiler = decompile.Decompiler(optimizingDisassembler)
+            decompiler = decompile.Decompiler(optimizingDisassembler,
+                                              seen=self.seen,
+                                              budget=self.budget)
             
         #TODO - try and get code that was decompiled before error
         except (parse.ParseErrorException,
                 parse.IOErrorException,
                 parse.BadFirstObjectException), err:
             print err
-            return ""
+            return ("", [])
         
         except:
             print '>>> Unexpected exception:'
             traceback.print_exc()
-            return ""
+            return ("", [])
     
+        if self.nested_map:
+            self._fan_out(code_obj, parser.co)
+            
         sc = decompiler.decompile()
+        self.seen.store(seen_key, sc, decompiler.timedOut)
 
+        return (sc, decompiler.timedOut)
+    
+    
+    def _nested_functions(self, code_obj, co):
+        """
+        Find the functions defined in a code object, including the methods of
+        the classes it defines. Class bodies are left to the decompilation of
+        the code object itself as they are little more than a list of defs,
+        functions nested in functions are left to their enclosing function
+        
+        Return:
+               [(raw code object, parse.pyCode), ...]
+        """
+        found = []
+        if len(code_obj.co_consts) != len(co.consts.value):
+            return found
+        
+        for (raw, parsed) in zip(code_obj.co_consts, co.consts.value):
+            ##Lambdas, generator expressions etc are decompiled where used
+            if type(raw) != types.CodeType or raw.co_name.startswith("<"):
+                continue
+            if raw.co_flags & CO_OPTIMIZED:
+                found.append((raw, parsed))
+            else:
+                found += self._nested_functions(raw, parsed)
+                
+        return found
+    
+    
+    def _fan_out(self, code_obj, co):
+        """
+        Decompile the functions defined in a code object with nested_map, so
+        in other processes, before the code object itself is decompiled. The
+        source is put where the decompiler looks for code objects it has
+        already seen, so is stitched in as it reaches each definition
+        """
+        tasks = []
+        keys  = []
+        for (raw, parsed) in self._nested_functions(code_obj, co):
+            key = self.seen.key(parsed)
+            if key is None or self.seen.known(key) or key in keys:
+                continue
+            try:
+                tasks.append((marshal.dumps(raw), 0))
+            except ValueError, err:
+                continue
+            keys.append(key)
+            
+        ##Not worth the trip to another process
+        if len(tasks) < 2:
+            return
+        
+        print "[+] Decompiling %d functions of %s in worker processes"%(len(tasks),
+                                                                        co.name.value)
+        try:
+            results = self.nested_map(tasks)
+        except Exception, err:
+            print "[-] Problem decompiling functions in worker processes, " \
+                  "decompiling them here instead: %s"%(err)
+            return
+        
+        for (key, (sc, info, records)) in zip(keys, results):
+            ##Failures are tried again here as the decompiler reaches them.
+            ## Functions that ran out of budget are reported when their
+            ## source is stitched in, once for each copy
+            if sc is not None:
+                self.seen.prefill(key, sc, info["timed_out"])
+            self.seen.saved += info["saved"]
+            timing.add_records(records)
+    
+    
+    def nested_decompile(self, co_bytes, offset):
+        """
+        Decompile a function or class body handed over by the nested_map of
+        another process
+        
+        co_bytes - marshalled code object
+        offset   - offset in the bytecode to decompile from
+        
+        Return:
+               source code unindented, None on failure
+        """
+        try:
+            parser = CoParser(marshal.loads(co_bytes))
+        except Exception, err:
+            print "[-] Problem parsing code object from another process: %s"%(err)
+            return None
+        
+        key = self.seen.key(parser.co, offset)
+        found, sc, timed_out = self.seen.lookup(key)
+        if found:
+            self.budget.timedOut += timed_out
+            return sc
+        
+        timing.begin(parser.co.name.value)
+        try:
+            try:
+                da = disasm.Disassembler(parser.co, optimizeJumps=True)
+                decompiler = decompile.Decompiler(da, seen=self.seen,
+                                                  budget=self.budget)
+                sc = decompiler.decompile(offset=offset)
+            except Exception, err:
+                print "[-] Problem decompiling %s: %s"%(parser.co.name.value, err)
+                return None
+        finally:
+            timing.end()
+            
+        self.seen.store(key, sc, decompiler.timedOut)
         return sc
     
     
+    def take_run_info(self):
+        """
+        Return what happened during the decompilations since the last call
+        
+        Return:
+               {"saved"     : decompilations skipped as identical code was seen,
+                "timed_out" : [(code object name, reason), ...] that ran out
+                              of structuring budget}
+        """
+        return {"saved"     : self.seen.take_saved(),
+                "timed_out" : self.budget.takeTimedOut()}
+    
+    
     def _is_new_style_class(self, cls):
         """
         Check to see if this is a new style class
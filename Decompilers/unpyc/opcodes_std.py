@@ -39,9 +39,13 @@ Constants are the following:
               representation.
     - rflags - reverse of flags mapping.
     - ropcodes - reverse of opcodes mapping.
+    - magic - .pyc magic number of the Python version the opcodes are for.
 
 '''
 
+# Python 2.6
+magic = '\xd1\xf2\r\n'
+
 opcodes = {
     ############# from opcodes.h #############
 
@@ -0,0 +1,174 @@
+#!/usr/bin/python
+
+# [The "BSD licence"]
+# Copyright (c) 2026 agent
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * The name of the author may not be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ''AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL agent BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+'''
+The active opcode table compiled into lists indexed by opcode byte, and
+swapping in a newly remapped table without a restart.
+
+'''
+
+##opcodes.py is a dict keyed by opcode byte, fine for generating a remap but
+## slow to hit once per instruction. It is compiled here into 256 slot lists
+## that are indexed by the opcode byte instead.
+##
+## ACTIVE is the one table the decompiler uses and is recompiled in place, so
+## after swap() the next decompilation uses the new table. Streams already
+## disassembled keep the lists they were made with.
+
+try:
+    from hashlib import sha1
+except ImportError:
+    ##Python 2.4
+    from sha import new as sha1
+
+##Module from the projects lib - possibly remapped
+import opcodes
+
+##What the argument of a jump is relative to
+JUMP_NONE     = 0
+JUMP_RELATIVE = 1   ##Bytes on from the end of the instruction
+JUMP_ABSOLUTE = 2   ##Offset in co_code
+
+##By mnemonic, as the mnemonics are what a remap does not change
+JUMP_KINDS = {"JUMP_FORWARD"         : JUMP_RELATIVE,
+              "JUMP_IF_FALSE"        : JUMP_RELATIVE,
+              "JUMP_IF_TRUE"         : JUMP_RELATIVE,
+              "FOR_ITER"             : JUMP_RELATIVE,
+              "SETUP_LOOP"           : JUMP_RELATIVE,
+              "SETUP_EXCEPT"         : JUMP_RELATIVE,
+              "SETUP_FINALLY"        : JUMP_RELATIVE,
+              "SETUP_WITH"           : JUMP_RELATIVE,
+              "JUMP_ABSOLUTE"        : JUMP_ABSOLUTE,
+              "CONTINUE_LOOP"        : JUMP_ABSOLUTE,
+              "POP_JUMP_IF_FALSE"    : JUMP_ABSOLUTE,
+              "POP_JUMP_IF_TRUE"     : JUMP_ABSOLUTE,
+              "JUMP_IF_FALSE_OR_POP" : JUMP_ABSOLUTE,
+              "JUMP_IF_TRUE_OR_POP"  : JUMP_ABSOLUTE}
+
+
+class OpcodeTable:
+    """
+    An opcodes.py module compiled into lists indexed by opcode byte. Bytes
+    that are not opcodes have a mnemonic of None, argument size 0 and no
+    jump kind.
+
+    names  - mnemonic of each opcode
+    sizes  - argument size in bytes
+    jumps  - JUMP_NONE, JUMP_RELATIVE or JUMP_ABSOLUTE
+    docs   - description from opcodes.py, None if it has none
+    cmp_op - COMPARE_OP argument names
+    magic  - .pyc magic number of the Python the opcodes are for, None if
+             opcodes.py doesn't say (e.g. a remapped table)
+    digest - hash of the opcodes and their argument sizes
+    """
+    def __init__(self, module = None):
+
+        ##opcodes dict the lists were compiled from
+        self.source = None
+
+        ##Times compile() has been called, to tell one table from the next
+        self.generation = 0
+
+        self.names  = [None] * 256
+        self.sizes  = [0] * 256
+        self.jumps  = [JUMP_NONE] * 256
+        self.docs   = [None] * 256
+        self.cmp_op = ()
+        self.magic  = None
+        self.digest = None
+
+        if module:
+            self.compile(module)
+
+
+    def compile(self, module):
+        """
+        Compile the opcodes dict of an opcodes.py module into this table. New
+        lists are made rather than the old ones changed, so anything that took
+        the old lists carries on using them consistently
+        """
+        table = module.opcodes
+
+        names = [None] * 256
+        sizes = [0] * 256
+        jumps = [JUMP_NONE] * 256
+        docs  = [None] * 256
+        h     = sha1()
+
+        for op in sorted(table.keys()):
+            entry     = table[op]
+            names[op] = entry[0]
+            sizes[op] = entry[1]
+            jumps[op] = JUMP_KINDS.get(entry[0], JUMP_NONE)
+            if len(entry) > 2:
+                docs[op] = entry[2]
+            h.update("%d:%s:%d;"%(op, entry[0], entry[1]))
+
+        self.names  = names
+        self.sizes  = sizes
+        self.jumps  = jumps
+        self.docs   = docs
+        self.cmp_op = module.cmp_op
+        self.magic  = getattr(module, "magic", None)
+        self.digest = h.hexdigest()
+        self.source = table
+        self.generation += 1
+
+
+    def __len__(self):
+        return 256 - self.names.count(None)
+
+
+##The table used for decompilation
+ACTIVE = OpcodeTable()
+
+
+def active():
+    """
+    Get the active opcode table, compiling it again first if opcodes.py has
+    been reloaded since it was last compiled (e.g. by a pool worker starting)
+    """
+    if ACTIVE.source is not opcodes.opcodes:
+        ACTIVE.compile(opcodes)
+
+    return ACTIVE
+
+
+def swap():
+    """
+    Reload opcodes.py and compile it into the active table. The project libs
+    dir is first on the path, so a remapped opcodes.py copied in there by
+    swap_opcodes is the one loaded. Nothing needs restarting, the next
+    decompilation uses the new table
+
+    Return:
+           the active table
+    """
+    reload(opcodes)
+    ACTIVE.compile(opcodes)
+
+    return ACTIVE
@@ -25,16 +25,21 @@
 # (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
+from bisect import bisect_left
 from copy import copy
+from heapq import heapify, heappop, heappush
 import re
+import time
 import traceback
 
 from ast import *
+import timing
 
 # mergeCompoundNodes
 from text import s_indentExText as indentExText, \
                  s_indentForText as indentForText, \
-                 s_indentText as indentText
+                 s_indentText as indentText, \
+                 Text
 
 def dbgprint(s):
     '''
@@ -43,6 +48,68 @@ def dbgprint(s):
     #print >> stderr, s
     pass
 
+class BudgetExceeded(Exception):
+    '''Raised when structuring a CFG runs out of its L{Budget}.'''
+    pass
+
+class Budget:
+    '''
+    Time and step limits for structuring the CFG of a single code object,
+    shared by all the code objects of a run. Names of code objects that ran
+    out are collected in timedOut.
+
+    '''
+
+    def __init__(self, seconds=None, steps=None):
+        '''
+        @param seconds: wall time allowed per code object, None for no limit.
+        @param steps: structuring steps allowed per code object, None for no
+            limit.
+
+        '''
+        self.seconds = seconds
+        self.steps = steps
+        self.timedOut = []
+
+    def start(self):
+        '''@return: L{BudgetClock} for a code object about to be structured.'''
+
+        return BudgetClock(self.seconds, self.steps)
+
+    def takeTimedOut(self):
+        '''
+        @return: (name, reason) of code objects that ran out since the last
+            call.
+
+        '''
+        r = self.timedOut
+        self.timedOut = []
+        return r
+
+class BudgetClock:
+    '''Spends a L{Budget} while one CFG is structured.'''
+
+    def __init__(self, seconds, steps):
+        self.deadline = None
+        if seconds:
+            self.deadline = time.time() + seconds
+        self.seconds = seconds
+        self.steps = steps
+        self.taken = 0
+
+    def tick(self):
+        '''
+        Called once per structuring step.
+
+        @raise BudgetExceeded: if the time or step limit has been reached.
+
+        '''
+        self.taken += 1
+        if self.steps and self.taken > self.steps:
+            raise BudgetExceeded('step budget of %d exceeded' % self.steps)
+        if self.deadline and time.time() > self.deadline:
+            raise BudgetExceeded('time budget of %ss exceeded' % self.seconds)
+
 class edge:
     '''Class that defines edge in CFG.'''
 
@@ -63,10 +130,124 @@ class edge:
         return '%s -(%s)-> %s' % \
                (str(self.fromNode), str(self.type), str(self.toNode))
 
+class edgeMap(list):
+    '''
+    Edges of a node in CFG. A list of the edges in the order they were
+    added, indexed by the node at the other end once there are enough of
+    them, so that renaming and removing the edges to one neighbour of a
+    node with thousands of edges does not mean scanning all of them.
+    See L{incomingEdges} and L{outgoingEdges}.
+
+    '''
+
+    # attribute of L{edge} naming the node at the other end
+    key = None
+    # fewer edges than this are scanned, scanning a handful of edges is
+    # cheaper than keeping an index of them
+    SCAN = 8
+    # name of the node at the other end -> [(seq, edge), ...]
+    byNode = None
+    # sequence number of each edge in the list, always sorted
+    seqs = None
+
+    def index(self):
+        '''
+        @return: edges by the name of the node at the other end.
+
+        '''
+        if self.byNode is None:
+            self.byNode = {}
+            self.seqs = range(len(self))
+            for seq in self.seqs:
+                e = self[seq]
+                self.byNode.setdefault(getattr(e, self.key), []).append(
+                    (seq, e))
+        return self.byNode
+
+    def append(self, e):
+        list.append(self, e)
+        if self.byNode is not None:
+            seq = self.seqs and self.seqs[-1] + 1 or 0
+            self.seqs.append(seq)
+            self.byNode.setdefault(getattr(e, self.key), []).append((seq, e))
+
+    def delete(self, seq):
+        index = bisect_left(self.seqs, seq)
+        del self[index]
+        del self.seqs[index]
+
+    def drop(self, name):
+        '''
+        Removes the first edge to (or from) node name, if there is one.
+
+        @param name: name of the node at the other end.
+
+        '''
+        if self.byNode is None and len(self) < self.SCAN:
+            key = self.key
+            for x in xrange(len(self)):
+                if getattr(self[x], key) == name:
+                    del self[x]
+                    return
+            return
+        edges = self.index().get(name)
+        if not edges:
+            return
+        self.delete(edges.pop(0)[0])
+        if not edges:
+            del self.byNode[name]
+
+    def rename(self, oldname, newname):
+        '''
+        Makes the edges to node oldname lead to node newname. The first of
+        them keeps its place, the rest are removed, and all of them are
+        removed if there already is an edge to newname.
+
+        @param oldname: previous name of the node at the other end.
+        @param newname: new name of the node at the other end.
+
+        '''
+        if self.byNode is None and len(self) < self.SCAN:
+            key = self.key
+            pos = []
+            found = False
+            for x in xrange(len(self)):
+                name = getattr(self[x], key)
+                if name == oldname:
+                    pos.append(x)
+                elif name == newname:
+                    found = True
+            if pos and not found:
+                setattr(self[pos.pop(0)], key, newname)
+            pos.reverse()
+            for x in pos:
+                del self[x]
+            return
+        edges = self.index().pop(oldname, None)
+        if edges is None:
+            return
+        if newname in self.byNode:
+            for (seq, e) in edges:
+                self.delete(seq)
+            return
+        setattr(edges[0][1], self.key, newname)
+        self.byNode[newname] = edges
+        while len(edges) > 1:
+            self.delete(edges.pop()[0])
+
+class incomingEdges(edgeMap):
+    '''Incoming edges of a node in CFG, by the node they come from.'''
+
+    key = 'fromNode'
+
+class outgoingEdges(edgeMap):
+    '''Outgoing edges of a node in CFG, by the node they lead to.'''
+
+    key = 'toNode'
+
 class node:
     '''Class that defines node in CFG.'''
 
-    # TODO: incoming and outgoing should be hashes
     # CAUTION: all calls should be done via named parameters!
     def __init__(self, name, incoming, outgoing,
                  conditional=True, loop=False, forloop=False,
@@ -74,8 +255,8 @@ class node:
                  code='', condition=None, offset=-1, length=-1):
         '''
         @param name: name of the node.
-        @param incoming: incoming edges.
-        @param outgoing: outgoing edges.
+        @param incoming: incoming edges (L{incomingEdges}).
+        @param outgoing: outgoing edges (L{outgoingEdges}).
         @param conditional: whether the node is conditional or not.
         @param loop: whether the node is a head of a loop or not.
         @param forloop: whether the node is a head of a forloop or not.
@@ -136,6 +317,34 @@ class graph:
         self.debugDrawComment = ''
         # counter for debugDraw
         self.incnum = 0
+        # L{BudgetClock} limiting structuring, None for no limit
+        self.clock = None
+        # names of the nodes changed since the last look, whose outgoing
+        # edges, code or kind changed (touched) or only whose incoming edges
+        # changed (touchedIn), None when nobody is looking
+        self.touched = None
+        self.touchedIn = None
+        # work done by simplifyAllCompound: passes over the graph, merges
+        # and nodes visited, and the nodes a full pass each time would visit
+        self.passes = 0
+        self.merges = 0
+        self.visits = 0
+        self.sweeps = 0
+
+    def tick(self):
+        '''One structuring step, see L{BudgetClock.tick}.'''
+
+        if self.clock is not None:
+            self.clock.tick()
+
+    def touch(self, *names):
+        '''
+        Notes nodes whose outgoing edges, code or kind were changed, see
+        L{simplifyAllCompound}.
+
+        '''
+        if self.touched is not None:
+            self.touched.update(names)
 
     def __str__(self):
         r = 'r:%s\n' % self.root
@@ -243,44 +452,31 @@ class graph:
         @param newname: new name of the node.
 
         '''
-        toDelete = []
-        for ie in self.nodes[oldname].incoming:
+        old = self.nodes[oldname]
+        for ie in old.incoming:
             if ie.fromNode == '0': continue
-            for x in xrange(len(self.nodes[ie.fromNode].outgoing)):
-                if self.nodes[ie.fromNode].outgoing[x].toNode == oldname:
-                    a = [e.toNode for e in self.nodes[ie.fromNode].outgoing]
-                    if newname not in a:
-                        self.nodes[ie.fromNode].outgoing[x].toNode = newname
-                    else:
-                        toDelete.append((ie.fromNode, x))
-        for (a, b) in toDelete:
-            del self.nodes[a].outgoing[b]
-        toDelete = []
-        for oe in self.nodes[oldname].outgoing:
-            for x in xrange(len(self.nodes[oe.toNode].incoming)):
-                if self.nodes[oe.toNode].incoming[x].fromNode == oldname:
-                    a = [e.fromNode for e in self.nodes[oe.toNode].incoming]
-                    if newname not in a:
-                        self.nodes[oe.toNode].incoming[x].fromNode = newname
-                    else:
-                        toDelete.append((oe.toNode, x))
-        for (a, b) in toDelete:
-            del self.nodes[a].incoming[b]
+            self.nodes[ie.fromNode].outgoing.rename(oldname, newname)
+        for oe in old.outgoing:
+            self.nodes[oe.toNode].incoming.rename(oldname, newname)
+        if self.touched is not None:
+            self.touched.add(newname)
+            self.touched.update([ie.fromNode for ie in old.incoming])
+            self.touchedIn.update([oe.toNode for oe in old.outgoing])
 
     def removeEdge(self, fromNode, toNode):
-        for index in xrange(len(fromNode.outgoing)):
-            if fromNode.outgoing[index].toNode == toNode.name:
-                del fromNode.outgoing[index]
-                break
-        for index in xrange(len(toNode.incoming)):
-            if toNode.incoming[index].fromNode == fromNode.name:
-                del toNode.incoming[index]
-                break
+        fromNode.outgoing.drop(toNode.name)
+        toNode.incoming.drop(fromNode.name)
+        if self.touched is not None:
+            self.touched.add(fromNode.name)
+            self.touchedIn.add(toNode.name)
 
     def addEdge(self, fromNode, toNode, type=''):
         e = edge(fromNode.name, toNode.name, type)
         fromNode.outgoing.append(e)
         toNode.incoming.append(e)
+        if self.touched is not None:
+            self.touched.add(fromNode.name)
+            self.touchedIn.add(toNode.name)
 
     def doDebugDraw(self):
         '''Save CFG as png image in current working directory.'''
@@ -391,6 +587,7 @@ class graph:
         del (self.nodes[x], self.nodes[y])
         
 
+    @timing.timed('simplifyComplexIFs')
     def simplifyComplexIFs(self):
         '''
         Structures short ciruit evaluation of conditions.
@@ -456,11 +653,12 @@ class graph:
             if x.code == '': x.code = 'pass\n'
             if isinstance(head.condition, CompareOp) and \
                head.condition.value == 'EXC_MATCH':
-                code = head.code + 'except ' + \
-                       str(head.condition.children[1]) + indentExText(x.code)
+                code = Text([head.code, 'except ' +
+                             str(head.condition.children[1]),
+                             indentExText(x.code)])
             else:
-                code = head.code + 'if ' + \
-                       str(head.condition) + ':\n' + indentText(x.code, 1)
+                code = Text([head.code, 'if ' + str(head.condition) + ':\n',
+                             indentText(x.code, 1)])
                        #+ '\n' + latch.code
             n = node(head.name, head.incoming, x.outgoing,
                      conditional=False, code=code, offset=head.offset)
@@ -470,18 +668,18 @@ class graph:
             if isinstance(head.condition, CompareOp) and \
                head.condition.value == 'EXC_MATCH':
                 if y.conditional:
-                    code = head.code + 'except ' + \
-                           str(head.condition.children[1]) + \
-                           indentExText(x.code) + y.code
+                    code = Text([head.code, 'except ' +
+                                 str(head.condition.children[1]),
+                                 indentExText(x.code), y.code])
                 else:
-                    code = head.code + 'except ' + \
-                           str(head.condition.children[1]) + \
-                           indentExText(x.code) + \
-                           'except:\n' + indentText(y.code, 1)
+                    code = Text([head.code, 'except ' +
+                                 str(head.condition.children[1]),
+                                 indentExText(x.code), 'except:\n',
+                                 indentText(y.code, 1)])
             else:
-                code = head.code + 'if ' + str(head.condition) + ':\n' + \
-                       indentText(x.code, 1) + \
-                       'else:\n' + indentText(y.code, 1)# + '\n' + latch.code
+                code = Text([head.code, 'if ' + str(head.condition) + ':\n',
+                             indentText(x.code, 1), 'else:\n',
+                             indentText(y.code, 1)])# + '\n' + latch.code
             n = node(head.name, head.incoming, x.outgoing,
                      conditional=False, code=code, offset=head.offset)
 
@@ -491,6 +689,7 @@ class graph:
         del self.nodes[x.name] #, self.nodes[latch.name])
         if y is not None: del self.nodes[y.name]
 
+    @timing.timed('preprocessWhileLoops')
     def preprocessWhileLoops(self):
         '''
         Finds while loops and marks first conditional node as unconditional.
@@ -574,6 +773,7 @@ class graph:
                 
                 self.removeEdge(loop, AF)
                 self.removeEdge(n, AL)
+                self.touch(forloop.name, AF.name)
                 return True
         else:
             try:
@@ -588,6 +788,7 @@ class graph:
                         fn.code = 'else:\n' + indentText(fn.code, 1)
                     self.removeEdge(loop, fn)
                     self.removeEdge(n, AL)
+                    self.touch(tn.name, fn.name)
                     return True
             except Exception, err:
                 print "[X] Rich exception caught", err
@@ -626,6 +827,7 @@ class graph:
                not tn.code.startswith('except:'):
                 if tn.code == '': tn.code = 'pass\n'
                 tn.code = 'except:\n' + indentText(tn.code, 1)
+                self.touch(tn.name)
                 changes = True
 
         # check if try block is structured
@@ -667,6 +869,7 @@ class graph:
                         if pn.outgoing[index2].type == 'ASF' and \
                            pn.outgoing[index2].toNode == n.name:
                             pn.outgoing[index2].type = 'ASF2'
+                    self.touch(n.name, pn.name)
                     changes = True
             if elsen is not None and len(En.outgoing) == 1 and \
                En.outgoing[0].toNode == elsen.outgoing[0].toNode:
@@ -682,6 +885,7 @@ class graph:
                 del self.nodes[dummyname]
                 self.addEdge(Tn, En)
                 self.addEdge(En, elsen)
+                self.touch(elsen.name)
                 changes = True
             elif elsen is None and len(En.outgoing) == 1 and \
                  En.outgoing[0].toNode == Tn.outgoing[0].toNode:
@@ -726,6 +930,7 @@ class graph:
                 latch = self.nodes[finallyn.outgoing[0].toNode]
                 self.removeEdge(finallyn, latch) # remove AE
                 self.addEdge(finallyn, latch)
+                self.touch(ASFn.name)
                 changes = True
         elif ASF2e is not None:
             # it is a try-except-(else)-finally case
@@ -747,10 +952,46 @@ class graph:
                 changes = True
         return changes
 
+    def predecessors(self, names, depth):
+        '''
+        @param names: names of nodes.
+        @param depth: how many edges back to go.
+        @return: set of the names and of the nodes up to depth edges before.
+
+        '''
+        res = set([x for x in names if x in self.nodes])
+        level = res
+        for i in xrange(depth):
+            found = set()
+            for x in level:
+                for e in self.nodes[x].incoming:
+                    if e.fromNode not in res and e.fromNode in self.nodes:
+                        found.add(e.fromNode)
+            res.update(found)
+            level = found
+        return res
+
+    @timing.timed('simplifyAllCompound')
     def simplifyAllCompound(self):
         '''
         Structures all compound statements (if/else, for, while, try/except).
 
+        Goes over the graph in passes, the nodes in postorder and then
+        L{simplifyConsecutive}, until a pass changes nothing. A pass only
+        visits the nodes that can structure differently than they did in the
+        pass before: the nodes changed since and the nodes up to two edges
+        before them, which is as far down the graph the if/else, loop and
+        finally patterns look, and the heads of try/except and try/finally
+        blocks, whose patterns look further. A node changed behind the one
+        being structured is still visited in the same pass, so on a
+        consistent graph the result and the number of passes are those of
+        sweeping every node each pass. Each pass ranks the nodes afresh, so
+        a corrupt graph fails as loudly: an edge leading to a node that is
+        gone raises KeyError in L{postorder}, and so does a node due in the
+        pass that is gone before its turn. Only the stage a corrupt graph
+        fails in can differ, as a pass may stop at a node the sweep would
+        have reached later.
+
         '''
         # TODO: test `if a is not in b' and such...
         # TODO: elif
@@ -759,34 +1000,105 @@ class graph:
         self.newDebugDrawIteration('simplifyAllCompound')
         self.doDebugDraw()
 
-        changes = True
-        while changes:
-            changes = False
-            pnodes = self.postorder()
-            
-            for nname in pnodes:
-                n = self.nodes[nname]
-                if n.conditional:
-                    changes = self.structureSingleConditional(n) or changes
-                elif n.loop:
-                    changes = self.structureSingleLoop(n) or changes
-                elif n.exceptNode:
-                    changes = self.structureSingleExcept(n) or changes
-                elif n.finallyNode:
-                    changes = self.structureSingleFinally(n) or changes
-            if changes:
-                self.doDebugDraw()
-   
-            changes = self.simplifyConsecutive() or changes
-         
-            self.newDebugDrawIteration('simplifyAllCompound')
+        # nodes to visit in the next pass, None for all of them
+        todo = None
+        heads = None
+        # nodes simplifyConsecutive has to look at, None for all of them
+        consecutive = None
+        self.touched = set()
+        self.touchedIn = set()
+        try:
+            changes = True
+            while changes:
+                changes = False
+                # postorder position of each node the graph leads to, ranked
+                # afresh each pass, see above
+                pnodes = self.postorder()
+                rank = {}
+                for nname in pnodes:
+                    if nname not in rank:
+                        rank[nname] = len(rank)
+                if todo is None:
+                    todo = set(rank)
+                    heads = [x for x in rank if self.nodes[x].exceptNode or \
+                                                self.nodes[x].finallyNode]
+                self.passes += 1
+                self.sweeps += len(pnodes)
+                nexttodo = set()
+                queued = set([x for x in todo if x in rank])
+                queue = [(rank[x], x) for x in queued]
+                heapify(queue)
+                while len(queue):
+                    (r, nname) = heappop(queue)
+                    queued.discard(nname)
+                    self.tick()
+                    self.visits += 1
+                    n = self.nodes[nname]
+                    res = False
+                    if n.conditional:
+                        res = self.structureSingleConditional(n)
+                    elif n.loop:
+                        res = self.structureSingleLoop(n)
+                    elif n.exceptNode:
+                        res = self.structureSingleExcept(n)
+                    elif n.finallyNode:
+                        res = self.structureSingleFinally(n)
+                    if res:
+                        self.merges += 1
+                        self.touch(nname)
+                        changes = True
+                    if not self.touched:
+                        continue
+                    for x in self.predecessors(self.touched, 2):
+                        if x not in rank or x in queued:
+                            continue
+                        if rank[x] > r:
+                            heappush(queue, (rank[x], x))
+                            queued.add(x)
+                        else:
+                            nexttodo.add(x)
+                    if consecutive is not None:
+                        consecutive.update(self.touched)
+                    self.touched = set()
+                # the incoming edges of a node only matter to the pattern of
+                # a try head and whether its predecessor can take it in
+                touchedIn = self.touchedIn
+                self.touchedIn = set()
+                if changes:
+                    self.doDebugDraw()
 
-    def simplifyConsecutive(self, verbose=0):
+                if consecutive is not None:
+                    consecutive = self.predecessors(consecutive, 1)
+                    for x in touchedIn:
+                        if x in self.nodes and \
+                           len(self.nodes[x].incoming) == 1:
+                            consecutive.add(self.nodes[x].incoming[0].fromNode)
+                changes = self.simplifyConsecutive(nodes=consecutive) or \
+                          changes
+
+                consecutive = self.touched
+                self.touched = set()
+                if changes:
+                    todo = self.predecessors(consecutive, 2)
+                    todo.update(nexttodo)
+                    todo.update([x for x in heads if x in self.nodes])
+
+                self.newDebugDrawIteration('simplifyAllCompound')
+        finally:
+            self.touched = None
+            self.touchedIn = None
+
+    @timing.timed('simplifyConsecutive')
+    def simplifyConsecutive(self, verbose=0, nodes=None):
         '''
         Simplify consecutive nodes.
 
+        @param nodes: names of the nodes to look at, None for all of them.
+
         '''
-        nodes = sorted(self.nodes.keys())
+        if nodes is None:
+            nodes = self.nodes.keys()
+        nodes = sorted(nodes)
 
         self.newDebugDrawIteration('simplifyConsecutive')
         self.doDebugDraw()
@@ -795,6 +1107,7 @@ class graph:
 
         for nname in nodes:
             if nname not in self.nodes: continue
+            self.tick()
             n = self.nodes[nname]
             # don't simplify if edge is After Exception edge (AE)
             
@@ -819,18 +1132,20 @@ class graph:
                and n.outgoing[0].type != 'AE':
 
                 c = self.nodes[n.outgoing[0].toNode]
-                code = n.code + c.code
+                code = Text([n.code, c.code])
                 nn = node(n.name, n.incoming, c.outgoing,
                           conditional=c.conditional, code=code,
                           condition=c.condition, offset=n.offset)
                 self.nodes[nname] = nn
                 self.updateEdges(c.name, n.name)
                 del self.nodes[c.name]
+                self.merges += 1
                 changes = True
 
                 self.doDebugDraw()
         return changes
 
+    @timing.timed('DFADecompile')
     def DFADecompile(self, dc):
         '''
         Decompiles code in all basic blocks, but doesn't do any structuring.
@@ -838,20 +1153,27 @@ class graph:
         @param dc: decompiler.
 
         '''
-        import copy
         visited = set()
-        DFAStack = [(self.root, [])]
+        DFAStack = [(self.root, ())]
         while len(DFAStack):
             (n, DecompileStack) = DFAStack.pop()
             if n not in visited:
                 visited.add(n)
+                # the list is this block's own, the nodes in it are shared
+                # with the other successors of the block before
+                DecompileStack = list(DecompileStack)
                 res = dc.codeDecompile(self.nodes[n].offset,
                                        self.nodes[n].length,
                                        stack=DecompileStack,
                                        mode='conditional')
                 (self.nodes[n].code, self.nodes[n].condition) = res
+                # one snapshot of the stack is handed to every successor,
+                # nodes on it are copied on write from here on
+                for o in DecompileStack:
+                    o.share()
+                DecompileStack = tuple(DecompileStack)
                 for e in self.nodes[n].outgoing:
-                    DFAStack.append((e.toNode, copy.deepcopy(DecompileStack)))
+                    DFAStack.append((e.toNode, DecompileStack))
 
     def savePythonGraph(self, filename):
         '''
@@ -879,14 +1201,14 @@ class graph:
         for n in self.nodes:
             if self.nodes[n].code != '':
                 if self.nodes[n].condition is not None:
-                    txt = re.sub(pattern1, r'\\l', self.nodes[n].code + \
+                    txt = re.sub(pattern1, r'\\l', str(self.nodes[n].code) + \
                           '\n\n' + str(self.nodes[n].condition))
                     txt = re.sub(pattern2, r'\\"', txt)
                     gr.add_node(n, [('label', '"' + txt + '"')])
                     #print '1:::'
                     #print txt
                 else:
-                    txt = re.sub(pattern1, r'\\l', self.nodes[n].code)
+                    txt = re.sub(pattern1, r'\\l', str(self.nodes[n].code))
                     txt = re.sub(pattern2, r'\\"', txt)
                     gr.add_node(n, [('label', '"' + txt + '"')])
                     #print '2:::'
@@ -979,13 +1301,16 @@ def readExGraph(filename):
                 i.append(edge(x, n[0]))
             for (x, t) in procTF(filter(filt, b[1].split(','))):
                 o.append(edge(n[0], x, t))
-            nodes[n[0]] = node(n[0], i, o, conditional=n[2], code=n[1])
+            nodes[n[0]] = node(n[0], incomingEdges(i),
+                               outgoingEdges(o),
+                               conditional=n[2], code=n[1])
             if root is None: root = n[0]
         except: pass
         s = f.readline()
     f.close()
     return graph(root, nodes)
 
+@timing.timed('getGraphFromCodeBlocks')
 def getGraphFromCodeBlocks(cb, debugDraw=False):
     '''
     Builds CFG from codeblocks.
@@ -1024,11 +1349,13 @@ def getGraphFromCodeBlocks(cb, debugDraw=False):
     for index in xrange(len(cbs)):
         toNode = cbs[index]
         if index < len(cbs) - 1:
-            nodes[toNode] = node(toNode, [], [], conditional=False,
+            nodes[toNode] = node(toNode, incomingEdges(),
+                                 outgoingEdges(), conditional=False,
                                  code=str(toNode), offset=toNode,
                                  length=cbs[index+1]-toNode)
         else:
-            nodes[toNode] = node(toNode, [], [], conditional=False,
+            nodes[toNode] = node(toNode, incomingEdges(),
+                                 outgoingEdges(), conditional=False,
                                  code=str(toNode), offset=toNode, length=0)
     for toNode in cbs:
         for ref in cb.blocks[toNode]:
@@ -1063,7 +1390,7 @@ if __name__ == '__main__':
         print g
         g.mergeComplexNodes('1', '2', 0)
         print g
-        g.mergeComplexNodes('1&2', '3&4', 1)
+        g.mergeComplexNodes('1', '3', 1)
         print g
         print g.postorder()
     g.simplifyComplexIFs()
@@ -36,8 +36,13 @@ INDENT = '\t'
 ASM_INDENT = '    '
 ASM_INDENT2 = '         '
 
+# start of every line that is not empty
+LINE_START = re.compile('^(?=.)', re.M)
+
 # from decompile
 def d_indentText(text, depth):
+    if isinstance(text, Text):
+        return text.render(depth)
     r = re.compile('^(?=.)', re.M)
     return r.sub(INDENT * depth, text)
 
@@ -101,10 +106,151 @@ def dropNewLines(text):
     return r.sub('', text)
 
 # from structure
-def s_indentExText(text):
+class Text:
+    '''
+    Source code made of fragments, strings or other L{Text}s, that are
+    only joined by L{render}. Merging basic blocks or indenting a block
+    wraps its code in a new L{Text} instead of copying it, so the
+    structuring of a big function is not quadratic in its size.
+
+    Lines from line skip on (0 or 1) are indented by depth, as
+    L{s_indentText} does to a string.
+
+    '''
+    def __init__(self, parts, depth=0, skip=0):
+        '''
+        @param parts: list of strings and L{Text}s, not to be changed later.
+        @param depth: indent of the lines.
+        @param skip: 1 to leave the first line unindented.
+
+        '''
+        self.parts = parts
+        self.depth = depth
+        self.skip = skip
+        # characters and newlines of the fragments and the last character,
+        # indentation only adds characters in front of others
+        self.size = 0
+        self.newlines = 0
+        self.last = ''
+        for p in parts:
+            if isinstance(p, Text):
+                self.size += p.size
+                self.newlines += p.newlines
+                if p.size: self.last = p.last
+            elif p:
+                self.size += len(p)
+                self.newlines += p.count('\n')
+                self.last = p[-1]
+
+    def render(self, depth=0, limit=None):
+        '''
+        Joins the fragments in one pass, indenting each line by the
+        indentation of the L{Text}s it starts in.
+
+        @param depth: indent of the whole text.
+        @param limit: stop once at least limit characters are made.
+        @return: the text as a string.
+
+        '''
+        out = []
+        made = 0
+        # running totals of indent over the open indenting L{Text}s, of
+        # all of them and of those that indent their first line
+        allDepth = [0, depth]
+        firstDepth = [0, depth]
+        # open L{Text}s from index mark on are at the start of a line,
+        # those before index seen have had a newline since they opened
+        mark = 0
+        seen = 0
+        stack = []
+        text = self
+        index = 0
+        if text.depth:
+            self._open(text, allDepth, firstDepth)
+        while True:
+            if index == len(text.parts):
+                if text.depth:
+                    allDepth.pop()
+                    firstDepth.pop()
+                    top = len(allDepth) - 1
+                    if mark > top: mark = top
+                    if seen > top: seen = top
+                if not stack: break
+                (text, index) = stack.pop()
+                continue
+            part = text.parts[index]
+            index += 1
+            if isinstance(part, Text):
+                stack.append((text, index))
+                text = part
+                index = 0
+                if text.depth:
+                    self._open(text, allDepth, firstDepth)
+                continue
+            if not part:
+                continue
+            top = len(allDepth) - 1
+            k = part.find('\n')
+            if k == -1: line = part
+            else: line = part[:k]
+            if line:
+                if mark < top:
+                    if mark < seen:
+                        tabs = allDepth[seen] - allDepth[mark] + \
+                               firstDepth[top] - firstDepth[seen]
+                    else:
+                        tabs = firstDepth[top] - firstDepth[mark]
+                    if tabs: out.append(INDENT * tabs)
+                    mark = top
+                out.append(line)
+            if k != -1:
+                # after a newline every open L{Text} is at a line start
+                # and indents the line fully
+                rest = part[k + 1:]
+                if rest and allDepth[top]:
+                    rest = LINE_START.sub(INDENT * allDepth[top], rest)
+                out.append('\n')
+                out.append(rest)
+                seen = top
+                if rest == '' or rest[-1] == '\n': mark = 0
+                else: mark = top
+            if limit is not None:
+                made += len(part)
+                if made >= limit: break
+        return ''.join(out)
+
+    def _open(self, text, allDepth, firstDepth):
+        allDepth.append(allDepth[-1] + text.depth)
+        if text.skip:
+            firstDepth.append(firstDepth[-1])
+        else:
+            firstDepth.append(firstDepth[-1] + text.depth)
+
+    def startswith(self, prefix):
+        return self.render(limit=len(prefix)).startswith(prefix)
+
+    def __add__(self, other):
+        return Text([self, other])
+
+    def __radd__(self, other):
+        return Text([other, self])
+
+    def __eq__(self, other):
+        if isinstance(other, Text): other = other.render()
+        if not isinstance(other, basestring): return False
+        # indentation never makes the text shorter
+        if self.size > len(other): return False
+        return self.render() == other
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __str__(self):
+        return self.render()
+
+def _indentExString(text):
     depth = 1
     skip = 1
-    if text == '': text = 'pass\n'
     list = text.split('\n')
 
     if len(list) >= 1:
@@ -117,24 +263,22 @@ def s_indentExText(text):
         index += 1
     return '\n'.join(list)
 
+def s_indentExText(text):
+    if text == '': text = 'pass\n'
+    if isinstance(text, Text): first = text.render(limit=1)[:1]
+    else: first = text[:1]
+    if first in ('#', '\n'):
+        # "# as name" opening the block goes onto the except line, rare
+        # enough to be done on the joined text
+        if isinstance(text, Text): text = text.render()
+        return _indentExString(text)
+    return Text([':\n', Text([text], 1)])
+
 def s_indentText(text, depth, skip=0):
-    list = text.split('\n')
-    index = skip
-    while index < len(list):
-        # TODO: use common indent variable
-        if list[index] != '': list[index] = INDENT * depth + list[index]
-        index += 1
-    return '\n'.join(list)
+    return Text([text], depth, skip)
 
 def s_indentForText(text):
-    skip = 1
-    depth = 1
-    list = text.split('\n')
-    if len(list) == 2 and list[1] == '':
-        list[1] = 'pass'
-    index = skip
-    while index < len(list):
-        # TODO: use common indent variable
-        if list[index] != '': list[index] = INDENT * depth + list[index]
-        index += 1
-    return '\n'.join(list)
\ No newline at end of file
+    if not isinstance(text, Text): text = Text([text])
+    if text.newlines == 1 and text.last == '\n':
+        return Text([text, INDENT + 'pass'])
+    return Text([text], 1, 1)
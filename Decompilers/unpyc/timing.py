@@ -0,0 +1,378 @@
+#!/usr/bin/python
+
+# [The "BSD licence"]
+# Copyright (c) 2026 agent
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * The name of the author may not be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ''AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL agent BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+'''
+Per stage wall time and call counts for each code object that goes
+through the UnPyc pipeline.
+
+'''
+
+##Stage times are exclusive, time spent in a stage called from inside another
+## (e.g. simplifyConsecutive from simplifyAllCompound, or the stages of a nested
+## function decompiled during its parents DFADecompile) only counts towards the
+## inner stage, so the stage totals add up to the time actually spent. The per
+## code object 'self' time excludes nested code objects so the slowest report
+## points at the function that is actually slow
+
+import sys
+import time
+
+try:
+    import json
+    CAN_JSON = True
+except ImportError:
+    try:
+        import simplejson as json
+        CAN_JSON = True
+    except ImportError:
+        CAN_JSON = False
+
+try:
+    import resource
+    CAN_RESOURCE = True
+except ImportError:
+    ##Not on Windows
+    CAN_RESOURCE = False
+
+##Off unless switched on, when off each timed stage costs one flag check
+ENABLED = False
+
+##Also attribute growth of the process peak memory to the stage it happened in
+TRACK_MEMORY = False
+
+##Every code object timed since the last reset, in the order they were started
+_records = []
+
+##Code objects currently being decompiled, innermost last
+_active  = []
+
+##Exclusive seconds & peak memory growth recorded by all stages so far, so an
+## outer stage can subtract what the stages it called have already claimed
+_claimed = {"seconds" : 0.0, "peak_kb" : 0}
+
+
+def peak_rss():
+    """
+    Return:
+           peak resident memory of this process in KB, 0 if unknown
+    """
+    if not CAN_RESOURCE:
+        return 0
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        ##Reported in bytes rather than KB
+        peak = peak / 1024
+    return peak
+
+
+class CodeTiming:
+    """
+    Timings for the decompilation of a single code object
+    """
+    def __init__(self, name):
+
+        self.name   = name
+
+        ##stage name -> [calls, seconds, peak memory growth KB]
+        self.stages = {}
+
+        ##counter name -> count, e.g. the passes structuring took
+        self.counters = {}
+
+        ##Wall time from begin() to end() and the part of it spent on nested
+        ## code objects
+        self.total  = 0.0
+        self.nested = 0.0
+
+        self._start = None
+
+
+    def add(self, stage, elapsed, growth = 0):
+
+        if stage not in self.stages:
+            self.stages[stage] = [0, 0.0, 0]
+        self.stages[stage][0] += 1
+        self.stages[stage][1] += elapsed
+        self.stages[stage][2] += growth
+
+
+    def self_time(self):
+
+        return self.total - self.nested
+
+
+    def to_dict(self):
+
+        stages = {}
+        for stage, (calls, seconds, growth) in self.stages.items():
+            stages[stage] = {"calls" : calls, "seconds" : seconds,
+                             "peak_growth_kb" : growth}
+
+        return {"name" : self.name, "total" : self.total, "nested" : self.nested,
+                "self" : self.self_time(), "stages" : stages,
+                "counters" : dict(self.counters)}
+
+
+def _from_dict(d):
+
+    rec = CodeTiming(d["name"])
+    rec.total  = d["total"]
+    rec.nested = d["nested"]
+    for stage, s in d["stages"].items():
+        rec.stages[stage] = [s["calls"], s["seconds"], s.get("peak_growth_kb", 0)]
+    rec.counters = dict(d.get("counters", {}))
+
+    return rec
+
+
+def enable(memory = False):
+    """
+    memory - also track peak memory growth per stage, costs a getrusage()
+             call either side of every stage
+    """
+    global ENABLED, TRACK_MEMORY
+    ENABLED      = True
+    TRACK_MEMORY = memory and CAN_RESOURCE
+
+
+def disable():
+
+    global ENABLED, TRACK_MEMORY
+    ENABLED      = False
+    TRACK_MEMORY = False
+
+
+def reset():
+    """
+    Throw away all timings gathered so far
+    """
+    del _records[:]
+    del _active[:]
+
+
+def begin(name):
+    """
+    Start timing a code object, stages run until the matching end() are
+    attributed to it. Nested code objects are named after their parent
+    """
+    if not ENABLED:
+        return
+
+    if _active:
+        name = "%s/%s"%(_active[-1].name, name)
+
+    rec = CodeTiming(name)
+    _records.append(rec)
+    _active.append(rec)
+    rec._start = time.time()
+
+
+def end():
+    """
+    Stop timing the code object from the matching begin()
+    """
+    if not ENABLED or not _active:
+        return
+
+    rec = _active.pop()
+    rec.total = time.time() - rec._start
+    if _active:
+        _active[-1].nested += rec.total
+
+
+def timed(stage):
+    """
+    Decorator recording a call of the wrapped function as the named stage of
+    the code object currently being timed
+    """
+    def decorator(func):
+
+        def wrapper(*args, **kwargs):
+
+            if not ENABLED or not _active:
+                return func(*args, **kwargs)
+
+            rec           = _active[-1]
+            inner_seconds = _claimed["seconds"]
+            inner_growth  = _claimed["peak_kb"]
+            if TRACK_MEMORY:
+                start_peak = peak_rss()
+            start = time.time()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                elapsed = time.time() - start - (_claimed["seconds"] - inner_seconds)
+                _claimed["seconds"] += elapsed
+                
+                growth = 0
+                if TRACK_MEMORY:
+                    growth = peak_rss() - start_peak - (_claimed["peak_kb"] - inner_growth)
+                    _claimed["peak_kb"] += growth
+                    
+                rec.add(stage, elapsed, growth)
+
+        wrapper.__name__ = func.__name__
+        wrapper.__doc__  = func.__doc__
+        return wrapper
+
+    return decorator
+
+
+def count(counter, n = 1):
+    """
+    Add n to the named counter of the code object currently being timed
+    """
+    if not ENABLED or not _active:
+        return
+
+    rec = _active[-1]
+    rec.counters[counter] = rec.counters.get(counter, 0) + n
+
+
+def take_records():
+    """
+    Return the finished records as dicts and forget them, used to ship timings
+    from worker processes back to the parent
+    """
+    finished = [rec.to_dict() for rec in _records if rec not in _active]
+    _records[:] = [rec for rec in _records if rec in _active]
+    return finished
+
+
+def add_records(records):
+    """
+    Add records taken by take_records() in another process
+    """
+    for d in records:
+        _records.append(_from_dict(d))
+
+
+def record_count():
+    """
+    Return:
+           number of code objects timed since the last reset
+    """
+    return len(_records)
+
+
+def stage_totals():
+    """
+    Return:
+           {stage name : [calls, seconds, peak memory growth KB, code objects]}
+           summed over every code object
+    """
+    totals = {}
+    for rec in _records:
+        for stage, (calls, seconds, growth) in rec.stages.items():
+            if stage not in totals:
+                totals[stage] = [0, 0.0, 0, 0]
+            totals[stage][0] += calls
+            totals[stage][1] += seconds
+            totals[stage][2] += growth
+            totals[stage][3] += 1
+
+    return totals
+
+
+def counter_totals():
+    """
+    Return:
+           {counter name : total} summed over every code object
+    """
+    totals = {}
+    for rec in _records:
+        for counter, n in rec.counters.items():
+            totals[counter] = totals.get(counter, 0) + n
+
+    return totals
+
+
+def slowest(top = 10):
+    """
+    Return:
+           the top N CodeTimings ordered by self time, slowest first
+    """
+    recs = [(rec.self_time(), rec) for rec in _records]
+    recs.sort()
+    recs.reverse()
+    return [rec for (t, rec) in recs[:top]]
+
+
+def export_json(filename):
+    """
+    Write every record and the per stage and counter totals to a JSON file
+
+    Return:
+           True on success
+    """
+    if not CAN_JSON:
+        print "[-] json / simplejson module unavailable, cannot export timings"
+        return False
+
+    totals = {}
+    for stage, (calls, seconds, growth, code_objects) in stage_totals().items():
+        totals[stage] = {"calls" : calls, "seconds" : seconds,
+                         "peak_growth_kb" : growth, "code_objects" : code_objects}
+
+    data = {"stages"       : totals,
+            "counters"     : counter_totals(),
+            "code_objects" : [rec.to_dict() for rec in _records]}
+    try:
+        f = open(filename, "w")
+        json.dump(data, f, indent = 1, sort_keys = True)
+        f.close()
+    except (IOError, OSError), err:
+        print "[-] Problem writing timings to %s : %s"%(filename, err)
+        return False
+
+    print "[+] Timings of %d code objects written to %s"%(len(_records), filename)
+    return True
+
+
+def report(top = 10):
+    """
+    Print the per stage totals and the top N slowest code objects
+    """
+    totals = stage_totals().items()
+    totals.sort(lambda a, b: cmp(b[1][1], a[1][1]))
+
+    print "[=] Timed %d code objects"%(len(_records))
+    print "[=] %-24s %10s %12s"%("Stage", "Calls", "Seconds")
+    for stage, (calls, seconds, growth, code_objects) in totals:
+        print "[=] %-24s %10d %12.4f"%(stage, calls, seconds)
+
+    counters = counter_totals().items()
+    if counters:
+        counters.sort()
+        print "[=] %-24s %10s"%("Counter", "Total")
+        for counter, n in counters:
+            print "[=] %-24s %10d"%(counter, n)
+
+    print "[=] Slowest %d code objects (self / total seconds):"%(top)
+    for rec in slowest(top):
+        print "[=] %10.4f %10.4f  %s"%(rec.self_time(), rec.total, rec.name)
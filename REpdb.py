@@ -128,6 +128,43 @@ class REpdb(pdb.Pdb):
                     pass
                 
         
+    def __swap_opcode_table(self, verbose = True):
+        """
+        Load the opcodes.py in the project libs dir as the opcode table UnPYC
+        decompiles with. The active table is replaced in place, so a remap takes
+        effect at the next decompilation without restarting REpdb or losing the
+        state of the process we are attached to
+        
+        Return boolean
+        """
+        try:
+            from Decompilers.unpyc import optable
+            table = optable.swap()
+            
+        except Exception, err:
+            print "[-] Problem loading the opcode table : %s"%(err)
+            print "[!!] *Restart REpdb for the new opcode table to take effect*"
+            return False
+        
+        if verbose:
+            print "[+] Opcode table from %s now used for decompilation (%d opcodes)"%(optable.opcodes.__file__, len(table))
+        return True
+    
+    
+    def __drop_compiled(self, py_file):
+        """
+        Remove the .pyc/.pyo of a module file that has just been copied over, a
+        copy made in the same second as the old .pyc would otherwise not be
+        seen as newer by reload
+        """
+        for ext in ["c", "o"]:
+            try:
+                os.remove(py_file + ext)
+            except OSError:
+                ##Not there
+                pass
+        
+        
     def do_show(self, args):
         """
         Print out all the current settings for this REpdb project
@@ -524,6 +561,7 @@ class REpdb(pdb.Pdb):
         self.do_set_version(p_ver)
         
         self.__reload_modules()
+        self.__swap_opcode_table(verbose = False)
         
         
     def switch_project(self, name):
@@ -560,6 +598,7 @@ class REpdb(pdb.Pdb):
         self.remap_complete()
         
         self.__reload_modules()
+        self.__swap_opcode_table(verbose = False)
         
         
     def does_project_exist(self, name):
@@ -597,23 +636,86 @@ class REpdb(pdb.Pdb):
         self.remap_complete()
 
 
-    def do_fs_um_decompile(self, path = None):
+    def do_fs_um_decompile(self, args = None):
         """
         Decompile obfuscated bytecode by traversing the filesystem from a given
         start point and using the current runtimes marshal module to unmarshal
         the bytecode of each .pyc found.
         
+        An optional number of worker processes can be given to decompile a
+        directory in parallel, output is still written in the same order.
+        
+        The path can also be a zip archive such as a py2exe library.zip or an
+        egg, its members are decompiled without being extracted.
+        
+        Each file processed is recorded in the project manifest as it finishes,
+        adding 'resume' skips files an earlier (perhaps killed) run already
+        decompiled completely and which have not changed since.
+        
+        The walk can be limited with depth=<levels below the path>, and with
+        include=<glob> / exclude=<glob> (each can be given more than once)
+        matched against file & directory names or their path below the start
+        point. Excluded directories are never walked into. 'dryrun' only lists
+        and counts the files that would be decompiled.
+        
+        nested=<number of workers> decompiles the functions and methods of each
+        module in that many worker processes instead, so a single huge module
+        uses more than one core. It is not used when a number of workers for
+        the files is given as well.
+        
         Note: If the current obfuscated runtime does not have the marshal module
               available then this decompilation technique cannot be used.
               
-        usage: fs_um_decompile <path to obfuscated pyc's>
+        usage: fs_um_decompile <path to obfuscated pyc's> [number of workers] [resume]
+                               [depth=N] [include=<glob>] [exclude=<glob>] [dryrun]
+                               [nested=N]
         example: fs_um_decompile /tmp/foo.app/Contents/Resources/runtime/site_packages/
+        example: fs_um_decompile /tmp/foo.app/Contents/Resources/runtime/site_packages/ 8
+        example: fs_um_decompile /tmp/foo.app/Contents/Resources/runtime/site_packages/ 8 resume
+        example: fs_um_decompile /tmp/foo/dist/library.zip
+        example: fs_um_decompile /tmp/foo/site_packages/ exclude=test* exclude=*/vendor depth=3 dryrun
+        example: fs_um_decompile /tmp/foo/site_packages/huge_module.pyc nested=8
         """
-        if not path:
+        if not args:
             print "[-] No path to begin decompilation from specified"
             return
+        
+        ##Paths may contain spaces so only trailing words are taken as the
+        ## worker count & options
+        path    = args.strip()
+        workers = 1
+        resume  = False
+        dry_run = False
+        depth   = None
+        nested  = 1
+        include = []
+        exclude = []
+        while True:
+            split_args = path.rsplit(" ", 1)
+            if len(split_args) != 2:
+                break
+            opt = split_args[1]
+            if opt.isdigit():
+                workers = int(opt)
+            elif opt.lower() == "resume":
+                resume  = True
+            elif opt.lower() == "dryrun":
+                dry_run = True
+            elif opt.startswith("depth=") and opt[6:].isdigit():
+                depth   = int(opt[6:])
+            elif opt.startswith("nested=") and opt[7:].isdigit():
+                nested  = int(opt[7:])
+            elif opt.startswith("include=") and opt[8:]:
+                include.insert(0, opt[8:])
+            elif opt.startswith("exclude=") and opt[8:]:
+                exclude.insert(0, opt[8:])
+            else:
+                break
+            path = split_args[0].strip()
 
-        self.pyretic.fs_unmarshal(path)
+        self.pyretic.fs_unmarshal(path, depth = depth, workers = workers, resume = resume,
+                                  include = include, exclude = exclude, dry_run = dry_run,
+                                  nested = nested)
 
 
     def do_fs_mem_decompile(self, path = None):
@@ -730,7 +832,7 @@ class REpdb(pdb.Pdb):
         ##Swap in the newly generated opcodes
         self.do_swap_opcodes()
         
-        print "[+] Automatic remapping of opcodes complete. Please restart to use the new opcode tables in decompilation"
+        print "[+] Automatic remapping of opcodes complete, the new opcode tables are being used for decompilation"
         
     
 
@@ -943,28 +1045,16 @@ class REpdb(pdb.Pdb):
     
                 ##Copy over
                 shutil.copyfile(remap_name, curr_name)
+                self.__drop_compiled(curr_name)
                 self.do_module_restore = False
                 
-                #TODO force reload
-                ##live.reload()
-                
             except Exception, err:
                 print "[-] Error copying a file: %s"%(err)
                 
         print "[+] New opcode maps copied"
-        print "[!!] *MUST restart REpdb for changes to take effect*"
         
-##        ##Reload stdlib modules
-##        self.__reload_modules()
-##        
-##        if "OpcodeRemap" not in sys.modules.keys():
-##            print "IMPORT"
-##            from OpcodeRemap import OpcodeRemap
-##            OpcodeRemap.opcode.__file__
-##        else:
-##            print "RELOAD"
-##            OpcodeRemap = reload(OpcodeRemap)
-##            OpcodeRemap.opcode.__file__
+        ##Hot swap the opcode table, the next decompilation uses the remap
+        self.__swap_opcode_table()
 
 
             
@@ -989,16 +1079,15 @@ class REpdb(pdb.Pdb):
             try:
                 shutil.copyfile(os.path.join(self.pyretic.get_project_mod_dir(), "%s_orig.py"%(f)),
                                 os.path.join(self.pyretic.get_project_mod_dir(), "%s.py"%(f)))
+                self.__drop_compiled(os.path.join(self.pyretic.get_project_mod_dir(), "%s.py"%(f)))
                 
                 print "[+] Restored original %s.py"%(f)
                 
             except Exception, err:
                 print "[-] Error copying file: %s"%(err)
                 
-        #print "[=] *MUST* restart REpdb for changes to take effect"
-        #TODO force reload
-        ##live.reload()
         self.__reload_modules()
+        self.__swap_opcode_table()
 
 
     def do_recompile(self, path):
@@ -1041,6 +1130,113 @@ class REpdb(pdb.Pdb):
         ##debugger activity
         return pdb.bdb.Bdb.trace_dispatch(self, frame, event, arg)
         
+    def do_cache(self, args):
+        """
+        Inspect or manage the decompilation cache of the current project.
+        Source code for a code object is reused from the cache when both the
+        code object and the opcode table match a previous decompilation
+        
+        stats          - show entries, size on disk and hit/miss counts
+        clear          - remove all entries
+        max_size <MB>  - set the size at which old entries are evicted
+        
+        Usage: cache stats|clear|max_size <MB>
+        """
+        args = args.split()
+        if not args:
+            print "[-] Usage: cache stats|clear|max_size <MB>"
+            return
+        
+        cache = self.pyretic.get_cache()
+        
+        if args[0] == "stats":
+            cache.display_stats()
+            
+        elif args[0] == "clear":
+            print "[+] Removed %d entries from %s"%(cache.clear(), cache.cache_dir)
+            
+        elif args[0] == "max_size" and len(args) == 2 and args[1].isdigit():
+            cache.max_size = int(args[1]) * 1024 * 1024
+            print "[+] Decompilation cache maximum size set to %sMB"%(args[1])
+            
+        else:
+            print "[-] Usage: cache stats|clear|max_size <MB>"
+            
+        
+    def do_set_budget(self, args):
+        """
+        Set how long the decompiler may spend structuring the control flow of
+        any one function before giving up and outputting its basic blocks
+        unstructured (as #[NODE: ...] blocks), so one pathological function
+        cannot stall a whole run. Functions that run out are listed at the
+        end of the run. 0 means no limit
+        
+        Usage: set_budget <seconds> [steps]
+        """
+        args = args.split()
+        if not args or len(args) > 2 or not "".join(args).isdigit():
+            print "[-] Usage: set_budget <seconds> [steps]"
+            return
+        
+        self.pyretic.budget_seconds = int(args[0]) or None
+        if len(args) == 2:
+            self.pyretic.budget_steps = int(args[1]) or None
+            
+        print "[+] Structuring budget per code object: %s seconds, %s steps"%(
+            self.pyretic.budget_seconds or "unlimited", self.pyretic.budget_steps or "unlimited")
+        
+        
+    def do_timing(self, args):
+        """
+        Record wall time and call counts of each decompilation stage (CoParser,
+        disassembly, code blocks, CFG, DFA decompile, each simplify pass) for
+        every code object decompiled. Timings build up over decompile runs
+        until reset
+        
+        on / off        - start / stop recording
+        reset           - throw away the timings recorded so far
+        report [N]      - show per stage totals and the N slowest code objects
+        export [file]   - write all timings as JSON, default timing.json in the project
+        
+        Usage: timing on|off|reset|report [N]|export [file]
+        """
+        #TODO - make decompiler independent
+        from Decompilers.unpyc import timing
+        
+        args = args.split()
+        if not args:
+            print "[-] Usage: timing on|off|reset|report [N]|export [file]"
+            return
+        
+        if args[0] == "on":
+            timing.enable()
+            print "[+] Stage timing on"
+            
+        elif args[0] == "off":
+            timing.disable()
+            print "[+] Stage timing off"
+            
+        elif args[0] == "reset":
+            timing.reset()
+            print "[+] Stage timings reset"
+            
+        elif args[0] == "report":
+            if len(args) > 1 and args[1].isdigit():
+                timing.report(int(args[1]))
+            else:
+                timing.report()
+                
+        elif args[0] == "export":
+            if len(args) > 1:
+                filename = args[1]
+            else:
+                filename = os.path.join(self.pyretic.get_projectdir(), "timing.json")
+            timing.export_json(filename)
+            
+        else:
+            print "[-] Usage: timing on|off|reset|report [N]|export [file]"
+            
+            
     ##Extra none decompile related functionality
     def do_set_callgraph_exclude(self, excludes):
         """
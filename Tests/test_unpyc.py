@@ -0,0 +1,302 @@
+#!/usr/bin/env python
+##WingHeader v1
+###############################################################################
+## File       :  test_unpyc.py
+## Description:  Tests of the UnPyc decompilation pipeline as driven by pyREtic
+## Created_On :  Sun Oct 18 19:20:12 2026
+## Created_By :  agent
+## Modified_On:
+## Modified_By:
+## License    :  GPLv3 (Docs/LICENSE.txt)
+##
+## (c) Copyright 2026, agent all rights reserved.
+###############################################################################
+
+##python Tests/test_unpyc.py
+
+import os
+import sys
+import shutil
+import tempfile
+import types
+import zipfile
+import unittest
+import py_compile
+
+MODULE_LOCATION = os.path.dirname(os.path.abspath(__file__))
+PYRETIC_ROOT    = os.path.dirname(MODULE_LOCATION)
+
+sys.path.insert(0, PYRETIC_ROOT)
+
+import pyREtic
+
+##A function that takes far more structuring steps than the module defining it
+SHARED_FUNCTION = "def shared(a, b):\n" + \
+                  "".join(["    for i in g(a, %d):\n        b = b + i\n"%(j)
+                           for j in range(30)]) + \
+                  "    return b\n"
+
+
+class QuietTestCase(unittest.TestCase):
+    """
+    Sends the decompiler's chatter to /dev/null and gives each test a project
+    of its own in a temp dir
+    """
+    def setUp(self):
+
+        self.tmp_dir = tempfile.mkdtemp()
+        self.real_stdout = sys.stdout
+        sys.stdout = open(os.devnull, "w")
+
+
+    def tearDown(self):
+
+        sys.stdout.close()
+        sys.stdout = self.real_stdout
+        shutil.rmtree(self.tmp_dir)
+
+
+    def write_module(self, name, source):
+        """
+        Compile source to <tmp dir>/modules/<name>.pyc
+
+        Return:
+               directory of the module
+        """
+        mod_dir = os.path.join(self.tmp_dir, "modules")
+        if not os.path.isdir(mod_dir):
+            os.makedirs(mod_dir)
+
+        location = os.path.join(mod_dir, name + ".py")
+        f = open(location, "w")
+        f.write(source)
+        f.close()
+        py_compile.compile(location, doraise = True)
+        os.remove(location)
+
+        return mod_dir
+
+
+class BudgetTest(QuietTestCase):
+
+    def test_shared_timeout(self):
+        """
+        A function vendored into two modules that runs out of budget leaves
+        both modules partial, the second copy is reused but is no more complete
+        """
+        for name in ("mod_a", "mod_b"):
+            mod_dir = self.write_module(name, SHARED_FUNCTION + "x = 1\n")
+
+        p = pyREtic.pyREtic(write_source = False, project_name = "test",
+                            project_root = self.tmp_dir, budget_steps = 40)
+        summary = p.fs_unmarshal(mod_dir)
+
+        timed_out = [(os.path.basename(f), name.split()[0])
+                     for (f, name, reason) in summary.timed_out]
+        timed_out.sort()
+        self.assertEqual(timed_out, [("mod_a.pyc", "shared"),
+                                     ("mod_b.pyc", "shared")])
+
+        manifest = pyREtic.RunManifest(p.get_manifest_path())
+        self.assertEqual(len(manifest.entries), 2)
+        for (status, duration, mtime, size) in manifest.entries.values():
+            self.assertEqual(status, pyREtic.RunManifest.PARTIAL)
+
+        self.assertEqual(p.get_cache().disk_usage()[0], 0)
+
+
+    def test_complete_cached(self):
+        """
+        Modules structured within budget are cached, copies of the same code
+        included
+        """
+        for name in ("mod_a", "mod_b"):
+            mod_dir = self.write_module(name, SHARED_FUNCTION + "x = 1\n")
+
+        p = pyREtic.pyREtic(write_source = False, project_name = "test",
+                            project_root = self.tmp_dir)
+        summary = p.fs_unmarshal(mod_dir)
+
+        self.assertEqual(summary.timed_out, [])
+        self.assertEqual(p.get_cache().disk_usage()[0], 2)
+
+
+class WriteFailureTest(QuietTestCase):
+
+    def test_unwritten_source(self):
+        """
+        A file whose source can't be written out failed, and is decompiled
+        again by a resumed run
+        """
+        mod_dir = self.write_module("mod_a", "x = 1\n")
+
+        p = pyREtic.pyREtic(write_source = True, project_name = "test",
+                            project_root = self.tmp_dir)
+        location = p._source_location(mod_dir, "mod_a.pyc", "fs_um")[1]
+        os.makedirs(location)
+
+        summary = p.fs_unmarshal(mod_dir)
+        self.assertEqual(summary.decompiled, [])
+        self.assertEqual([f for (f, reason) in summary.failures],
+                         [os.path.join(mod_dir, "mod_a.pyc")])
+
+        manifest = pyREtic.RunManifest(p.get_manifest_path())
+        self.assertEqual([e[0] for e in manifest.entries.values()],
+                         [pyREtic.RunManifest.FAILED])
+
+        os.rmdir(location)
+        summary = p.fs_unmarshal(mod_dir, resume = True)
+        self.assertEqual(summary.skipped, 0)
+        self.assertEqual(summary.decompiled, [os.path.join(mod_dir, "mod_a.pyc")])
+        self.assertTrue(os.path.isfile(location))
+
+
+class ArchiveTest(QuietTestCase):
+
+    def write_archive(self):
+        """
+        Return:
+               path of a zip archive holding mod_a.pyc
+        """
+        mod_dir  = self.write_module("mod_a", "x = 1\n")
+        location = os.path.join(self.tmp_dir, "modules.zip")
+        zf = zipfile.ZipFile(location, "w")
+        zf.write(os.path.join(mod_dir, "mod_a.pyc"), "mod_a.pyc")
+        zf.close()
+        return location
+
+
+    def test_closed_after_dry_run(self):
+        """
+        A dry run leaves no archive open to be read at stale offsets later
+        """
+        location = self.write_archive()
+        p = pyREtic.pyREtic(write_source = False, project_name = "test",
+                            project_root = self.tmp_dir)
+
+        files = p.fs_unmarshal(location, dry_run = True, resume = True)
+        self.assertEqual(len(files), 1)
+        self.assertEqual(pyREtic._ARCHIVES, {})
+
+
+    def test_closed_after_error(self):
+        """
+        Archives are closed when the walk is stopped by an exception
+        """
+        location = self.write_archive()
+        p = pyREtic.pyREtic(write_source = False, project_name = "test",
+                            project_root = self.tmp_dir)
+
+        def fail(*args):
+            raise RuntimeError("walk stopped")
+        p._fs_unmarshal_walk = fail
+        pyREtic._member_stat(location, "mod_a.pyc")
+
+        self.assertRaises(RuntimeError, p.fs_unmarshal, location)
+        self.assertEqual(pyREtic._ARCHIVES, {})
+
+
+class StructureTest(QuietTestCase):
+
+    def test_merged_node_name(self):
+        """
+        The nodes of a short circuit condition merge into one named after both,
+        as shown in the output of an unstructured graph
+        """
+        pyREtic.pyREtic(write_source = False, project_name = "test",
+                        project_root = self.tmp_dir)
+        from Decompilers.unpyc import structure, ast
+
+        ##if c0 and c1: <2>, then <3>
+        nodes = {}
+        for n in range(4):
+            nodes[n] = structure.node(n, structure.incomingEdges(),
+                                      structure.outgoingEdges(),
+                                      conditional = n < 2,
+                                      condition = ast.Variable("c%d"%(n)),
+                                      offset = n)
+        for (a, b, kind) in ((0, 1, "t"), (0, 3, "f"), (1, 2, "t"),
+                             (1, 3, "f"), (2, 3, "")):
+            nodes[a].outgoing.append(structure.edge(a, b, kind))
+            nodes[b].incoming.append(structure.edge(a, b, kind))
+
+        g = structure.graph(0, nodes, False)
+        g.simplifyComplexIFs()
+        self.assertEqual(g.root, "0&1")
+        self.assertEqual(sorted(g.nodes.keys()), [2, 3, "0&1"])
+
+
+class KeptBlocksTest(QuietTestCase):
+
+    def test_decompile_again(self):
+        """
+        Decompiling a code object again in the same run takes every basic block
+        from the first time and gives the same source
+        """
+        pyREtic.pyREtic(write_source = False, project_name = "test",
+                        project_root = self.tmp_dir)
+        from Decompilers.unpyc import cache, disasm, decompile, liveUnPYC
+
+        f_code = compile(SHARED_FUNCTION, "shared", "exec").co_consts[0]
+        co = liveUnPYC.CoParser(f_code).co
+        seen = cache.SeenCode()
+
+        first = decompile.Decompiler(disasm.Disassembler(co, optimizeJumps = True),
+                                     seen = seen)
+        source = first.decompile()
+        self.assertEqual(source.count("for i in g(a, "), 30)
+        self.assertEqual(first.keptBlocks, 0)
+
+        blocks = len(seen.kept_blocks(seen.key(co)))
+        self.assertTrue(blocks > 30)
+
+        again = decompile.Decompiler(disasm.Disassembler(co, optimizeJumps = True),
+                                     seen = seen)
+        self.assertEqual(again.decompile(), source)
+        self.assertEqual(again.keptBlocks, blocks)
+
+        ##Once the source is stored copies are given that instead
+        seen.store(seen.key(co), source)
+        self.assertEqual(seen.blocks, {})
+
+
+class OpcodeSwapTest(QuietTestCase):
+
+    def test_swap_after_disassembly(self):
+        """
+        Commands disassembled with one opcode table are shown and decompiled
+        with it, whatever table is swapped in afterwards
+        """
+        pyREtic.pyREtic(write_source = False, project_name = "test",
+                        project_root = self.tmp_dir)
+        from Decompilers.unpyc import optable, disasm, decompile, liveUnPYC
+
+        ##return a < b, in the bytecode of the Python 2.6 table UnPyc ships with
+        f_code = compile("def f(a, b):\n    return a < b\n", "f", "exec").co_consts[0]
+        f_code = types.CodeType(2, 2, 2, f_code.co_flags,
+                                "|\x00\x00|\x01\x00j\x00\x00S", (None,), (),
+                                ("a", "b"), "f", "f", 1, "")
+        co = liveUnPYC.CoParser(f_code).co
+        da = disasm.Disassembler(co, optimizeJumps = True)
+        listing = da.codeDisasm()
+        source = decompile.Decompiler(da).decompile()
+        self.assertTrue("a < b" in source)
+
+        opcodes = optable.opcodes
+        table, cmp_op = opcodes.opcodes, opcodes.cmp_op
+        swapped = {}
+        for (op, entry) in table.items():
+            swapped[op] = (entry[0], entry[1], "swapped in later")
+        opcodes.opcodes = swapped
+        opcodes.cmp_op = dict([(arg, "swapped") for arg in cmp_op.keys()])
+        try:
+            self.assertEqual(optable.active().cmp_op, opcodes.cmp_op)
+            self.assertEqual(da.codeDisasm(), listing)
+            self.assertEqual(decompile.Decompiler(da).decompile(), source)
+        finally:
+            opcodes.opcodes, opcodes.cmp_op = table, cmp_op
+            optable.active()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -18,11 +18,407 @@ __version__= "0.5.1"
 import os
 import os.path
 import sys
+import time
 import shutil
+import fnmatch
+import zipfile
+import traceback
+
+##Process pools are only available from 2.6 onwards, fall back to serial
+## decompilation if the runtime we are injected into doesn't have them
+try:
+    import multiprocessing
+    CAN_MULTIPROCESS = True
+except ImportError:
+    CAN_MULTIPROCESS = False
+
+##Runtimes built without thread support write output on the decompiling thread
+try:
+    import threading
+    import Queue
+    CAN_THREAD = True
+except ImportError:
+    CAN_THREAD = False
 
 ##Allows easy relative writes to the location this dir later
 MODULE_LOCATION = os.path.dirname(__file__)
 
+##liveUnPYC instance private to each pool worker process, see _pool_init
+_WORKER_LUPC = None
+
+##Archives opened by this process - path : ZipFile, see _read_member
+_ARCHIVES = {}
+
+
+def _read_member(archive, member):
+    """
+    Read a member of a zip/egg archive straight into memory, keeping the
+    archive open for the members that follow
+    """
+    if archive not in _ARCHIVES:
+        _ARCHIVES[archive] = zipfile.ZipFile(archive)
+    return _ARCHIVES[archive].read(member)
+
+
+def _member_stat(archive, member):
+    """
+    Return:
+           (mtime, size) of a member of a zip/egg archive, as os.stat would
+           give for a file on the filesystem
+    """
+    if archive not in _ARCHIVES:
+        _ARCHIVES[archive] = zipfile.ZipFile(archive)
+    zi = _ARCHIVES[archive].getinfo(member)
+    return (int(time.mktime(zi.date_time + (0, 0, -1))), zi.file_size)
+
+
+def _close_archives():
+    
+    for zf in _ARCHIVES.values():
+        zf.close()
+    _ARCHIVES.clear()
+
+
+def _unmarshal_one(lupc, path, pyx, archive = None, member = None):
+    """
+    Decompile a single .pyc/.pyo via unmarshalling, never raising
+    
+    archive, member - zip archive and the name of the .pyc/.pyo within it, for
+                      a file that is not on the filesystem
+    
+    Return:
+           (path, pyx, sourcecode, error, info) - error is None on success,
+           info is liveUnPYC.take_run_info() for this file plus the seconds
+           it took as 'duration'
+    """
+    start = time.time()
+    error = None
+    try:
+        if archive:
+            sc = lupc.bytes_decompile(_read_member(archive, member),
+                                      "%s/%s"%(archive, member))
+        else:
+            sc = lupc.fs_decompile(os.path.join(path, pyx))
+        if not sc:
+            sc, error = "", "no source code produced"
+    except Exception, err:
+        sc, error = "", "%s\n%s"%(err, traceback.format_exc())
+    
+    info = lupc.take_run_info()
+    info["duration"] = time.time() - start
+    
+    return (path, pyx, sc, error, info)
+
+
+def _pool_init(libs_dir, cache_dir, cache_max_size, time_stages, budget):
+    """
+    Run once as each worker process starts. Put the project libs dir first on
+    the path and reload opcodes.py so the project's (possibly remapped) opcode
+    table is the one used by every decompilation in this worker
+    
+    cache_dir   - project decompilation cache to share, None for no cache
+    time_stages - record per stage timings, see Decompilers/unpyc/timing.py
+    budget      - (seconds, steps) allowed to structure each code object
+    """
+    global _WORKER_LUPC
+    
+    if libs_dir in sys.path:
+        sys.path.remove(libs_dir)
+    sys.path.insert(0, libs_dir)
+    
+    import opcodes
+    reload(opcodes)
+    
+    from Decompilers.unpyc import liveUnPYC as live
+    _WORKER_LUPC = live.liveUnPYC(None)
+    _WORKER_LUPC.budget.seconds, _WORKER_LUPC.budget.steps = budget
+    
+    if cache_dir:
+        from Decompilers.unpyc import cache
+        _WORKER_LUPC.cache = cache.DecompileCache(cache_dir, cache_max_size)
+        
+    if time_stages:
+        from Decompilers.unpyc import timing
+        timing.enable()
+    
+    
+def _pool_unmarshal(task):
+    """
+    Worker side of the process pool - decompile one (path, pyx, archive, member) task
+    
+    Return:
+           (result of _unmarshal_one, cache counters, timing records) - the
+           counters & records only cover this task
+    """
+    from Decompilers.unpyc import timing
+    
+    res = _unmarshal_one(_WORKER_LUPC, *task)
+    
+    cache_stats = {}
+    if _WORKER_LUPC.cache:
+        cache_stats = _WORKER_LUPC.cache.take_stats()
+        
+    return (res, cache_stats, timing.take_records())
+
+
+def _pool_nested(task):
+    """
+    Worker side of the nested pool - decompile one (marshalled code object,
+    offset) task for the liveUnPYC.nested_map of the parent process
+    
+    Return:
+           (source or None, run info, timing records) - the info & records
+           only cover this task
+    """
+    from Decompilers.unpyc import timing
+    
+    sc = _WORKER_LUPC.nested_decompile(*task)
+    
+    return (sc, _WORKER_LUPC.take_run_info(), timing.take_records())
+
+
+class RunSummary:
+    """
+    Per-file outcome of a filesystem decompilation run, so a bad file is
+    reported at the end rather than stopping the whole run
+    """
+    def __init__(self):
+        
+        self.decompiled = []
+        self.failures   = []
+        
+        ##Decompilations avoided by reusing identical code objects
+        self.saved      = 0
+        
+        ##(filename, code object, reason) that ran out of structuring budget
+        self.timed_out  = []
+        
+        ##Files not decompiled again as a resumed run found them complete
+        self.skipped    = 0
+        
+    def add_success(self, filename):
+        
+        self.decompiled.append(filename)
+        
+    def add_failure(self, filename, reason):
+        
+        self.failures.append((filename, reason))
+        
+    def add_info(self, filename, info):
+        """
+        Add the liveUnPYC.take_run_info() of a file
+        """
+        self.saved += info["saved"]
+        for (name, reason) in info["timed_out"]:
+            self.timed_out.append((filename, name, reason))
+        
+    def display(self):
+        """
+        Print the summary to stdout
+        """
+        print "[+] Run complete: %d decompiled, %d failed"%(len(self.decompiled),
+                                                           len(self.failures))
+        if self.skipped:
+            print "[+] %d files skipped as already complete in the manifest"%(self.skipped)
+        print "[+] %d decompilations saved by reusing identical code objects"%(self.saved)
+        for filename, reason in self.failures:
+            print "[-] %s : %s"%(filename, reason.split("\n")[0])
+        if self.timed_out:
+            print "[!] %d code objects ran out of budget and were left unstructured:"%(len(self.timed_out))
+        for filename, name, reason in self.timed_out:
+            print "[!] %s : %s - %s"%(filename, name, reason)
+
+
+class BackgroundWriter:
+    """
+    Run output jobs (writing source files, manifest records) in order on a
+    thread of their own, so decompilation is not held up by disk I/O
+    
+    The queue is bounded, if the disk can't keep up the decompiler waits
+    rather than finished source piling up in memory
+    """
+    def __init__(self, max_queued = 256):
+        
+        self.queue  = Queue.Queue(max_queued)
+        self.thread = threading.Thread(target = self._run)
+        self.thread.setDaemon(True)
+        self.thread.start()
+        
+    def put(self, func, *args):
+        """
+        Queue func(*args) to be run on the writer thread
+        """
+        self.queue.put((func, args))
+        
+    def _run(self):
+        
+        while True:
+            job = self.queue.get()
+            if job is None:
+                break
+            func, args = job
+            try:
+                func(*args)
+            except Exception, err:
+                print "[-] Problem writing output : %s"%(err)
+                
+    def close(self):
+        """
+        Wait for everything queued to be written & stop the thread
+        """
+        self.queue.put(None)
+        self.thread.join()
+
+
+class RunManifest:
+    """
+    Record of every file a filesystem run has processed, appended to as each
+    file finishes so that a run which dies part way through can be resumed
+    without decompiling the files already done again
+    
+    One line per file: status, seconds taken, mtime, size & path, tab
+    separated. Later lines for a path replace earlier ones
+    """
+    COMPLETE = "complete"
+    PARTIAL  = "partial"
+    FAILED   = "failed"
+    
+    def __init__(self, location):
+        
+        self.location = location
+        
+        ##path : (status, duration, mtime, size)
+        self.entries  = {}
+        
+        self.f        = None
+        
+        self.load()
+        
+    def load(self):
+        """
+        Read the entries written by earlier runs, a line left half written by
+        a run that was killed is ignored
+        """
+        self.entries = {}
+        try:
+            f = open(self.location, "r")
+        except IOError:
+            return
+        
+        try:
+            for line in f:
+                if not line.endswith("\n"):
+                    break
+                try:
+                    status, duration, mtime, size, path = line[:-1].split("\t", 4)
+                    self.entries[path] = (status, float(duration), int(mtime), int(size))
+                except ValueError:
+                    continue
+        finally:
+            f.close()
+            
+    def is_complete(self, path, mtime, size):
+        """
+        Return:
+               True if the path was completely decompiled and has not changed since
+        """
+        if path not in self.entries or mtime < 0:
+            return False
+        
+        status, duration, old_mtime, old_size = self.entries[path]
+        return status == self.COMPLETE and (old_mtime, old_size) == (mtime, size)
+    
+    def record(self, path, mtime, size, status, duration):
+        """
+        Append the outcome of a file, flushed straight away so it survives the
+        run being killed
+        """
+        if "\n" in path:
+            ##Can't be represented, will just be decompiled again on resume
+            return
+        
+        if not self.f:
+            self.f = open(self.location, "a")
+        self.f.write("%s\t%.3f\t%d\t%d\t%s\n"%(status, duration, mtime, size, path))
+        self.f.flush()
+        
+        self.entries[path] = (status, duration, mtime, size)
+        
+    def close(self):
+        
+        if self.f:
+            self.f.close()
+            self.f = None
+
+
+class WalkFilter:
+    """
+    Decide which parts of a tree a filesystem walk goes into, so directories
+    that aren't wanted (test suites, vendored packages ...) are pruned before
+    they are descended into rather than walked and decompiled for nothing
+    
+    depth   - levels of subdirectories below the root to go into, 0 for just
+              the files in the root, None for no limit
+    include - glob patterns, when given only files matching one, or inside a
+              directory matching one, are decompiled
+    exclude - glob patterns of files & directories to skip entirely
+    
+    Patterns are matched against the name and against the path relative to the
+    root with / as the separator, e.g. 'test*' or 'vendor/*/tests'
+    """
+    def __init__(self, depth = None, include = None, exclude = None):
+        
+        self.depth   = depth
+        self.include = include or []
+        self.exclude = exclude or []
+        
+    def _match(self, relpath, patterns):
+        
+        name = relpath.split("/")[-1]
+        for pattern in patterns:
+            if fnmatch.fnmatch(name, pattern) or fnmatch.fnmatch(relpath, pattern):
+                return True
+        return False
+    
+    def descend(self, reldir):
+        """
+        Return:
+               True if the directory (relative to the root) should be walked into
+        """
+        if self.depth is not None and len(reldir.split("/")) > self.depth:
+            return False
+        return not self._match(reldir, self.exclude)
+    
+    def wanted(self, relpath):
+        """
+        Return:
+               True if a file (relative to the root) in a directory that was
+               walked into should be processed
+        """
+        if self._match(relpath, self.exclude):
+            return False
+        if not self.include:
+            return True
+        
+        parts = relpath.split("/")
+        for i in range(1, len(parts) + 1):
+            if self._match("/".join(parts[:i]), self.include):
+                return True
+        return False
+    
+    def wanted_member(self, relpath):
+        """
+        Return:
+               True if an archive member should be processed, archives list
+               every member so the directories it is in are checked here
+        """
+        parts = relpath.split("/")
+        for i in range(1, len(parts)):
+            if not self.descend("/".join(parts[:i])):
+                return False
+        return self.wanted(relpath)
+
+
 class pyREtic:
     """
     Main pyREtic decompilation functionality
@@ -30,13 +426,23 @@ class pyREtic:
     as well as the way in which the bytecode is obtained (via unmarshalling or importing)
     """
     def __init__(self, write_source = True, display_source = False,
-                 project_name = "default", project_root = None, decompiler = "unpyc"):
+                 project_name = "default", project_root = None, decompiler = "unpyc",
+                 use_cache = True, budget_seconds = 300, budget_steps = None):
         """
         Set project name and where to dump the code produced
         """        
         ##What is the decompiler we are using
         self.decompiler = decompiler
         
+        ##Reuse source of code objects decompiled in earlier runs, see get_cache
+        self.use_cache = use_cache
+        self.cache     = None
+        
+        ##Limits on structuring the control flow of any one code object, so a
+        ## pathological function can't stall a whole run. None for no limit
+        self.budget_seconds = budget_seconds
+        self.budget_steps   = budget_steps
+        
         if not project_root:
             self.project_root = os.path.join(MODULE_LOCATION, "Projects" )
         else:
@@ -62,6 +468,16 @@ class pyREtic:
         self.write_sourcecode   = write_source        
         self.display_sourcecode = display_source  
         
+        ##Output dirs known to exist, saves a makedirs() per file written
+        self.made_dirs = {}
+        
+        ##BackgroundWriter while a filesystem run is in progress, see _output
+        self.writer    = None
+        
+        ##Worker processes decompiling the functions of a module during a
+        ## filesystem run, see _start_nested_pool
+        self.nested_pool = None
+        
         
     def _quiet_makedir(self, dirname):
         """
@@ -207,6 +623,34 @@ class pyREtic:
         Get where the source code dump is 
         """
         return self.dump_dir
+    
+    
+    def get_cache_dir(self):
+        """
+        Get where the decompilation cache for the project is
+        """
+        return os.path.join(self.project_dir, "cache")
+    
+    
+    def get_manifest_path(self):
+        """
+        Get where the record of files processed by filesystem runs in the project is
+        """
+        return os.path.join(self.project_dir, "manifest")
+    
+    
+    def get_cache(self):
+        """
+        Get the decompilation cache of the current project, reopened if the
+        project has been switched since it was last used
+        """
+        #TODO - make decompiler independent
+        from Decompilers.unpyc import cache
+        
+        if not self.cache or self.cache.cache_dir != self.get_cache_dir():
+            self.cache = cache.DecompileCache(self.get_cache_dir())
+            
+        return self.cache
         
     
     def init_project(self, py_ver):
@@ -224,6 +668,7 @@ class pyREtic:
             ##Create dir structure on fs
             self._quiet_makedir(os.path.join(self.get_projectdir(), "sourcecode") )
             self._quiet_makedir(os.path.join(self.get_projectdir(), "pybs") )
+            self._quiet_makedir(os.path.join(self.get_projectdir(), "cache") )
             self._quiet_makedir(os.path.join(self.get_projectdir(), "libs") )
             
             ##Create __init__.py's for dirs from which imports may occur
@@ -297,14 +742,34 @@ class pyREtic:
         self.dump_dir     = os.path.join(self.prev_project_dir, "sourcecode")
         
     
-    def fs_unmarshal(self, fs_root, depth=None):
+    def fs_unmarshal(self, fs_root, depth=None, workers=1, resume=False,
+                     include=None, exclude=None, dry_run=False, nested=1):
         """
         Walk the filesystem from start directory indicated & to a depth inidicated
         
         The unmarshal technique will be used on each .pyc/.pyo found
+        
+        fs_root can also be a zip archive (e.g. a py2exe library.zip or an egg),
+        the .pyc/.pyo members are decompiled without extracting them and the
+        source written out in the same layout as inside the archive
+        
+        workers - number of processes to decompile a directory with, 1 to
+                  decompile everything in this process
+        resume  - skip files the project manifest has as completely decompiled
+                  by an earlier run, unless they have changed since
+        depth, include, exclude - limit what is walked, see WalkFilter
+        dry_run - only list & count what would be decompiled
+        nested  - number of processes to decompile the functions of each
+                  module with, so one huge module uses more than one core.
+                  Not used when files are already spread over workers
+        
+        Return:
+               RunSummary for a directory or archive, None for a single file,
+               the files that would be decompiled for a dry run
         """
-        #TODO depth, make decompiler independent
+        #TODO make decompiler independent
         from Decompilers.unpyc import liveUnPYC as live
+        from Decompilers.unpyc import timing
         
         tag = "fs_um"
         self._quiet_makedir(os.path.join(self.dump_dir, tag))
@@ -313,11 +778,18 @@ class pyREtic:
         
         fs_root = self.normalise_path(fs_root)
 
+        archive = os.path.isfile(fs_root) and zipfile.is_zipfile(fs_root)
+        
         ##Single file supplied no need to walk the directory
-        if os.path.isfile(fs_root):
+        if os.path.isfile(fs_root) and not archive:
             
             print "[+] Decompiling single file: %s"%(fs_root)
-            sc   = lupc.fs_decompile(fs_root)
+            self._start_nested_pool(lupc, nested)
+            try:
+                sc = lupc.fs_decompile(fs_root)
+            finally:
+                self._stop_nested_pool(lupc)
+            self._report_timeouts(lupc)
             
             ##Do the output style specified
             if self.write_sourcecode:
@@ -329,18 +801,287 @@ class pyREtic:
              
             
         else:
-            print "[+] Decompiling directory starting at: %s"%(fs_root)
-            for (path, dirs, pyx) in self._fs_walk(fs_root, depth, tag):
+            walk_filter = WalkFilter(depth, include, exclude)
+            if dry_run:
+                return self._fs_dry_run(fs_root, archive, walk_filter, resume, tag)
+            
+            summary  = RunSummary()
+            manifest = RunManifest(self.get_manifest_path())
+            
+            self._start_writer()
+            try:
+                self._fs_unmarshal_walk(fs_root, archive, walk_filter, workers,
+                                        resume, lupc, tag, summary, manifest,
+                                        nested)
+            finally:
+                self._stop_nested_pool(lupc)
+                ##Everything queued is on disk before the manifest is closed
+                self._stop_writer()
+                manifest.close()
+                ##A ZipFile left open keeps the member offsets of the archive
+                ## as it was, stale if it is rebuilt before the next run
+                _close_archives()
+                
+            summary.display()
+            if timing.ENABLED:
+                timing.report()
+            return summary
+        
+        
+    def _unmarshal_tasks(self, fs_root, archive, walk_filter, tag, sources = None):
+        """
+        Return:
+               (path, pyx, archive, member) for each .pyc/.pyo to decompile in
+               a directory or archive, see _fs_walk for sources
+        """
+        if archive:
+            print "[+] Decompiling archive: %s"%(fs_root)
+            return self._archive_walk(fs_root, tag, walk_filter, sources)
+        
+        print "[+] Decompiling directory starting at: %s"%(fs_root)
+        return [(path, pyx, None, None) for (path, dirs, pyx) in \
+                self._fs_walk(fs_root, walk_filter, tag, sources)]
+    
+    
+    def _task_stats(self, tasks):
+        """
+        Return:
+               {path : (mtime, size)} of the file each task decompiles
+        """
+        stats = {}
+        for (path, pyx, archive, member) in tasks:
+            stats[os.path.join(path, pyx)] = self._task_stat(path, pyx, archive, member)
+        return stats
+    
+    
+    def _resume_tasks(self, tasks, stats, manifest):
+        """
+        Return:
+               (tasks still to do, number already complete in the manifest)
+        """
+        todo = []
+        for task in tasks:
+            filename = os.path.join(task[0], task[1])
+            if not manifest.is_complete(filename, *stats[filename]):
+                todo.append(task)
+        return (todo, len(tasks) - len(todo))
+    
+    
+    def _fs_dry_run(self, fs_root, archive, walk_filter, resume, tag):
+        """
+        List & count what fs_unmarshal would decompile without decompiling or
+        writing anything
         
-                print "[+] Decompiling via unmarshal '%s'...."%(pyx)
-                sc   = lupc.fs_decompile(os.path.join(path,pyx))
+        Return:
+               paths of the files that would be decompiled
+        """
+        sources = []
+        skipped = 0
+        try:
+            tasks = self._unmarshal_tasks(fs_root, archive, walk_filter, tag, sources)
+            if resume:
+                tasks, skipped = self._resume_tasks(tasks, self._task_stats(tasks),
+                                                    RunManifest(self.get_manifest_path()))
+        finally:
+            _close_archives()
+            
+        files = [os.path.join(path, pyx) for (path, pyx, arc, member) in tasks]
+        for filename in files:
+            print "[=] %s"%(filename)
+            
+        print "[+] Dry run: %d files would be decompiled, %d .py files copied"%(len(files),
+                                                                             len(sources))
+        if resume:
+            print "[+] %d files skipped as already complete in the manifest"%(skipped)
+        return files
+    
+    
+    def _fs_unmarshal_walk(self, fs_root, archive, walk_filter, workers, resume,
+                           lupc, tag, summary, manifest, nested):
+        """
+        Decompile every .pyc/.pyo of a directory or archive for fs_unmarshal,
+        filling in the summary & manifest
+        """
+        tasks = self._unmarshal_tasks(fs_root, archive, walk_filter, tag)
+        
+        ##path : (mtime, size) as it was when the file was decompiled
+        stats = self._task_stats(tasks)
+            
+        if resume:
+            tasks, summary.skipped = self._resume_tasks(tasks, stats, manifest)
+            print "[+] Resuming, %d files already complete"%(summary.skipped)
+        
+        if workers > 1 and not CAN_MULTIPROCESS:
+            print "[-] multiprocessing module unavailable, decompiling in a single process"
+            
+        if workers > 1 and CAN_MULTIPROCESS:
+            if nested > 1:
+                ##Pool workers cannot start pools of their own
+                print "[-] Files are decompiled by %d worker processes, nested=%d not used"%(workers,
+                                                                                           nested)
+            results = self._pool_unmarshal(tasks, workers)
+        else:
+            self._start_nested_pool(lupc, nested)
+            results = self._serial_unmarshal(lupc, tasks)
+            
+        ##Results arrive in walk order whichever way they were produced
+        for (path, pyx, sc, err, info) in results:
+            
+            filename = os.path.join(path, pyx)
+            mtime, size = stats[filename]
+            
+            summary.add_info(filename, info)
+            if err:
+                summary.add_failure(filename, err)
+                self._output(manifest.record, filename, mtime, size,
+                             RunManifest.FAILED, info["duration"])
+                continue
+            
+            if self.display_sourcecode:
+                self._display_source(sc)
                 
-                ##Do the output style specified
-                if self.write_sourcecode:
-                    self._write_source(sc, path, pyx, tag)
-                    
-                if self.display_sourcecode:
-                    self._display_source(sc)
+            ##Code objects left unstructured are worth another go with a
+            ## bigger budget
+            if info["timed_out"]:
+                status = RunManifest.PARTIAL
+            else:
+                status = RunManifest.COMPLETE
+                
+            ##Do the output style specified, the write and the record are one
+            ## job so a file is only a success once its source is out
+            write = None
+            if self.write_sourcecode:
+                write = (sc,) + self._source_location(path, pyx, tag)
+            self._output(self._record_file, summary, manifest, filename,
+                         mtime, size, status, info["duration"], write)
+    
+    
+    def _record_file(self, summary, manifest, filename, mtime, size, status,
+                     duration, write = None):
+        """
+        Write out the source of a decompiled file then record the outcome in
+        the summary & manifest, a file whose source could not be written
+        failed
+        
+        write - (sourcecode, dump_dir, location) for _write_file, None if the
+                source is not written out
+        """
+        if write:
+            err = self._write_file(*write)
+            if err:
+                summary.add_failure(filename, err)
+                manifest.record(filename, mtime, size, RunManifest.FAILED, duration)
+                return
+            
+        summary.add_success(filename)
+        manifest.record(filename, mtime, size, status, duration)
+    
+    
+    def _task_stat(self, path, pyx, archive, member):
+        """
+        Return:
+               (mtime, size) of the file a task decompiles, (-1, -1) if unknown
+        """
+        try:
+            if archive:
+                return _member_stat(archive, member)
+            st = os.stat(os.path.join(path, pyx))
+            return (int(st.st_mtime), st.st_size)
+        except (OSError, KeyError), err:
+            return (-1, -1)
+        
+        
+    def _report_timeouts(self, lupc):
+        """
+        Print the code objects that ran out of structuring budget in a single
+        object decompile, directory runs report these in their RunSummary
+        """
+        for (name, reason) in lupc.take_run_info()["timed_out"]:
+            print "[!] %s : %s - left unstructured"%(name, reason)
+            
+            
+    def _serial_unmarshal(self, lupc, tasks):
+        """
+        Decompile each (path, pyx, archive, member) task in this process,
+        yielding results in order
+        """
+        for task in tasks:
+            
+            print "[+] Decompiling via unmarshal '%s'...."%(task[1])
+            yield _unmarshal_one(lupc, *task)
+            
+            
+    def _pool_unmarshal(self, tasks, workers):
+        """
+        Farm each (path, pyx, archive, member) task out to a pool of worker processes, yielding
+        results in the same order as the tasks were given
+        """
+        print "[+] Decompiling %d files with %d worker processes"%(len(tasks), workers)
+        
+        #TODO - make decompiler independent
+        from Decompilers.unpyc import timing
+        
+        cache, init_args = self._pool_init_args()
+        pool = multiprocessing.Pool(workers, _pool_init, init_args)
+        try:
+            for (res, cache_stats, timings) in pool.imap(_pool_unmarshal, tasks):
+                ##Keep the parents cache counters & timings covering the whole run
+                if cache:
+                    cache.add_stats(cache_stats)
+                timing.add_records(timings)
+                yield res
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        pool.join()
+
+
+    def _pool_init_args(self):
+        """
+        Return:
+               (project cache or None, arguments for _pool_init)
+        """
+        #TODO - make decompiler independent
+        from Decompilers.unpyc import timing
+        
+        if self.use_cache:
+            cache = self.get_cache()
+            return (cache, (self.get_project_mod_dir(), cache.cache_dir,
+                            cache.max_size, timing.ENABLED,
+                            (self.budget_seconds, self.budget_steps)))
+        
+        return (None, (self.get_project_mod_dir(), None, None, timing.ENABLED,
+                       (self.budget_seconds, self.budget_steps)))
+    
+    
+    def _start_nested_pool(self, lupc, workers):
+        """
+        Start a pool of worker processes that the functions of each module
+        lupc decompiles are handed out to, see liveUnPYC.nested_map
+        """
+        if workers < 2:
+            return
+        if not CAN_MULTIPROCESS:
+            print "[-] multiprocessing module unavailable, decompiling functions in a single process"
+            return
+        
+        print "[+] Decompiling the functions of each module with %d worker processes"%(workers)
+        
+        cache, init_args = self._pool_init_args()
+        pool = multiprocessing.Pool(workers, _pool_init, init_args)
+        
+        self.nested_pool = pool
+        lupc.nested_map  = lambda tasks: pool.map(_pool_nested, tasks)
+        
+        
+    def _stop_nested_pool(self, lupc):
+        
+        lupc.nested_map = None
+        if self.nested_pool:
+            self.nested_pool.close()
+            self.nested_pool.join()
+            self.nested_pool = None
 
                     
     def fs_objwalk(self, fs_root,  depth=None):
@@ -351,7 +1092,7 @@ class pyREtic:
         
         No access to unmarshaling required 
         """
-        #TODO depth, make decompiler independent
+        #TODO make decompiler independent
         from Decompilers.unpyc import liveUnPYC as live
         
         tag = "fs_obj"
@@ -368,7 +1109,9 @@ class pyREtic:
             print "[-] single file memory traversal not supported yet"
             return
         
-        for (path, dirs, pyx) in self._fs_walk(fs_root, depth, tag):
+        summary = RunSummary()
+        
+        for (path, dirs, pyx) in self._fs_walk(fs_root, WalkFilter(depth), tag):
             
             print "[+] Decompiling in-memory '%s'...."%(pyx)
             
@@ -412,7 +1155,12 @@ class pyREtic:
                 import traceback
                 print "[-] Error decompiling %s : %s"%(p_obj, err)
                 traceback.print_exc()
+                summary.add_info(os.path.join(path, pyx), lupc.take_run_info())
+                summary.add_failure(os.path.join(path, pyx), str(err))
                 continue
+            
+            summary.add_info(os.path.join(path, pyx), lupc.take_run_info())
+            summary.add_success(os.path.join(path, pyx))
     
             
             ##Do the output style specified
@@ -426,6 +1174,9 @@ class pyREtic:
             ##Keep syspath clean - remove what we added
             sys.path.remove(subpath) 
             
+        summary.display()
+        return summary
+            
                     
     def mem_objwalk(self, obj):
         """
@@ -445,6 +1196,7 @@ class pyREtic:
         ## decompiled .....may take a while
         lupc = live.liveUnPYC(self) 
         sc   = lupc.get_py(obj)
+        self._report_timeouts(lupc)
         
         ##Do the output style specified
         try:
@@ -484,23 +1236,41 @@ class pyREtic:
             
 
     
-    def _fs_walk(self, fs_root, depth, tag):
+    def _fs_walk(self, fs_root, walk_filter, tag, sources = None):
         """
         General function to walk a file system & yield up files which are pyc's
         
         Essentially walk & selectively yield path, dirs, file everything that matches
         criteria of .pyc or .pyo
         
-        for .py just shortcut and dump
+        for .py just shortcut and dump, or if a sources list is given just add
+        the path to it
+        
+        walk_filter - WalkFilter deciding which dirs & files are walked
         """
             
         print "[+] Walking filesystem from %s"%(fs_root)        
         for (path, dirs, files) in os.walk(fs_root):
             
-            for pyx in files:
+            reldir = path[len(fs_root):].strip(os.sep).replace(os.sep, "/")
+            if reldir:
+                reldir += "/"
+                
+            ##Prune before os.walk descends, keeping the order stable between
+            ## runs/platforms
+            dirs[:] = [d for d in sorted(dirs) if walk_filter.descend(reldir + d)]
+            
+            for pyx in sorted(files):
+                
+                if not walk_filter.wanted(reldir + pyx):
+                    continue
                 
+                ##Only listing
+                if os.path.splitext(pyx)[1] == ".py" and sources is not None:
+                    sources.append(os.path.join(path, pyx))
+                    
                 ##If the file is .py just dump it's contents - go straight to output
-                if os.path.splitext(pyx)[1] == ".py":
+                elif os.path.splitext(pyx)[1] == ".py":
                     f_py = open(os.path.join(path,pyx), "rb")
                     sc = f_py.read()
                     f_py.close
@@ -530,15 +1300,107 @@ class pyREtic:
         print "\n\n",source,"\n\n"
                     
     
+    def _archive_walk(self, archive, tag, walk_filter = None, sources = None):
+        """
+        The zip archive equivalent of _fs_walk, returns (path, pyx, archive, member)
+        for each .pyc/.pyo member, where path is the archive path joined with
+        the directory of the member so output mirrors the archive layout
+        
+        .py members are just dumped (or listed in sources) as for _fs_walk
+        """
+        if not walk_filter:
+            walk_filter = WalkFilter()
+            
+        print "[+] Reading archive %s"%(archive)
+        tasks = []
+        
+        zf = zipfile.ZipFile(archive)
+        for member in sorted(zf.namelist()):
+            
+            parts = member.split("/")
+            
+            ##Directory entry
+            if not parts[-1]:
+                continue
+            
+            ##Never let a member name write outside of the dump dir
+            if member.startswith("/") or ".." in parts:
+                print "[-] Skipping archive member with unsafe path: %s"%(member)
+                continue
+            
+            if not walk_filter.wanted_member(member):
+                continue
+            
+            path = os.path.join(archive, *parts[:-1])
+            pyx  = parts[-1]
+            ext  = os.path.splitext(pyx)[1]
+            
+            if ext == ".py" and sources is not None:
+                sources.append(os.path.join(path, pyx))
+                
+            elif ext == ".py":
+                sc = zf.read(member)
+                
+                ##Do the output as specified
+                if self.write_sourcecode:
+                    self._write_source(sc, path, pyx, tag)
+                    
+                if self.display_sourcecode:
+                    self._display_source(sc)
+                    
+            elif ext == ".pyc" or ext == ".pyo":
+                
+                tasks.append((path, pyx, archive, member))
+                
+        zf.close()
+        return tasks
+            
+            
+    def _start_writer(self):
+        """
+        Hand output to a BackgroundWriter until _stop_writer is called
+        """
+        ##Dirs may have been removed between runs
+        self.made_dirs = {}
+        
+        if CAN_THREAD and not self.writer:
+            self.writer = BackgroundWriter()
+            
+            
+    def _stop_writer(self):
+        """
+        Wait for all queued output to be written
+        """
+        if self.writer:
+            self.writer.close()
+            self.writer = None
+            
+            
+    def _output(self, func, *args):
+        """
+        Run an output job, on the background writer if one is running
+        """
+        if self.writer:
+            self.writer.put(func, *args)
+        else:
+            func(*args)
+            
+            
     def _write_source(self, sourcecode, path, filename, tag):
         """
         Write the decompiled sourcecode to disk location
         """
+        dump_dir, location = self._source_location(path, filename, tag)
+        self._output(self._write_file, sourcecode, dump_dir, location)
+        
+        
+    def _source_location(self, path, filename, tag):
+        """
+        Return:
+               (dump_dir, location) the source of a .pyc/.pyo is written to
+        """
         dump_dir = os.path.join(self.dump_dir, tag, path.strip(os.sep))
             
-        #TODO - cleanup
-        self._quiet_makedir(dump_dir)
-
         location = os.path.join(dump_dir, filename)
         
         ext = os.path.splitext(location)[1]
@@ -547,13 +1409,31 @@ class pyREtic:
             location = location.replace(".pyc",".py")
         elif ext == ".pyo":
             location = location.replace(".pyo", ".py")
- 
+            
+        return (dump_dir, location)
+        
+        
+    def _write_file(self, sourcecode, dump_dir, location):
+        """
+        Write sourcecode to location, creating dump_dir the first time it's used
+        
+        Return:
+               None on success, else what went wrong
+        """
         try:
+            if dump_dir not in self.made_dirs:
+                self._quiet_makedir(dump_dir)
+                self.made_dirs[dump_dir] = True
+                
             f = open(location, "wb")
             f.write(sourcecode)
             f.close()
             print "[+] Source code written to: %s"%location
         except Exception, err:
-            print "[-] Problem writing sourcecode to %s [%s]"%(location, err)
+            problem = "Problem writing sourcecode to %s [%s]"%(location, err)
+            print "[-] %s"%(problem)
+            return problem
+        
+        return None
         
     
\ No newline at end of file